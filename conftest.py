@@ -2,6 +2,9 @@
 Module to add configuration used by various tests.
 """
 
+import pytest
+
+
 def pytest_addoption(parser):
     """
     Add options to py.test
@@ -15,3 +18,20 @@ def pytest_addoption(parser):
         "--live", action='store_true',
         help="Whether to run the consistency tests against a live server"
     )
+    group.addoption(
+        "--update-snapshots", action='store_true',
+        help="Save the snapshots of the generated pipelines, instead of checking against them"
+    )
+    group.addoption(
+        "--changed-since", metavar='REF', default=None,
+        help="Only test the scripts affected by changes since the git commit REF (except on the main branch)"
+    )
+
+
+def pytest_configure(config):
+    """
+    Reject option combinations that can't work together.
+    """
+    # Live runs save the config to the working directory, so parallel workers would overwrite each other's results.
+    if config.getoption('live') and getattr(config.option, 'numprocesses', None):
+        raise pytest.UsageError('--live cannot be combined with -n')
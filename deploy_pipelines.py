@@ -65,7 +65,34 @@ def print_failure_report(failures):
     default=False,
     is_flag=True
 )
-def run_pipelines(environment, config_file, script, verbose, dry_run, save_config_locally):
+@click.option(
+    '--config-repo-dir',
+    help='Write each pipeline to a config-repo file in this directory, instead of saving the server config.',
+    required=False,
+    default=None,
+)
+@click.option(
+    '--watch',
+    help='Keep running, and show how the pipelines differ from the server each time a source or variable file changes.',
+    default=False,
+    is_flag=True,
+)
+@click.option(
+    '--base-config',
+    help='With --watch, compare against this saved server config (such as config-before.xml) instead of the server.',
+    required=False,
+    default=None,
+    type=click.Path(dir_okay=False, exists=True),
+)
+@click.option(
+    '--encryption-cache',
+    envvar='GOCD_ENCRYPTION_CACHE',
+    help='With --watch, the local cache of encrypted secure variable values.',
+    default='.gocd_encryption_cache.json',
+    type=click.Path(dir_okay=False),
+)
+def run_pipelines(environment, config_file, script, verbose, dry_run, save_config_locally, config_repo_dir,
+                  watch, base_config, encryption_cache):
     """
 
     Args:
@@ -73,6 +100,10 @@ def run_pipelines(environment, config_file, script, verbose, dry_run, save_confi
         config_file (str): Path to the configuration file
         script (str): The script to run.
         verbose (bool): if true set the logging level to debug
+        config_repo_dir (str): if set, write config-repo files to this directory instead of saving the server config
+        watch (bool): if true, regenerate the scripts in-process as their files change, instead of deploying them
+        base_config (str): the server config to compare against when watching, instead of fetching it
+        encryption_cache (str): the cache of encrypted secure values used when watching
 
     Returns:
 
@@ -86,10 +117,18 @@ def run_pipelines(environment, config_file, script, verbose, dry_run, save_confi
         print "No scripts to run!"
         exit(1)
 
+    if watch:
+        from edxpipelines.watch import Watcher, load_base_config
+        base = load_base_config(scripts[0], base_config, encryption_cache)
+        Watcher(lambda: parse_config(environment, config_file, script), config_file, base).run()
+        exit(0)
+
     success = []
     failures = []
     for script in scripts:
         script_name = script.pop('script')
+        if config_repo_dir:
+            script['config-repo-dir'] = config_repo_dir
         try:
             ensure_pipeline(
                 script_name,
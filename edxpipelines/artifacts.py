@@ -0,0 +1,161 @@
+"""
+A registry of the artifacts published by the jobs in a configuration, kept up
+to date as pipelines are generated, so that fetches of artifacts can be
+checked (and artifacts located by name) as soon as the fetch is added.
+"""
+import os.path
+
+from edxpipelines.utils import ArtifactLocation
+
+
+class UnpublishedArtifact(Exception):
+    pass
+
+
+def artifact_paths(src, dest=None):
+    """
+    The paths that an artifact with source ``src``, uploaded to ``dest``, can be fetched from.
+    """
+    file_name = os.path.basename(src.rstrip('/'))
+    paths = {file_name}
+    if dest:
+        paths.add(os.path.join(dest, file_name))
+    return paths
+
+
+def is_published(source, paths):
+    """
+    Whether ``source`` is one of the artifact ``paths``, or inside one of them.
+    """
+    parts = source.strip('/').split('/')
+    return any('/'.join(parts[:length]) in paths for length in range(1, len(parts) + 1))
+
+
+def _fetch_source(element):
+    return element.get('srcfile') or element.get('srcdir')
+
+
+class ArtifactRegistry(object):
+    """
+    The artifacts published by each job of each pipeline in a configurator.
+
+    The artifacts of a pipeline are read from its xml the first time they're
+    needed, and kept up to date by ``publish`` and ``invalidate``.
+
+    Args:
+        find_pipeline (callable): returns the element of the pipeline with the given name, or None
+    """
+    def __init__(self, find_pipeline):
+        self._find_pipeline = find_pipeline
+        # Pipeline name -> (stage name, job name) -> the paths its artifacts can be fetched from.
+        self._pipelines = {}
+        # Fetches from pipelines that didn't exist when the fetch was added.
+        self._pending = []
+
+    def _jobs(self, pipeline_name):
+        """
+        The artifacts of the jobs of ``pipeline_name``, or None if there is no such pipeline.
+        """
+        if pipeline_name not in self._pipelines:
+            element = self._find_pipeline(pipeline_name)
+            if element is None:
+                return None
+            jobs = self._pipelines[pipeline_name] = {}
+            for stage in element.findall('stage'):
+                for job in stage.findall('jobs/job'):
+                    paths = jobs.setdefault((stage.get('name'), job.get('name')), set())
+                    for artifact in job.findall('artifacts/*'):
+                        paths.update(artifact_paths(artifact.get('src'), artifact.get('dest')))
+        return self._pipelines[pipeline_name]
+
+    def publish(self, pipeline_name, stage_name, job_name, src, dest=None):
+        """
+        Record an artifact that has been added to a job.
+        """
+        if pipeline_name in self._pipelines:
+            self._pipelines[pipeline_name].setdefault((stage_name, job_name), set()).update(artifact_paths(src, dest))
+
+    def invalidate(self, pipeline_name=None):
+        """
+        Forget the artifacts of ``pipeline_name`` (or of every pipeline), after it has changed.
+        """
+        if pipeline_name is None:
+            self._pipelines.clear()
+        else:
+            self._pipelines.pop(pipeline_name, None)
+
+    def forget_fetches(self, pipeline_name):
+        """
+        Stop checking the fetches added to ``pipeline_name``, after it has been emptied or removed.
+        """
+        self._pending = [(name, fetch) for name, fetch in self._pending if name != pipeline_name]
+
+    def _fetch_error(self, pipeline_name, fetch):
+        """
+        Why the ``fetch`` element in ``pipeline_name`` can't be satisfied, or None if it can
+        (or if the pipeline it fetches from is unknown).
+        """
+        # The pipeline may be a path from an ancestor, where the artifact is, down to a direct upstream pipeline.
+        upstream = (fetch.get('pipeline') or pipeline_name).split('/')[0]
+        jobs = self._jobs(upstream)
+        if jobs is None:
+            return None
+        location = '{}/{}/{}/{}'.format(upstream, fetch.get('stage'), fetch.get('job'), _fetch_source(fetch))
+        paths = jobs.get((fetch.get('stage'), fetch.get('job')))
+        if paths is None:
+            return 'pipeline {}: fetch of {} refers to a missing job'.format(pipeline_name, location)
+        if not is_published(_fetch_source(fetch), paths):
+            return 'pipeline {}: fetch of {} refers to an artifact that the job does not publish'.format(
+                pipeline_name, location
+            )
+        return None
+
+    def check_fetch(self, pipeline_name, fetch):
+        """
+        Check a fetchartifact element that has just been added to ``pipeline_name``.
+
+        Raises:
+            UnpublishedArtifact: if the pipeline it fetches from exists, and
+                doesn't publish the artifact. Fetches from pipelines that don't
+                exist (yet) are checked again by ``unresolved``.
+        """
+        upstream = (fetch.get('pipeline') or pipeline_name).split('/')[0]
+        if self._jobs(upstream) is None:
+            self._pending.append((pipeline_name, fetch))
+            return
+        error = self._fetch_error(pipeline_name, fetch)
+        if error is not None:
+            raise UnpublishedArtifact(error)
+
+    def unresolved(self):
+        """
+        Check the fetches from pipelines that didn't exist when they were added.
+
+        Returns:
+            list of str: the fetches of artifacts that aren't published, now that the
+                pipelines they fetch from exist. Fetches from pipelines that still
+                don't exist aren't included.
+        """
+        errors = (self._fetch_error(pipeline_name, fetch) for pipeline_name, fetch in self._pending)
+        return [error for error in errors if error is not None]
+
+    def locate(self, pipeline_name, file_name):
+        """
+        Find the job of ``pipeline_name`` that publishes ``file_name``.
+
+        Returns:
+            ArtifactLocation: where to fetch ``file_name`` from
+
+        Raises:
+            UnpublishedArtifact: if no job of the pipeline, or more than one, publishes the file
+        """
+        matches = sorted(
+            job for job, paths in (self._jobs(pipeline_name) or {}).items()
+            if is_published(file_name, paths)
+        )
+        if len(matches) != 1:
+            raise UnpublishedArtifact('{} is published by {} jobs of pipeline {}'.format(
+                file_name, len(matches) or 'no', pipeline_name,
+            ))
+        stage_name, job_name = matches[0]
+        return ArtifactLocation(pipeline_name, stage_name, job_name, file_name)
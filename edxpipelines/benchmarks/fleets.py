@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+"""
+Benchmark every step of a deploy over synthetic fleets of pipelines, from
+merging the variable files to checking the generated config.
+
+Each fleet is a ``config.yml`` with one entry per pipeline, the variable files
+it refers to, and a server config that already holds an older version of every
+pipeline. The pipelines are built with the same pattern as the IDA pipeline
+scripts, so the fleets grow the way the real config does.
+
+    python -m edxpipelines.benchmarks.fleets run --sizes 10,100,1000
+    python -m edxpipelines.benchmarks.fleets compare HEAD~1 HEAD
+
+Results are saved per commit in ``.benchmarks/<sha>.json``, so that the
+steps that regressed between two commits can be found with ``compare``.
+"""
+from collections import OrderedDict
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+from gomatic import GoCdConfigurator
+from gomatic.fake import FakeHostRestClient, empty_config_xml
+import gomatic
+import lxml.etree as ElementTree
+import yaml
+
+from edxpipelines import utils
+from edxpipelines.canonicalize import PARSER, canonicalize_gocd
+from edxpipelines.consistency import SystemIndex
+from edxpipelines.index import IndexedConfigurator
+from edxpipelines.patterns import pipelines
+from edxpipelines.validation import schema_errors
+
+RESULTS_DIR = '.benchmarks'
+STEPS = ('merge', 'install', 'serialize', 'canonicalize', 'diff', 'schema', 'references')
+
+ENVIRONMENTS = ('stage', 'prod', 'loadtest')
+DEPLOYMENTS = ('edx', 'edge', 'mckinsey')
+GROUP_SIZE = 50
+# Every nth pipeline is at a newer version than on the server, so that the diff isn't empty.
+CHANGED_EVERY = 10
+
+ADMIN_VARIABLES = {
+    'gocd_username': 'gocd', 'gocd_password': 'password', 'gocd_url': 'gocd.example.com',
+    'aws_access_key_id': 'access_key', 'aws_secret_access_key': 'secret_key',
+    'asgard_api_endpoints': 'https://asgard.example.com/api', 'asgard_token': 'asgard_token',
+    'hipchat_token': 'hipchat_token', 'github_private_key': 'private_key',
+    'tubular_url': 'https://github.com/edx/tubular.git',
+    'configuration_url': 'https://github.com/edx/configuration.git',
+    'ec2_vpc_subnet_id': 'subnet', 'ec2_security_group_id': 'security_group',
+    'ec2_instance_profile_name': 'instance_profile', 'base_ami_id': 'ami-00000000',
+}
+
+
+def _play(index):
+    return 'play{}'.format(index)
+
+
+def _fleet_entry(index):
+    """
+    The variables of the ``index``th pipeline, split into the files that config.yml would merge.
+    """
+    environment = ENVIRONMENTS[index % len(ENVIRONMENTS)]
+    deployment = DEPLOYMENTS[(index // len(ENVIRONMENTS)) % len(DEPLOYMENTS)]
+    play = _play(index)
+    return OrderedDict([
+        ('deployment-{}.yml'.format(deployment), {
+            'edx_deployment': deployment,
+            'configuration_secure_repo': 'git@github.com:edx/{}-secure.git'.format(deployment),
+            'configuration_internal_repo': 'git@github.com:edx/{}-internal.git'.format(deployment),
+        }),
+        ('{}-{}.yml'.format(environment, deployment), {
+            'edx_environment': environment,
+            'db_migration_pass': 'migration_password',
+        }),
+        ('play-{}.yml'.format(play), {
+            'play': play,
+            'pipeline_group': 'group{}'.format(index // GROUP_SIZE),
+            'app_repo': 'https://github.com/edx/{}.git'.format(play),
+            'app_destination_directory': play,
+        }),
+    ])
+
+
+def write_fleet(directory, size):
+    """
+    Write a config.yml for ``size`` pipelines, and the variable files it refers to, into ``directory``.
+
+    Returns:
+        str: the path of the config.yml
+    """
+    entries = []
+    files = {'admin.yml': ADMIN_VARIABLES}
+    for index in range(size):
+        variable_files = _fleet_entry(index)
+        files.update(variable_files)
+        entries.append({
+            'script': 'edxpipelines/pipelines/cd_{}.py'.format(_play(index)),
+            'enabled': True,
+            'variable_file': [os.path.join(directory, name) for name in ['admin.yml'] + variable_files.keys()],
+        })
+    for name, variables in files.items():
+        with open(os.path.join(directory, name), 'w') as variable_file:
+            yaml.safe_dump(variables, variable_file)
+    config_path = os.path.join(directory, 'config.yml')
+    with open(config_path, 'w') as config_file:
+        yaml.safe_dump({'tools': entries}, config_file)
+    return config_path
+
+
+def merge_fleet(config_path):
+    """
+    Merge the variable files of every entry in the fleet, as deploy_pipelines.py and the scripts do.
+    """
+    with open(config_path) as config_file:
+        entries = yaml.safe_load(config_file)['tools']
+    return [utils.merge_files_and_dicts(entry['variable_file'], []) for entry in entries]
+
+
+def install_fleet(configurator, configs, version='$GO_REVISION_APP'):
+    """
+    Generate the pipeline of each merged config, as the IDA pipeline scripts do.
+    """
+    for config in configs:
+        pipelines.generate_basic_multistage_pipeline(
+            configurator,
+            play=config['play'],
+            pipeline_group=config['pipeline_group'],
+            playbook_path='playbooks/edx-east/{}.yml'.format(config['play']),
+            app_repo=config['app_repo'],
+            service_name=config['play'],
+            hipchat_room='release',
+            config=config,
+            app_version=version,
+        )
+
+
+def server_config(configs):
+    """
+    A server config holding an older version of every pipeline in the fleet.
+    """
+    configurator = IndexedConfigurator(GoCdConfigurator(FakeHostRestClient(empty_config_xml)))
+    for index, config in enumerate(configs):
+        version = '$GO_REVISION_OLD' if index % CHANGED_EVERY == 0 else '$GO_REVISION_APP'
+        install_fleet(configurator, [config], version)
+    return configurator.config
+
+
+def _peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and in kilobytes elsewhere.
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def measure(size):
+    """
+    Time each step of a deploy of a fleet of ``size`` pipelines.
+
+    Memory is reported as the peak resident set size of the process after each
+    step, and the growth of that peak during the step, so it's only meaningful
+    in a fresh process (see ``run``).
+
+    Returns:
+        OrderedDict: step name -> {'seconds', 'peak_rss_kb', 'rss_growth_kb'}
+    """
+    directory = tempfile.mkdtemp()
+    results = OrderedDict()
+    state = {}
+
+    def step(name, function):
+        before = _peak_rss_kb()
+        start = time.time()
+        state[name] = function()
+        results[name] = {
+            'seconds': round(time.time() - start, 4),
+            'peak_rss_kb': _peak_rss_kb(),
+            'rss_growth_kb': _peak_rss_kb() - before,
+        }
+
+    def canonicalize():
+        paths = []
+        for name, xml in (('before.xml', before_xml), ('after.xml', state['serialize'])):
+            path = os.path.join(directory, name)
+            tree = ElementTree.ElementTree(ElementTree.fromstring(xml, parser=PARSER))
+            canonicalize_gocd(tree).write(path, pretty_print=True)
+            paths.append(path)
+        return paths
+
+    def diff():
+        # The same diff that deploy.ensure_pipeline shows for a dry run.
+        with open(os.devnull, 'w') as devnull:
+            subprocess.call(
+                ['git', '--no-pager', 'diff', '--no-index', '--color-words'] + state['canonicalize'],
+                stdout=devnull,
+            )
+
+    def install():
+        configurator = IndexedConfigurator(GoCdConfigurator(FakeHostRestClient(before_xml)))
+        install_fleet(configurator, state['merge'])
+        return configurator
+
+    try:
+        config_path = write_fleet(directory, size)
+        before_xml = server_config(merge_fleet(config_path))
+
+        step('merge', lambda: merge_fleet(config_path))
+        step('install', install)
+        step('serialize', lambda: state['install'].config)
+        step('canonicalize', canonicalize)
+        step('diff', diff)
+        step('schema', lambda: schema_errors(state['serialize']))
+        step('references', lambda: SystemIndex.from_configs([state['serialize']]).errors(check_artifacts=True))
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def run(sizes):
+    """
+    Measure each fleet size in a fresh process, so that the memory use of one doesn't hide another's.
+
+    Returns:
+        OrderedDict: fleet size (as a str) -> the results of ``measure``
+    """
+    results = OrderedDict()
+    for size in sizes:
+        pool = multiprocessing.Pool(processes=1, maxtasksperchild=1)
+        try:
+            results[str(size)] = pool.apply(measure, (size,))
+        finally:
+            pool.close()
+            pool.join()
+    return results
+
+
+def git_sha(ref='HEAD'):
+    return subprocess.check_output(['git', 'rev-parse', ref]).strip()
+
+
+def results_path(sha, results_dir=RESULTS_DIR):
+    return os.path.join(results_dir, '{}.json'.format(sha))
+
+
+def load_results(ref, results_dir=RESULTS_DIR):
+    """
+    The saved results for the commit ``ref``.
+    """
+    with open(results_path(git_sha(ref), results_dir)) as results_file:
+        return json.load(results_file, object_pairs_hook=OrderedDict)
+
+
+def regressions(base, head, threshold):
+    """
+    Compare the step times of two sets of saved results.
+
+    Returns:
+        list of (str, str, float, float): the fleet size, step, and base and head
+            seconds of each step that became more than ``threshold`` times slower
+    """
+    slower = []
+    for size, steps in head['results'].items():
+        for step, measurement in steps.items():
+            base_seconds = base['results'].get(size, {}).get(step, {}).get('seconds')
+            if base_seconds and measurement['seconds'] > base_seconds * threshold:
+                slower.append((size, step, base_seconds, measurement['seconds']))
+    return slower
+
+
+def _print_results(results):
+    click.echo('{:>10} '.format('pipelines') + ' '.join('{:>13}'.format(step) for step in STEPS) + ' {:>10}'.format(
+        'peak (MB)'
+    ))
+    for size, steps in results.items():
+        click.echo('{:>10} '.format(size) + ' '.join(
+            '{:>13.3f}'.format(steps[step]['seconds']) for step in STEPS
+        ) + ' {:>10.1f}'.format(max(step['peak_rss_kb'] for step in steps.values()) / 1024.0))
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command('run')
+@click.option(
+    '--sizes', default='10,100,1000,5000',
+    help='Comma-separated numbers of pipelines in each fleet.',
+)
+@click.option(
+    '--results-dir', default=RESULTS_DIR, type=click.Path(file_okay=False),
+    help='Where to save the results, as <commit sha>.json.',
+)
+@click.option('--no-save', is_flag=True, default=False, help="Print the results without saving them.")
+def run_command(sizes, results_dir, no_save):
+    """
+    Benchmark each step of a deploy, for fleets of each size.
+    """
+    results = run([int(size) for size in sizes.split(',')])
+    _print_results(results)
+    if no_save:
+        return
+
+    sha = git_sha()
+    dirty = bool(subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no']).strip())
+    if not os.path.isdir(results_dir):
+        os.makedirs(results_dir)
+    with open(results_path(sha, results_dir), 'w') as results_file:
+        json.dump(OrderedDict([
+            ('commit', sha),
+            ('dirty', dirty),
+            ('date', time.strftime('%Y-%m-%dT%H:%M:%S')),
+            ('python', platform.python_version()),
+            ('gomatic', getattr(gomatic, '__version__', None)),
+            ('results', results),
+        ]), results_file, indent=2)
+    click.echo('Saved {}{}'.format(results_path(sha, results_dir), ' (with uncommitted changes)' if dirty else ''))
+
+
+@cli.command()
+@click.argument('base')
+@click.argument('head', default='HEAD')
+@click.option(
+    '--results-dir', default=RESULTS_DIR, type=click.Path(file_okay=False),
+    help='Where the results were saved.',
+)
+@click.option(
+    '--threshold', default=1.25, type=float,
+    help='Report steps that became this many times slower.',
+)
+def compare(base, head, results_dir, threshold):
+    """
+    Compare the saved results of the commits BASE and HEAD, and fail if any step regressed.
+    """
+    base_results = load_results(base, results_dir)
+    head_results = load_results(head, results_dir)
+    for name, results in ((base, base_results), (head, head_results)):
+        click.echo('{} ({}):'.format(name, results['commit'][:7]))
+        _print_results(results['results'])
+
+    slower = regressions(base_results, head_results, threshold)
+    for size, step, base_seconds, head_seconds in slower:
+        click.echo('{} pipelines: {} went from {:.3f}s to {:.3f}s'.format(size, step, base_seconds, head_seconds))
+    if slower:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    cli()
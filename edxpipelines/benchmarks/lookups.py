@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Benchmark the cost of gomatic ``ensure_*`` calls as the server config grows,
+with and without the name index from ``edxpipelines.index``.
+
+    python -m edxpipelines.benchmarks.lookups --sizes 100,1000,5000
+"""
+import timeit
+
+import click
+from gomatic import GitMaterial, GoCdConfigurator
+from gomatic.fake import FakeHostRestClient, empty_config_xml
+
+from edxpipelines.index import IndexedConfigurator
+
+GROUP_COUNT = 3
+STAGES_PER_PIPELINE = 5
+JOBS_PER_STAGE = 2
+
+
+def server_config(pipeline_count):
+    """
+    Build a server config with ``pipeline_count`` pipelines spread over a few groups.
+    """
+    configurator = IndexedConfigurator(GoCdConfigurator(FakeHostRestClient(empty_config_xml)))
+    for index in range(pipeline_count):
+        group = configurator.ensure_pipeline_group('group_{}'.format(index % GROUP_COUNT))
+        pipeline = group.ensure_pipeline('pipeline_{}'.format(index))
+        pipeline.ensure_material(GitMaterial('https://github.com/edx/repo_{}.git'.format(index)))
+        for stage_index in range(STAGES_PER_PIPELINE):
+            stage = pipeline.ensure_stage('stage_{}'.format(stage_index))
+            for job_index in range(JOBS_PER_STAGE):
+                stage.ensure_job('job_{}'.format(job_index))
+    return configurator.config
+
+
+def replace_pipelines(configurator, pipeline_count):
+    """
+    Regenerate every pipeline in the config, as a batch of pipeline scripts would.
+    """
+    for index in range(pipeline_count):
+        group = configurator.ensure_pipeline_group('group_{}'.format(index % GROUP_COUNT))
+        pipeline = group.ensure_replacement_of_pipeline('pipeline_{}'.format(index))
+        pipeline.ensure_material(GitMaterial('https://github.com/edx/repo_{}.git'.format(index)))
+        for stage_index in range(STAGES_PER_PIPELINE):
+            stage = pipeline.ensure_stage('stage_{}'.format(stage_index))
+            for job_index in range(JOBS_PER_STAGE):
+                stage.ensure_job('job_{}'.format(job_index))
+
+
+def time_per_call(config, pipeline_count, wrap):
+    """
+    The mean time of each ensure_* call, in microseconds.
+    """
+    calls_per_pipeline = 3 + STAGES_PER_PIPELINE * (1 + JOBS_PER_STAGE)
+    configurator = wrap(GoCdConfigurator(FakeHostRestClient(config)))
+    seconds = timeit.timeit(lambda: replace_pipelines(configurator, pipeline_count), number=1)
+    return seconds * 1e6 / (pipeline_count * calls_per_pipeline)
+
+
+@click.command()
+@click.option(
+    '--sizes', default='10,100,1000,5000',
+    help='Comma-separated numbers of pipelines in the server config.',
+)
+def cli(sizes):
+    click.echo('{:>10} {:>14} {:>14}'.format('pipelines', 'gomatic (us)', 'indexed (us)'))
+    for size in [int(size) for size in sizes.split(',')]:
+        config = server_config(size)
+        click.echo('{:>10} {:>14.1f} {:>14.1f}'.format(
+            size,
+            time_per_call(config, size, lambda configurator: configurator),
+            time_per_call(config, size, IndexedConfigurator),
+        ))
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,411 @@
+"""
+Export of gomatic-built pipelines as GoCD config-repo files.
+
+Each pipeline is written to its own file, in either the yaml
+(https://github.com/tomzo/gocd-yaml-config-plugin) or json
+(https://github.com/tomzo/gocd-json-config-plugin) config-repo format, so that
+pipelines can be committed to a config repository and loaded by GoCD
+incrementally, instead of being POSTed as part of the full server config.
+
+Pipeline group authorization isn't part of the config-repo formats, and stays in
+the main server config.
+
+The files of pipelines that a script no longer generates are deleted, so
+that GoCD removes the pipelines too.
+"""
+import json
+import os.path
+
+import yaml
+
+FORMAT_VERSION = 1
+FILE_EXTENSIONS = {
+    'json': '.gopipeline.json',
+    'yaml': '.gocd.yaml',
+}
+# The lists of the files each script generated, so that it can delete the pipelines it no longer generates.
+MANIFEST_EXTENSION = '.manifest'
+
+
+class UnsupportedConfig(Exception):
+    pass
+
+
+def _bool(value, default):
+    if value is None:
+        return default
+    return value == 'true'
+
+
+def _environment_variables(element):
+    """
+    Render the ``environmentvariables`` child of ``element`` as a list of json variables.
+    """
+    variables = []
+    for variable in element.findall('environmentvariables/variable'):
+        rendered = {'name': variable.get('name')}
+        encrypted = variable.find('encryptedValue')
+        if encrypted is not None:
+            rendered['encrypted_value'] = encrypted.text or ''
+        elif variable.get('secure') == 'true':
+            raise UnsupportedConfig(
+                'Secure variable {} must be encrypted before it can be exported'.format(variable.get('name'))
+            )
+        else:
+            rendered['value'] = variable.findtext('value') or ''
+        variables.append(rendered)
+    return variables
+
+
+def _material(element):
+    if element.tag == 'git':
+        material = {
+            'type': 'git',
+            'url': element.get('url'),
+            'branch': element.get('branch', 'master'),
+            'auto_update': _bool(element.get('autoUpdate'), True),
+            'shallow_clone': _bool(element.get('shallowClone'), False),
+        }
+        if element.get('materialName'):
+            material['name'] = element.get('materialName')
+        if element.get('dest'):
+            material['destination'] = element.get('dest')
+        patterns = [ignore.get('pattern') for ignore in element.findall('filter/ignore')]
+        if patterns:
+            material['filter'] = {'whitelist' if _bool(element.get('invertFilter'), False) else 'ignore': patterns}
+        return material
+    elif element.tag == 'pipeline':
+        material = {
+            'type': 'dependency',
+            'pipeline': element.get('pipelineName'),
+            'stage': element.get('stageName'),
+        }
+        if element.get('materialName'):
+            material['name'] = element.get('materialName')
+        return material
+    raise UnsupportedConfig('Unsupported material: {}'.format(element.tag))
+
+
+def _task(element):
+    run_if = element.find('runif')
+    run_if = run_if.get('status') if run_if is not None else 'passed'
+    if element.tag == 'exec':
+        task = {
+            'type': 'exec',
+            'command': element.get('command'),
+            'arguments': [arg.text or '' for arg in element.findall('arg')],
+            'run_if': run_if,
+        }
+        if element.get('workingdir'):
+            task['working_directory'] = element.get('workingdir')
+        return task
+    elif element.tag == 'fetchartifact':
+        is_file = element.get('srcfile') is not None
+        task = {
+            'type': 'fetch',
+            'pipeline': element.get('pipeline'),
+            'stage': element.get('stage'),
+            'job': element.get('job'),
+            'source': element.get('srcfile') if is_file else element.get('srcdir'),
+            'is_source_a_file': is_file,
+            'run_if': run_if,
+        }
+        if element.get('dest'):
+            task['destination'] = element.get('dest')
+        return task
+    raise UnsupportedConfig('Unsupported task: {}'.format(element.tag))
+
+
+def _artifact(element):
+    if element.tag not in ('artifact', 'test'):
+        raise UnsupportedConfig('Unsupported artifact: {}'.format(element.tag))
+    artifact = {
+        'source': element.get('src'),
+        'type': 'test' if element.tag == 'test' else 'build',
+    }
+    if element.get('dest'):
+        artifact['destination'] = element.get('dest')
+    return artifact
+
+
+def _job(element):
+    job = {
+        'name': element.get('name'),
+        'environment_variables': _environment_variables(element),
+        'resources': [resource.text for resource in element.findall('resources/resource')],
+        'tabs': [{'name': tab.get('name'), 'path': tab.get('path')} for tab in element.findall('tabs/tab')],
+        'artifacts': [_artifact(artifact) for artifact in element.findall('artifacts/*')],
+        'tasks': [_task(task) for task in element.findall('tasks/*')],
+    }
+    if element.get('timeout'):
+        job['timeout'] = int(element.get('timeout'))
+    if _bool(element.get('runOnAllAgents'), False):
+        job['run_instance_count'] = 'all'
+    if element.get('elasticProfileId'):
+        job['elastic_profile_id'] = element.get('elasticProfileId')
+    return job
+
+
+def _stage(element):
+    stage = {
+        'name': element.get('name'),
+        'fetch_materials': _bool(element.get('fetchMaterials'), True),
+        'clean_working_directory': _bool(element.get('cleanWorkingDir'), False),
+        'never_cleanup_artifacts': _bool(element.get('artifactCleanupProhibited'), False),
+        'environment_variables': _environment_variables(element),
+        'jobs': [_job(job) for job in element.findall('jobs/job')],
+    }
+    approval = element.find('approval')
+    if approval is not None:
+        stage['approval'] = {
+            'type': approval.get('type'),
+            'roles': [role.text for role in approval.findall('authorization/role')],
+            'users': [user.text for user in approval.findall('authorization/user')],
+        }
+    return stage
+
+
+def pipeline_to_json(group_name, element):
+    """
+    Convert a pipeline into the json config-repo format.
+
+    Args:
+        group_name (str): the name of the group that holds the pipeline
+        element (xml.etree.ElementTree.Element): the ``pipeline`` element
+
+    Returns:
+        dict: the pipeline, as a json-serializable dict
+    """
+    if element.get('template'):
+        raise UnsupportedConfig('Pipeline {} uses a template'.format(element.get('name')))
+
+    pipeline = {
+        'format_version': FORMAT_VERSION,
+        'group': group_name,
+        'name': element.get('name'),
+        'enable_pipeline_locking': _bool(element.get('isLocked'), False),
+        'environment_variables': _environment_variables(element),
+        'materials': [_material(material) for material in element.findall('materials/*')],
+        'stages': [_stage(stage) for stage in element.findall('stage')],
+    }
+    if element.get('labeltemplate'):
+        pipeline['label_template'] = element.get('labeltemplate')
+    timer = element.find('timer')
+    if timer is not None:
+        pipeline['timer'] = {
+            'spec': timer.text,
+            'only_on_changes': _bool(timer.get('onlyOnChanges'), False),
+        }
+    return pipeline
+
+
+def _variables_to_yaml(variables):
+    """
+    Split json variables into yaml ``environment_variables`` and ``secure_variables``.
+    """
+    result = {}
+    plain = {var['name']: var['value'] for var in variables if 'value' in var}
+    secure = {var['name']: var['encrypted_value'] for var in variables if 'encrypted_value' in var}
+    if plain:
+        result['environment_variables'] = plain
+    if secure:
+        result['secure_variables'] = secure
+    return result
+
+
+def _material_to_yaml(material):
+    if material['type'] == 'dependency':
+        return {'pipeline': material['pipeline'], 'stage': material['stage']}
+
+    rendered = {
+        'git': material['url'],
+        'branch': material['branch'],
+        'auto_update': material['auto_update'],
+        'shallow_clone': material['shallow_clone'],
+    }
+    if 'destination' in material:
+        rendered['destination'] = material['destination']
+    for json_key, yaml_key in (('ignore', 'blacklist'), ('whitelist', 'whitelist')):
+        if json_key in material.get('filter', {}):
+            rendered[yaml_key] = material['filter'][json_key]
+    return rendered
+
+
+def _task_to_yaml(task):
+    rendered = {key: value for key, value in task.items() if key not in ('type', 'is_source_a_file')}
+    if task['type'] == 'exec':
+        return {'exec': rendered}
+    rendered['is_file'] = task['is_source_a_file']
+    return {'fetch': rendered}
+
+
+def _job_to_yaml(job):
+    rendered = _variables_to_yaml(job['environment_variables'])
+    rendered['tasks'] = [_task_to_yaml(task) for task in job['tasks']]
+    if job['resources']:
+        rendered['resources'] = job['resources']
+    if job['tabs']:
+        rendered['tabs'] = {tab['name']: tab['path'] for tab in job['tabs']}
+    if job['artifacts']:
+        rendered['artifacts'] = [
+            {artifact['type']: {key: value for key, value in artifact.items() if key != 'type'}}
+            for artifact in job['artifacts']
+        ]
+    for key in ('timeout', 'elastic_profile_id'):
+        if key in job:
+            rendered[key] = job[key]
+    if 'run_instance_count' in job:
+        rendered['run_instances'] = job['run_instance_count']
+    return rendered
+
+
+def _stage_to_yaml(stage):
+    rendered = _variables_to_yaml(stage['environment_variables'])
+    rendered.update({
+        'fetch_materials': stage['fetch_materials'],
+        'clean_workspace': stage['clean_working_directory'],
+        'keep_artifacts': stage['never_cleanup_artifacts'],
+        'jobs': {job['name']: _job_to_yaml(job) for job in stage['jobs']},
+    })
+    if 'approval' in stage:
+        rendered['approval'] = {key: value for key, value in stage['approval'].items() if value}
+    return {stage['name']: rendered}
+
+
+def pipeline_to_yaml(group_name, element):
+    """
+    Convert a pipeline into the yaml config-repo format.
+
+    Args:
+        group_name (str): the name of the group that holds the pipeline
+        element (xml.etree.ElementTree.Element): the ``pipeline`` element
+
+    Returns:
+        dict: the pipeline, as a yaml-serializable dict
+    """
+    pipeline = pipeline_to_json(group_name, element)
+    rendered = _variables_to_yaml(pipeline['environment_variables'])
+    rendered.update({
+        'group': group_name,
+        'locking': 'on' if pipeline['enable_pipeline_locking'] else 'off',
+        'materials': {
+            material.get('name', '{}_{}'.format(material['type'], index)): _material_to_yaml(material)
+            for index, material in enumerate(pipeline['materials'])
+        },
+        'stages': [_stage_to_yaml(stage) for stage in pipeline['stages']],
+    })
+    for key in ('label_template', 'timer'):
+        if key in pipeline:
+            rendered[key] = pipeline[key]
+    return {'format_version': FORMAT_VERSION, 'pipelines': {pipeline['name']: rendered}}
+
+
+def render_pipeline(group_name, element, file_format):
+    """
+    Render a pipeline as the contents of a config-repo file.
+
+    Args:
+        group_name (str): the name of the group that holds the pipeline
+        element (xml.etree.ElementTree.Element): the ``pipeline`` element
+        file_format (str): either 'yaml' or 'json'
+
+    Returns:
+        str: the file contents
+    """
+    if file_format == 'json':
+        return json.dumps(pipeline_to_json(group_name, element), indent=2, sort_keys=True) + '\n'
+    elif file_format == 'yaml':
+        return yaml.safe_dump(pipeline_to_yaml(group_name, element), default_flow_style=False)
+    raise ValueError('Unknown config-repo format: {}'.format(file_format))
+
+
+def _pipeline_files(configurator, output_dir, file_format):
+    """
+    Yield the path, group name and element of every pipeline in ``configurator``.
+    """
+    for group in configurator.pipeline_groups:
+        for pipeline in group.element.findall('pipeline'):
+            yield os.path.join(output_dir, pipeline.get('name') + FILE_EXTENSIONS[file_format]), group.name, pipeline
+
+
+def export_pipelines(configurator, output_dir, file_format='yaml', dry_run=False):
+    """
+    Write every pipeline in ``configurator`` to its own file in ``output_dir``.
+
+    Files whose contents haven't changed are left untouched, so only changed
+    pipelines show up as changes in the config repo.
+
+    Args:
+        configurator (gomatic.GoCdConfigurator): the configurator holding the generated pipelines
+        output_dir (str): the directory to write the pipeline files to
+        file_format (str): either 'yaml' or 'json'
+        dry_run (bool): only list the files that would be written
+
+    Returns:
+        list: the paths of the files that were (or would be) written
+    """
+    if not dry_run and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    written = []
+    for path, group_name, pipeline in _pipeline_files(configurator, output_dir, file_format):
+        contents = render_pipeline(group_name, pipeline, file_format)
+        if os.path.exists(path):
+            with open(path) as existing:
+                if existing.read() == contents:
+                    continue
+        if not dry_run:
+            with open(path, 'w') as pipeline_file:
+                pipeline_file.write(contents)
+        written.append(path)
+    return written
+
+
+def manifest_path(output_dir, owner):
+    """
+    The file that lists the pipeline files in ``output_dir`` that ``owner`` generated.
+    """
+    return os.path.join(output_dir, '.{}{}'.format(owner, MANIFEST_EXTENSION))
+
+
+def remove_stale_pipelines(configurator, output_dir, owner, file_format='yaml', dry_run=False, complete=True):
+    """
+    Delete the files of the pipelines that ``owner`` generated before, but doesn't generate any more.
+
+    Several scripts can export to the same directory, so each of them (each ``owner``) lists the files
+    it generated in a manifest, and only ever deletes the files in its own manifest.
+
+    Args:
+        configurator (gomatic.GoCdConfigurator): the configurator holding the generated pipelines
+        output_dir (str): the directory the pipeline files were exported to
+        owner (str): a name for the script (and variables) that generated the pipelines
+        file_format (str): either 'yaml' or 'json'
+        dry_run (bool): only list the files that would be deleted
+        complete (bool): whether ``configurator`` holds every pipeline ``owner`` generates. If not (with
+            ``--only``), nothing is deleted, and the pipelines are added to the manifest.
+
+    Returns:
+        list: the paths of the files that were (or would be) deleted
+    """
+    current = set(
+        os.path.basename(path) for path, _, _ in _pipeline_files(configurator, output_dir, file_format)
+    )
+    manifest = manifest_path(output_dir, owner)
+    previous = set()
+    if os.path.exists(manifest):
+        with open(manifest) as manifest_file:
+            previous = set(line.strip() for line in manifest_file if line.strip())
+
+    if not complete:
+        current |= previous
+    removed = [
+        os.path.join(output_dir, name) for name in sorted(previous - current)
+        if os.path.exists(os.path.join(output_dir, name))
+    ]
+    if not dry_run:
+        for path in removed:
+            os.remove(path)
+        if current != previous:
+            with open(manifest, 'w') as manifest_file:
+                manifest_file.write(''.join(name + '\n' for name in sorted(current)))
+    return removed
@@ -0,0 +1,235 @@
+"""
+Consistency checks across a whole system of GoCD pipelines.
+
+``SystemIndex`` reads the pipelines of one or more configs (the output of
+several pipeline scripts, or a complete server config) in a single pass, and
+then checks every reference between pipelines against it, so the cost of the
+checks grows linearly with the size of the configs.
+
+Pipelines built from a template get the stages of the template, with the
+pipeline's parameters substituted. Nothing is known about the stages of a
+pipeline whose template isn't in the indexed configs, so references to and
+from it aren't checked.
+"""
+from collections import namedtuple
+import copy
+import re
+
+import lxml.etree as ElementTree
+
+from edxpipelines.artifacts import artifact_paths, is_published
+from edxpipelines.canonicalize import PARSER
+
+# A reference from one pipeline to another: the ``element`` (a pipeline material or fetchartifact task)
+# found in the pipeline named ``pipeline``, within ``stage`` (None for materials).
+Reference = namedtuple('Reference', ['pipeline', 'stage', 'element'])
+
+
+def _root(config):
+    if isinstance(config, basestring):
+        return ElementTree.fromstring(config, parser=PARSER)
+    elif isinstance(config, ElementTree._ElementTree):
+        return config.getroot()
+    return config
+
+
+def _substitute_params(stage, params):
+    """
+    A copy of ``stage`` (from a template) with every ``#{param}`` in its attributes and text replaced.
+    """
+    def substitute(value):
+        return re.sub(r'#\{([^}]*)\}', lambda match: params.get(match.group(1), match.group(0)), value)
+
+    stage = copy.deepcopy(stage)
+    for element in stage.iter():
+        for name, value in element.attrib.items():
+            element.set(name, substitute(value))
+        if element.text:
+            element.text = substitute(element.text)
+    return stage
+
+
+class PipelineEntry(object):
+    """
+    What the index knows about a single pipeline.
+    """
+    def __init__(self, source):
+        self.source = source
+        # Stage names, mapped to their position in the pipeline.
+        self.stages = {}
+        # Stage name -> job name -> the set of paths its artifacts can be fetched from.
+        self.jobs = {}
+        # Upstream pipeline name -> the stage of it that this pipeline depends on.
+        self.materials = {}
+        # Whether the pipeline's stages are unknown, because its template wasn't indexed.
+        self.unresolved = False
+
+
+class SystemIndex(object):
+    """
+    An index of pipelines, stages, jobs and artifacts, and of the references between them.
+    """
+    def __init__(self):
+        self.pipelines = {}
+        self.references = []
+        self.duplicates = []
+        # Template name -> its ``pipeline`` element.
+        self.templates = {}
+
+    @classmethod
+    def from_configs(cls, configs):
+        """
+        Index ``configs``, an iterable of configs or of (source, config) pairs.
+        """
+        index = cls()
+        configs = [config if isinstance(config, tuple) else (None, config) for config in configs]
+        # A pipeline may use a template defined in any of the configs.
+        configs = [(source, _root(config)) for source, config in configs]
+        for _, root in configs:
+            index.add_templates(root)
+        for source, root in configs:
+            index.add_config(root, source=source)
+        return index
+
+    def add_templates(self, config):
+        """
+        Index the templates in ``config``, for the pipelines indexed after it.
+
+        Args:
+            config (str, lxml tree or element): a cruise-config xml
+        """
+        for template in _root(config).iterfind('templates/pipeline'):
+            self.add_template(template)
+
+    def add_template(self, template):
+        """
+        Index ``template``, the ``pipeline`` element of a template, for the pipelines indexed after it.
+        """
+        self.templates.setdefault(template.get('name'), template)
+
+    def add_config(self, config, source=None):
+        """
+        Index every pipeline in ``config``.
+
+        Args:
+            config (str, lxml tree or element): a cruise-config xml
+            source (str): where the config came from, used in error messages
+        """
+        root = _root(config)
+        self.add_templates(root)
+        for pipeline in root.iterfind('pipelines/pipeline'):
+            self.add_pipeline(pipeline, source)
+
+    def add_pipeline(self, pipeline, source=None):
+        name = pipeline.get('name')
+        if name in self.pipelines:
+            self.duplicates.append((name, self.pipelines[name].source, source))
+            return
+
+        entry = self.pipelines[name] = PipelineEntry(source)
+        for material in pipeline.iterfind('materials/pipeline'):
+            entry.materials.setdefault(material.get('pipelineName'), material.get('stageName'))
+            self.references.append(Reference(name, None, material))
+
+        stages = pipeline.iterfind('stage')
+        if pipeline.get('template'):
+            template = self.templates.get(pipeline.get('template'))
+            if template is None:
+                entry.unresolved = True
+                stages = []
+            else:
+                params = {param.get('name'): param.text or '' for param in pipeline.iterfind('params/param')}
+                stages = [_substitute_params(stage, params) for stage in template.iterfind('stage')]
+
+        for position, stage in enumerate(stages):
+            stage_name = stage.get('name')
+            entry.stages.setdefault(stage_name, position)
+            jobs = entry.jobs.setdefault(stage_name, {})
+            for job in stage.iterfind('jobs/job'):
+                artifacts = jobs.setdefault(job.get('name'), set())
+                for artifact in job.iterfind('artifacts/artifact'):
+                    artifacts.update(artifact_paths(artifact.get('src'), artifact.get('dest')))
+                for fetch in job.iterfind('tasks/fetchartifact'):
+                    self.references.append(Reference(name, stage_name, fetch))
+
+    def _material_errors(self, reference):
+        upstream = reference.element.get('pipelineName')
+        stage = reference.element.get('stageName')
+        entry = self.pipelines.get(upstream, PipelineEntry(None))
+        if not entry.unresolved and stage not in entry.stages:
+            yield 'pipeline {}: material refers to missing stage {}/{}'.format(reference.pipeline, upstream, stage)
+
+    def _fetch_errors(self, reference, check_artifacts):
+        fetch = reference.element
+        entry = self.pipelines[reference.pipeline]
+        stage_name = fetch.get('stage')
+        job_name = fetch.get('job')
+        source_file = fetch.get('srcfile') or fetch.get('srcdir')
+        description = '{}/{}/{}'.format(fetch.get('pipeline') or reference.pipeline, stage_name, job_name)
+
+        # The pipeline may be a path from an ancestor, where the artifact is, down to a direct upstream pipeline.
+        path = (fetch.get('pipeline') or reference.pipeline).split('/')
+        if path == [reference.pipeline]:
+            if stage_name in entry.stages and entry.stages[stage_name] >= entry.stages[reference.stage]:
+                yield 'pipeline {}: fetch of {} is not from an earlier stage'.format(reference.pipeline, description)
+        else:
+            downstream = reference.pipeline
+            for upstream in reversed(path):
+                if upstream not in self.pipelines.get(downstream, PipelineEntry(None)).materials:
+                    yield 'pipeline {}: fetch of {} needs {} to be a material of {}'.format(
+                        reference.pipeline, description, upstream, downstream,
+                    )
+                    return
+                downstream = upstream
+
+            upstream = self.pipelines.get(path[0])
+            if len(path) == 1 and upstream is not None and stage_name in upstream.stages:
+                material_stage = entry.materials[path[0]]
+                # A material of a missing stage is reported as such, rather than here.
+                if upstream.stages.get(material_stage, len(upstream.stages)) < upstream.stages[stage_name]:
+                    yield 'pipeline {}: fetch of {} is from a stage after the material stage {}'.format(
+                        reference.pipeline, description, material_stage,
+                    )
+
+        if path[0] in self.pipelines and self.pipelines[path[0]].unresolved:
+            return
+        jobs = self.pipelines[path[0]].jobs if path[0] in self.pipelines else {}
+        if job_name not in jobs.get(stage_name, {}):
+            yield 'pipeline {}: fetch refers to missing job {}'.format(reference.pipeline, description)
+        elif check_artifacts and not is_published(source_file, jobs[stage_name][job_name]):
+            yield 'pipeline {}: fetch refers to missing artifact {}/{}'.format(
+                reference.pipeline, description, source_file,
+            )
+
+    def errors(self, pipelines=None, check_artifacts=False):
+        """
+        Check the references between the indexed pipelines.
+
+        Pipeline names must be unique, pipeline materials must refer to stages
+        that exist, and fetch artifact tasks must refer to jobs that exist, in
+        a stage that has already run by the time the fetch does.
+
+        Args:
+            pipelines (set of str): only check references from these pipelines (all of them by default)
+            check_artifacts (bool): whether fetched files must also be artifacts of the job they're fetched
+                from. This needs every artifact to be declared in the indexed configs.
+
+        Returns:
+            list of str: the problems found
+        """
+        errors = []
+        for name, first_source, source in self.duplicates:
+            if pipelines is None or name in pipelines:
+                if first_source == source:
+                    errors.append('pipeline {} is defined more than once'.format(name))
+                else:
+                    errors.append('pipeline {} is defined by both {} and {}'.format(name, first_source, source))
+
+        for reference in self.references:
+            if pipelines is not None and reference.pipeline not in pipelines:
+                continue
+            if reference.stage is None:
+                errors.extend(self._material_errors(reference))
+            else:
+                errors.extend(self._fetch_errors(reference, check_artifacts))
+        return errors
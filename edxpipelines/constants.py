@@ -27,6 +27,8 @@ PRERELEASE_MATERIALS_STAGE_NAME = 'prerelease_materials'
 PRERELEASE_MATERIALS_JOB_NAME = 'prerelease_materials_job'
 BASE_AMI_SELECTION_STAGE_NAME = 'select_base_ami'
 BASE_AMI_SELECTION_JOB_NAME = 'select_base_ami_job'
+FIND_REUSABLE_AMI_STAGE_NAME = 'find_reusable_ami'
+FIND_REUSABLE_AMI_JOB_NAME = 'find_reusable_ami_job'
 GIT_SETUP_STAGE_NAME = 'create_branch_and_pr'
 GIT_SETUP_JOB_NAME = 'create_branch_and_pr_job'
 GIT_CREATE_BRANCH_STAGE_NAME = 'create_branch'
@@ -72,7 +74,43 @@ BUILD_AMI_FILENAME = 'ami.yml'
 DEPLOY_AMI_OUT_FILENAME = 'ami_deploy_info.yml'
 ROLLBACK_AMI_OUT_FILENAME = 'rollback_info.yml'
 LAUNCH_INSTANCE_FILENAME = 'launch_info.yml'
+# The files ansible needs to reach a launched instance, and the bundle the launch job also publishes them in.
+INSTANCE_ACCESS_FILES = ('key.pem', LAUNCH_INSTANCE_FILENAME, 'ansible_inventory')
+INSTANCE_ACCESS_FILENAME = 'instance_access.tar.gz'
+
+# How many -v flags ansible-playbook tasks get, unless their pipeline says otherwise.
+ANSIBLE_VERBOSITY = 1
+# Where ansible-playbook tasks send their output: the console, or a json or profile_tasks callback log
+# in ANSIBLE_OUTPUT_PATH, which the jobs publish.
+ANSIBLE_OUTPUTS = ('console', 'json', 'profile')
+ANSIBLE_OUTPUT_PATH = '{}/ansible'.format(ARTIFACT_PATH)
+# Where ansible-playbook tasks that cache facts keep them, and the artifact later stages fetch them from.
+ANSIBLE_FACT_CACHE_NAME = 'ansible_facts'
+ANSIBLE_FACT_CACHE_PATH = '{}/{}'.format(ARTIFACT_PATH, ANSIBLE_FACT_CACHE_NAME)
 BASE_AMI_OVERRIDE_FILENAME = 'ami_override.yml'
+# The fingerprint of the inputs of an AMI build, and the AMI built from them earlier, if there is one.
+AMI_REUSE_FILENAME = 'ami_reuse.yml'
+# The tag that AMIs are given their build fingerprint in. Bump the version to stop reusing the AMIs built so far.
+AMI_FINGERPRINT_TAG = 'edx_build_fingerprint'
+AMI_FINGERPRINT_VERSION = 1
+# The environment variable that holds a hash of the generated config of the stages that build an AMI, which the
+# fingerprint includes.
+AMI_BUILD_CONFIG_VARIABLE = 'EDX_AMI_BUILD_CONFIG'
+# The environment variable that records the class of a job (see patterns.stages.JobClass).
+JOB_CLASS_VARIABLE = 'EDX_JOB_CLASS'
+
+# Virtualenvs are cached on each agent, keyed by a hash of the requirements they were built from.
+VIRTUALENV_CACHE_DIR = '${EDX_VIRTUALENV_CACHE:-$HOME/.cache/edx-virtualenvs}'
+# Sourced by every bash task of a job (through BASH_ENV) to activate the job's virtualenv.
+VIRTUALENV_ACTIVATE_SCRIPT = (
+    VIRTUALENV_CACHE_DIR +
+    '/activate/${GO_PIPELINE_NAME}-${GO_PIPELINE_COUNTER}-${GO_STAGE_NAME}-${GO_STAGE_COUNTER}-${GO_JOB_NAME}.sh'
+)
+# Cached virtualenvs (and activation scripts) unused for this many days are removed.
+VIRTUALENV_CACHE_DAYS = 14
+# Agents that set this keep a bare reference repository of each secure repo in it, which the jobs they run
+# borrow objects from when they fetch the repo.
+GIT_REFERENCE_CACHE_DIR = '$EDX_GIT_REFERENCE_CACHE'
 CREATE_BRANCH_FILENAME = 'branch.yml'
 MERGE_BRANCH_FILENAME = 'merge_branch_sha.yml'
 CREATE_BRANCH_PR_FILENAME = 'create_branch_pr.yml'
@@ -0,0 +1,122 @@
+"""
+Static analysis of the imports between the modules of this repository.
+
+Used to work out which source files a pipeline script's output depends on,
+without importing (and so running) the script.
+"""
+import ast
+import os.path
+
+# The direct dependencies of each module, by (root, path, modification time), since parsing is slow.
+_DIRECT_DEPENDENCIES = {}
+
+
+def _module_path(root, module_name):
+    """
+    The source file under ``root`` for ``module_name``, or None if it isn't part of this repository.
+    """
+    base = os.path.join(root, *module_name.split('.'))
+    for path in (base + '.py', os.path.join(base, '__init__.py')):
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def _package(root, path):
+    """
+    The dotted name of the package containing the module at ``path``.
+    """
+    parts = os.path.relpath(os.path.dirname(path), root).split(os.sep)
+    return '.'.join(part for part in parts if part not in ('', '.'))
+
+
+def _imported_names(tree, package):
+    """
+    The dotted names of every module that might be imported by ``tree``,
+    a module in ``package``.
+    """
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                yield alias.name
+                if package:
+                    # An implicit relative import.
+                    yield package + '.' + alias.name
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                base = package.split('.')[:len(package.split('.')) - node.level + 1] if package else []
+                module = '.'.join(base + ([node.module] if node.module else []))
+            else:
+                module = node.module
+                if package:
+                    for name in _with_submodules(package + '.' + module, node.names):
+                        yield name
+            for name in _with_submodules(module, node.names):
+                yield name
+
+
+def _with_submodules(module, aliases):
+    """
+    ``module``, and each of the names imported from it, which may be submodules.
+    """
+    yield module
+    for alias in aliases:
+        if alias.name != '*':
+            yield module + '.' + alias.name
+
+
+def _parents(module_name):
+    """
+    ``module_name`` and each package above it, since importing a module runs the ``__init__`` of each of them.
+    """
+    parts = module_name.split('.')
+    return ['.'.join(parts[:index]) for index in range(1, len(parts) + 1)]
+
+
+def direct_dependencies(path, root):
+    """
+    Find the repository modules that the module at ``path`` imports itself.
+
+    Args:
+        path (str): the absolute path of a python source file
+        root (str): the absolute path of the directory that top-level imports are resolved against
+
+    Returns:
+        set of str: the paths of the imported modules
+    """
+    key = (root, path, os.path.getmtime(path))
+    if key not in _DIRECT_DEPENDENCIES:
+        with open(path) as source:
+            tree = ast.parse(source.read(), path)
+        _DIRECT_DEPENDENCIES[key] = set(
+            module_path
+            for name in _imported_names(tree, _package(root, path))
+            for module_path in (_module_path(root, module_name) for module_name in _parents(name))
+            if module_path is not None
+        )
+    return _DIRECT_DEPENDENCIES[key]
+
+
+def module_dependencies(path, root):
+    """
+    Find the source files that the module at ``path`` imports, directly or indirectly.
+
+    Only modules under ``root`` are followed; third-party and standard library
+    imports are ignored.
+
+    Args:
+        path (str): the python source file to start from
+        root (str): the directory that top-level imports are resolved against
+
+    Returns:
+        list of str: the sorted paths of ``path`` and every repository module it depends on
+    """
+    root = os.path.abspath(root)
+    pending = [os.path.abspath(path)]
+    found = set()
+    while pending:
+        current = pending.pop()
+        if current not in found:
+            found.add(current)
+            pending.extend(direct_dependencies(current, root) - found)
+    return sorted(found)
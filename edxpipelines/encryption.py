@@ -0,0 +1,194 @@
+"""
+Encryption of secure environment variables.
+
+Secure variables that are generated with plain text values get encrypted by the
+GoCD server on every save, which turns every run into a config change. This module
+encrypts them before the config is saved, caching ciphertexts locally so that each
+distinct secret is sent to the server at most once.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os.path
+from xml.etree import ElementTree
+
+import requests
+
+ENCRYPT_PATH = '/go/api/admin/encrypt'
+ENCRYPT_MEDIA_TYPE = 'application/vnd.go.cd.v1+json'
+
+
+class EncryptionError(Exception):
+    pass
+
+
+class GoCdEncrypter(object):
+    """
+    Encrypts values with the cipher of a GoCD server, using its encryption API.
+    """
+    def __init__(self, host, username, password, ssl=True):
+        self.url = '{}://{}{}'.format('https' if ssl else 'http', host, ENCRYPT_PATH)
+        self.auth = (username, password)
+
+    def encrypt(self, value):
+        """
+        Encrypt a single value.
+
+        Args:
+            value (str): the plain text to encrypt
+
+        Returns:
+            str: the ciphertext, as the server would store it in ``encryptedValue``
+        """
+        response = requests.post(
+            self.url,
+            auth=self.auth,
+            data=json.dumps({'value': value}),
+            headers={'Accept': ENCRYPT_MEDIA_TYPE, 'Content-Type': 'application/json'},
+        )
+        if response.status_code != 200:
+            raise EncryptionError(
+                'Unable to encrypt value ({}): {}'.format(response.status_code, response.text)
+            )
+        return response.json()['encrypted_value']
+
+
+class LocalEncrypter(object):
+    """
+    A stand-in for the GoCD cipher, for use offline and in tests.
+
+    Values are "encrypted" with a keyed hash, so the output is stable but can't be
+    decrypted by a real GoCD server.
+    """
+    def __init__(self, key='local'):
+        self.key = key
+        self.calls = 0
+
+    def encrypt(self, value):
+        self.calls += 1
+        return base64.b64encode(hmac.new(self.key, value.encode('utf-8'), hashlib.sha256).digest())
+
+
+class EncryptionCache(object):
+    """
+    A local cache of ciphertexts.
+
+    Entries are keyed by an HMAC of the plain text and the identity of the cipher
+    that encrypted it, so no plain text is ever written to disk, and ciphertexts
+    from one GoCD server are never used with another. The HMAC key is ``secret``
+    (see credentials_secret), which is never written to disk, so the keys in the
+    cache file can't be used to guess the secrets offline. Without a secret, the
+    cache is only kept in memory.
+    """
+    # Files in any other format (such as those keyed by a plain hash) are ignored, and replaced on save.
+    FORMAT_VERSION = 2
+
+    def __init__(self, path=None, secret=None):
+        self.path = path if secret is not None else None
+        self.secret = secret or ''
+        self.entries = {}
+        if self.path is not None and os.path.exists(self.path):
+            with open(self.path) as cache_file:
+                contents = json.load(cache_file)
+            if isinstance(contents, dict) and contents.get('version') == self.FORMAT_VERSION:
+                self.entries = contents['entries']
+
+    def key(self, cipher_identity, plaintext):
+        return hmac.new(
+            self.secret.encode('utf-8'),
+            u'{}\0{}'.format(cipher_identity, plaintext).encode('utf-8'),
+            hashlib.sha256,
+        ).hexdigest()
+
+    def get(self, cipher_identity, plaintext):
+        return self.entries.get(self.key(cipher_identity, plaintext))
+
+    def set(self, cipher_identity, plaintext, ciphertext):
+        self.entries[self.key(cipher_identity, plaintext)] = ciphertext
+
+    def save(self):
+        if self.path is None:
+            return
+        with open(self.path, 'w') as cache_file:
+            json.dump(
+                {'version': self.FORMAT_VERSION, 'entries': self.entries}, cache_file, indent=2, sort_keys=True
+            )
+
+
+def credentials_secret(username, password):
+    """
+    The key of the EncryptionCache entries of a GoCD user.
+
+    Args:
+        username (str): the GoCD username
+        password (str): the GoCD password
+
+    Returns:
+        str: the key
+    """
+    return hashlib.sha256(u'{}\0{}'.format(username, password).encode('utf-8')).hexdigest()
+
+
+def cipher_identity(gocd_url, configurator=None):
+    """
+    Identify the cipher used by a GoCD server.
+
+    GoCD keeps a single cipher per server, so the server id from its config, together
+    with the url used to reach it, is enough to tell ciphers apart.
+
+    Args:
+        gocd_url (str): the host of the server
+        configurator (gomatic.GoCdConfigurator): the configurator for the server, if its
+            config has been loaded
+
+    Returns:
+        str: the cipher identity
+    """
+    server_id = None
+    if configurator is not None:
+        server = ElementTree.fromstring(configurator.config).find('server')
+        if server is not None:
+            server_id = server.get('serverId')
+    return '{}|{}'.format(gocd_url, server_id)
+
+
+def encrypt_secure_variables(configurator, encrypter, cache, identity):
+    """
+    Replace the plain text value of every secure variable in the pipeline groups
+    with its ciphertext.
+
+    All the variables are collected first, so each distinct secret is encrypted once
+    per run, and only if the cache doesn't already hold its ciphertext.
+
+    Args:
+        configurator (gomatic.GoCdConfigurator): the configurator holding the generated pipelines
+        encrypter (GoCdEncrypter): anything with an ``encrypt(value)`` method
+        cache (EncryptionCache): the cache of previously encrypted values
+        identity (str): the identity of the cipher used by ``encrypter``
+
+    Returns:
+        int: the number of variables that were encrypted
+    """
+    variables = [
+        variable
+        for group in configurator.pipeline_groups
+        for variable in group.element.iter('variable')
+        if variable.get('secure') == 'true' and variable.find('value') is not None
+    ]
+
+    ciphertexts = {}
+    for plaintext in sorted(set(variable.find('value').text or '' for variable in variables)):
+        ciphertext = cache.get(identity, plaintext)
+        if ciphertext is None:
+            ciphertext = encrypter.encrypt(plaintext)
+            cache.set(identity, plaintext, ciphertext)
+        ciphertexts[plaintext] = ciphertext
+
+    for variable in variables:
+        value = variable.find('value')
+        variable.remove(value)
+        ElementTree.SubElement(variable, 'encryptedValue').text = ciphertexts[value.text or '']
+
+    cache.save()
+    return len(variables)
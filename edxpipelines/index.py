@@ -0,0 +1,298 @@
+"""
+Name-indexed lookups for gomatic configurators.
+
+gomatic finds pipeline groups, pipelines, stages, jobs and materials by scanning
+the children of an element on every ``ensure_*`` call, which makes building many
+pipelines against a large server config quadratic. The classes here wrap the
+gomatic objects and keep name-to-element maps for each parent element, so that
+those lookups take constant time.
+
+The maps are built lazily, with a single scan the first time a parent is looked
+into, and kept in sync by the mutating methods of the wrappers. Changes made to
+the xml directly, rather than through these objects, aren't seen by the index.
+"""
+from collections import OrderedDict
+from xml.etree import ElementTree
+
+from gomatic import FetchArtifactTask
+from gomatic.gocd.pipelines import Job, Pipeline, PipelineGroup, Stage
+from gomatic.xml_operations import Ensurance
+
+from edxpipelines.artifacts import ArtifactRegistry
+
+
+def _freeze(value):
+    """
+    A hashable version of ``value`` that compares equal exactly when ``value`` does.
+    """
+    if isinstance(value, (set, frozenset)):
+        return (set, frozenset(_freeze(item) for item in value))
+    elif isinstance(value, list):
+        return (list, tuple(_freeze(item) for item in value))
+    elif isinstance(value, dict):
+        return (dict, frozenset((key, _freeze(item)) for key, item in value.items()))
+    return value
+
+
+def material_key(material):
+    """
+    A hashable key for a gomatic material, that matches the material equality used by gomatic.
+    """
+    return (material.__class__, _freeze(vars(material)))
+
+
+class ConfigIndex(object):
+    """
+    Maps from names to child elements, for each parent element that has been looked into.
+    """
+    def __init__(self):
+        self._children = {}
+        self._materials = {}
+
+    def _names(self, parent, path, attribute):
+        paths = self._children.setdefault(parent, {})
+        if path not in paths:
+            # Reversed, so that the first of any duplicate names wins, as it does in gomatic.
+            paths[path] = {
+                element.get(attribute): element
+                for element in reversed(parent.findall(path))
+            }
+        return paths[path]
+
+    def lookup(self, parent, path, attribute, name):
+        """
+        Find the child of ``parent`` at ``path`` whose ``attribute`` is ``name``.
+
+        Returns:
+            Element: the child, or None if there is no such child
+        """
+        return self._names(parent, path, attribute).get(name)
+
+    def add(self, parent, path, attribute, element):
+        self._names(parent, path, attribute).setdefault(element.get(attribute), element)
+
+    def invalidate(self, parent, path=None):
+        """
+        Forget the names of the children of ``parent`` (at ``path``, or all of them).
+        """
+        if path is None:
+            self._children.pop(parent, None)
+            self._materials.pop(parent, None)
+        else:
+            self._children.get(parent, {}).pop(path, None)
+
+    def materials(self, pipeline):
+        """
+        The set of material keys of ``pipeline``.
+        """
+        if pipeline.element not in self._materials:
+            self._materials[pipeline.element] = set(material_key(material) for material in pipeline.materials)
+        return self._materials[pipeline.element]
+
+    def invalidate_materials(self, pipeline_element):
+        self._materials.pop(pipeline_element, None)
+
+
+class IndexedConfigurator(object):
+    """
+    Wraps a ``gomatic.GoCdConfigurator``, indexing the pipeline groups, pipelines,
+    stages and jobs reached through it.
+
+    Anything not overridden here is passed straight through to the wrapped configurator.
+
+    The artifacts published by the jobs of each pipeline are tracked in
+    ``artifact_registry``, and every fetch artifact task added through these objects
+    is checked against it.
+
+    ``changed_pipelines`` maps the name of each pipeline ensured or removed
+    through these objects to its group, in the order they were first changed.
+
+    ``stage_fusion`` holds the names of the pipelines whose stages
+    ``edxpipelines.optimize`` may fuse.
+    """
+    def __init__(self, configurator):
+        self._configurator = configurator
+        self.index = ConfigIndex()
+        self.artifact_registry = ArtifactRegistry(self.find_pipeline_element)
+        self.changed_pipelines = OrderedDict()
+        self.stage_fusion = set()
+        self._groups = None
+
+    def __getattr__(self, name):
+        return getattr(self._configurator, name)
+
+    def _group_elements(self):
+        if self._groups is None:
+            self._groups = {}
+            for group in reversed(self._configurator.pipeline_groups):
+                self._groups[group.name] = group.element
+        return self._groups
+
+    @property
+    def pipeline_groups(self):
+        return [IndexedPipelineGroup(group.element, self) for group in self._configurator.pipeline_groups]
+
+    def ensure_pipeline_group(self, group_name):
+        element = self._group_elements().get(group_name)
+        if element is None:
+            # Groups are added to the root element, which only the wrapped configurator can reach.
+            element = self._configurator.ensure_pipeline_group(group_name).element
+            self._groups[group_name] = element
+        return IndexedPipelineGroup(element, self)
+
+    def ensure_removal_of_pipeline_group(self, group_name):
+        element = self._group_elements().get(group_name)
+        if element is not None:
+            for pipeline in element.findall('pipeline'):
+                self.changed_pipelines.setdefault(pipeline.get('name'), group_name)
+        self._configurator.ensure_removal_of_pipeline_group(group_name)
+        self._group_elements().pop(group_name, None)
+        self.artifact_registry.invalidate()
+        return self
+
+    def find_pipeline_element(self, name):
+        """
+        The element of the pipeline called ``name``, in any group, or None if there isn't one.
+        """
+        for group in self._group_elements().values():
+            element = self.index.lookup(group, 'pipeline', 'name', name)
+            if element is not None:
+                return element
+        return None
+
+
+class IndexedPipelineGroup(PipelineGroup):
+    def __init__(self, element, configurator):
+        super(IndexedPipelineGroup, self).__init__(element, configurator)
+        self.index = configurator.index
+        self.artifact_registry = configurator.artifact_registry
+        self.changed_pipelines = configurator.changed_pipelines
+        self.stage_fusion = configurator.stage_fusion
+
+    @property
+    def pipelines(self):
+        return [IndexedPipeline(element, self) for element in self.element.findall('pipeline')]
+
+    def has_pipeline(self, name):
+        return self.index.lookup(self.element, 'pipeline', 'name', name) is not None
+
+    def find_pipeline(self, name):
+        element = self.index.lookup(self.element, 'pipeline', 'name', name)
+        if element is None:
+            raise RuntimeError('Cannot find pipeline with name "%s" in %s' % (name, self.pipelines))
+        return IndexedPipeline(element, self)
+
+    def ensure_pipeline(self, name):
+        element = self.index.lookup(self.element, 'pipeline', 'name', name)
+        if element is None:
+            element = ElementTree.SubElement(self.element, 'pipeline', name=name)
+            self.index.add(self.element, 'pipeline', 'name', element)
+        self.changed_pipelines.setdefault(name, self.name)
+        return IndexedPipeline(element, self)
+
+    def ensure_removal_of_pipeline(self, name):
+        super(IndexedPipelineGroup, self).ensure_removal_of_pipeline(name)
+        self.changed_pipelines.setdefault(name, self.name)
+        self.index.invalidate(self.element, 'pipeline')
+        self.artifact_registry.invalidate(name)
+        self.artifact_registry.forget_fetches(name)
+        return self
+
+
+class IndexedPipeline(Pipeline):
+    def __init__(self, element, parent):
+        super(IndexedPipeline, self).__init__(element, parent)
+        self.index = parent.index
+        self.artifact_registry = parent.artifact_registry
+        self.stage_fusion = parent.stage_fusion
+
+    def enable_stage_fusion(self):
+        """
+        Let consecutive stages of this pipeline be fused into one job, once every pipeline is generated.
+        """
+        self.stage_fusion.add(self.name)
+        return self
+
+    @property
+    def stages(self):
+        return [IndexedStage(element, self) for element in self.element.findall('stage')]
+
+    def ensure_stage(self, name):
+        element = self.index.lookup(self.element, 'stage', 'name', name)
+        if element is None:
+            element = ElementTree.SubElement(self.element, 'stage', name=name)
+            self.index.add(self.element, 'stage', 'name', element)
+        return IndexedStage(element, self)
+
+    def ensure_removal_of_stage(self, name):
+        super(IndexedPipeline, self).ensure_removal_of_stage(name)
+        self.index.invalidate(self.element, 'stage')
+        self.artifact_registry.invalidate(self.name)
+        return self
+
+    def ensure_material(self, material):
+        keys = self.index.materials(self)
+        key = material_key(material)
+        if key not in keys:
+            material.append_to(Ensurance(self.element).ensure_child('materials'))
+            keys.add(key)
+        return self
+
+    def set_git_material(self, git_material):
+        super(IndexedPipeline, self).set_git_material(git_material)
+        self.index.invalidate_materials(self.element)
+        return self
+
+    def remove_materials(self):
+        super(IndexedPipeline, self).remove_materials()
+        self.index.invalidate_materials(self.element)
+
+    def make_empty(self):
+        super(IndexedPipeline, self).make_empty()
+        self.index.invalidate(self.element)
+        self.artifact_registry.invalidate(self.name)
+        self.artifact_registry.forget_fetches(self.name)
+        self.stage_fusion.discard(self.name)
+
+
+class IndexedStage(Stage):
+    def __init__(self, element, pipeline):
+        super(IndexedStage, self).__init__(element)
+        self.pipeline = pipeline
+        self.index = pipeline.index
+
+    @property
+    def jobs(self):
+        return [IndexedJob(element, self) for element in self.element.findall('jobs/job')]
+
+    def ensure_job(self, name):
+        element = self.index.lookup(self.element, 'jobs/job', 'name', name)
+        if element is None:
+            jobs = Ensurance(self.element).ensure_child('jobs').element
+            element = ElementTree.SubElement(jobs, 'job', name=name)
+            self.index.add(self.element, 'jobs/job', 'name', element)
+        return IndexedJob(element, self)
+
+
+class IndexedJob(Job):
+    """
+    A job that records the artifacts it publishes, and checks the artifacts it fetches.
+    """
+    def __init__(self, element, stage):
+        super(IndexedJob, self).__init__(element)
+        self.stage = stage
+        self.artifact_registry = stage.pipeline.artifact_registry
+
+    def ensure_artifacts(self, artifacts):
+        super(IndexedJob, self).ensure_artifacts(artifacts)
+        for artifact in self.element.findall('artifacts/*'):
+            self.artifact_registry.publish(
+                self.stage.pipeline.name, self.stage.name, self.name, artifact.get('src'), artifact.get('dest'),
+            )
+        return self
+
+    def add_task(self, task):
+        result = super(IndexedJob, self).add_task(task)
+        if isinstance(task, FetchArtifactTask):
+            self.artifact_registry.check_fetch(self.stage.pipeline.name, self.element.find('tasks')[-1])
+        return result
@@ -0,0 +1,76 @@
+"""
+Classes of jobs, which can each be sent to their own agents, so that quick jobs don't wait for agents busy with
+long ones.
+
+The stages (edxpipelines.patterns.stages) set the class of each job they generate. Which agents a class runs on
+is a fleet-wide setting, set once per script with ``configure_job_classes``.
+"""
+from enum import Enum
+
+from edxpipelines import constants
+
+
+class JobClass(Enum):
+    """
+    The kinds of jobs the stages generate, which can each be sent to their own agents (see set_job_class).
+    """
+    # Quick scripts and API calls.
+    LIGHT = 'light'
+    # Ansible plays, and the instances and AMIs they build.
+    ANSIBLE_HEAVY = 'ansible-heavy'
+    # Jobs that mostly wait on other systems, such as ASGs, Jenkins or GitHub.
+    LONG_WAIT = 'long-wait'
+    # Jobs that check out the secure repos.
+    SECRETS = 'secrets'
+
+
+# JobClass -> the agents its jobs run on: a dict with either the ``resources`` the agents must have, or the
+# ``elastic_profile_id`` of the elastic agents. Jobs of the other classes run on any agent.
+JOB_CLASS_AGENTS = {}
+
+
+def configure_job_classes(job_classes=None):
+    """
+    Set the agents each class of job runs on, for the jobs generated from now on.
+
+    Args:
+        job_classes (dict): JobClass value -> dict of the ``resources`` (list) the agents of the class have,
+            or the ``elastic_profile_id`` of their elastic agent profile
+
+    Raises:
+        ValueError: for an unknown class or setting, or a class with both resources and an elastic profile
+    """
+    agents = {}
+    for name, settings in (job_classes or {}).items():
+        try:
+            job_class = JobClass(name)
+        except ValueError:
+            raise ValueError('job classes must be some of {}, not {!r}'.format(
+                ', '.join(job_class.value for job_class in JobClass), name
+            ))
+        if len(settings) != 1 or not set(settings) <= {'resources', 'elastic_profile_id'}:
+            raise ValueError('job class {} must have either resources or an elastic_profile_id'.format(name))
+        agents[job_class] = settings
+    JOB_CLASS_AGENTS.clear()
+    JOB_CLASS_AGENTS.update(agents)
+
+
+def set_job_class(job, job_class):
+    """
+    Run ``job`` on the agents of ``job_class`` (see configure_job_classes), and record its class in
+    the job's constants.JOB_CLASS_VARIABLE, for reports.
+
+    Args:
+        job (gomatic.job.Job): the job to classify, once
+        job_class (JobClass): what the job mostly does
+
+    Returns:
+        gomatic.job.Job
+    """
+    job.ensure_environment_variables({constants.JOB_CLASS_VARIABLE: job_class.value})
+    agents = JOB_CLASS_AGENTS.get(job_class, {})
+    for resource in agents.get('resources', []):
+        job.ensure_resource(resource)
+    if 'elastic_profile_id' in agents:
+        job.set_elastic_profile_id(agents['elastic_profile_id'])
+    return job
@@ -1,83 +1,131 @@
+"""
+The git materials shared by the edxapp pipelines.
+
+Each material is a factory: calling it returns a new GitMaterial, and keyword arguments override its settings.
+How the materials are polled, and whether they are cloned shallowly, are read from ``DEFAULTS`` each time a
+material is created. GoCD requires every copy of a material to have the same autoUpdate setting, so they are
+set once per script (with ``configure``) rather than by each pipeline. Each script configures them from its
+own variables, so the same ``material_defaults`` have to reach every script (through the variable files they
+share); before saving, edxpipelines.validation checks the script's copies of each material against the other
+copies on the server.
+"""
 from gomatic import GitMaterial
-from functools import partial
 
 
-TUBULAR = partial(
-    GitMaterial,
+# How the GoCD server learns about new commits: by polling the repo, from a webhook (which the repo must
+# be set up to send to the server), or not at all (only when a pipeline is triggered by hand).
+# The server only polls materials in 'poll' mode; the other two are the same in the config.
+POLLING_MODES = ('poll', 'webhook', 'off')
+
+# polling: one of POLLING_MODES
+# shallow: whether agents clone the materials with only their latest commits
+# materials: material name -> settings of that material that differ from the defaults above
+DEFAULTS = {
+    'polling': 'poll',
+    'shallow': False,
+    'materials': {},
+}
+
+
+def configure(polling='poll', shallow=False, materials=None):
+    """
+    Set the fleet-wide settings of the shared materials, for the materials created from now on.
+
+    Args:
+        polling (str): one of POLLING_MODES
+        shallow (bool): clone the materials shallowly?
+        materials (dict): material name -> dict of ``polling`` and ``shallow`` settings of that material,
+            that override the defaults
+
+    Raises:
+        ValueError: for an unknown polling mode
+    """
+    for settings in [{'polling': polling}] + (materials or {}).values():
+        if settings.get('polling', 'poll') not in POLLING_MODES:
+            raise ValueError('material polling must be one of {}, not {!r}'.format(
+                ', '.join(POLLING_MODES), settings['polling']
+            ))
+    DEFAULTS.update(polling=polling, shallow=shallow, materials=dict(materials or {}))
+
+
+def _material(settings=None, **attributes):
+    """
+    A factory of GitMaterials with ``attributes``, polled and cloned as ``DEFAULTS`` say when it's called.
+
+    ``settings`` are the material's own defaults for the settings of ``DEFAULTS``, which ``configure`` can
+    only override by the material's name.
+    """
+    def material(**kwargs):
+        merged = dict(DEFAULTS, **(settings or {}))
+        merged.update(DEFAULTS['materials'].get(attributes['material_name'], {}))
+        options = dict(attributes, polling=merged['polling'] == 'poll', shallow=merged['shallow'])
+        options.update(kwargs)
+        return GitMaterial(**options)
+    return material
+
+
+TUBULAR = _material(
     url="https://github.com/edx/tubular",
     branch="master",
     material_name="tubular",
-    polling=True,
     destination_directory="tubular",
     ignore_patterns=['**/*'],
 )
 
-CONFIGURATION = partial(
-    GitMaterial,
+CONFIGURATION = _material(
     url="https://github.com/edx/configuration",
     branch="master",
     material_name="configuration",
-    polling=True,
     destination_directory="configuration",
     ignore_patterns=['**/*'],
 )
 
-EDX_PLATFORM = partial(
-    GitMaterial,
+# edx-platform has a long history, which the pipelines never need.
+EDX_PLATFORM = _material(
+    settings={'shallow': True},
     url="https://github.com/edx/edx-platform",
     branch="release-candidate",
     material_name="edx-platform",
-    polling=True,
     destination_directory="edx-platform",
     ignore_patterns=['**/*'],
 )
 
-EDX_SECURE = partial(
-    GitMaterial,
+EDX_SECURE = _material(
     url="git@github.com:edx-ops/edx-secure.git",
     branch="master",
     material_name="edx-secure",
-    polling=True,
     destination_directory="edx-secure",
     ignore_patterns=['**/*'],
 )
 
-EDGE_SECURE = partial(
-    GitMaterial,
+EDGE_SECURE = _material(
     url="git@github.com:edx-ops/edge-secure.git",
     branch="master",
     material_name="edge-secure",
-    polling=True,
     destination_directory="edge-secure",
     ignore_patterns=['**/*'],
 )
 
-EDX_MICROSITE = partial(
-    GitMaterial,
+EDX_MICROSITE = _material(
     url="git@github.com:edx/edx-microsite.git",
     branch="release",
     material_name="edx-microsite",
-    polling=True,
     destination_directory="edx-microsite",
     ignore_patterns=['**/*'],
 )
 
-EDX_INTERNAL = partial(
-    GitMaterial,
+EDX_INTERNAL = _material(
     url="git@github.com:edx/edx-internal.git",
     branch="master",
     material_name="edx-internal",
-    polling=True,
     destination_directory="edx-internal",
     ignore_patterns=['**/*'],
 )
 
-EDGE_INTERNAL = partial(
-    GitMaterial,
+EDGE_INTERNAL = _material(
     url="git@github.com:edx/edge-internal.git",
     branch="master",
     material_name="edge-internal",
-    polling=True,
     destination_directory="edge-internal",
     ignore_patterns=['**/*'],
 )
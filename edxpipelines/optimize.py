@@ -0,0 +1,333 @@
+"""
+Optimizations applied to generated pipelines before they are saved.
+
+Stage fusion merges consecutive stages of a pipeline into a single job, so
+that their work runs on one agent: each stage boundary otherwise costs a round
+of agent scheduling, another checkout and requirements install, and an upload
+and download of every artifact handed from one stage to the next.
+
+Two adjacent stages are only fused if nothing can tell the difference:
+
+- the second stage runs automatically (it has no manual approval);
+- each stage has a single job, which isn't run on several agents;
+- no other pipeline (or template) uses either stage, as a material or to fetch artifacts from;
+- both stages and jobs have the same settings and resources, and their tasks
+  see the same environment variables;
+- every task of the second job only runs if the earlier tasks passed;
+- the jobs publish different artifacts, none inside another, so that neither
+  job's output overwrites or mixes with the other's in the fused job (two
+  migration jobs that both write ``target/migrations``, say, aren't fused).
+  The one exception is the ansible output directory, whose files are named
+  by the commands that write them: the jobs only share it if their commands
+  write different files;
+- everything the second job fetches from the first can be found in the
+  first job's working directory.
+
+Fetches from the first job become local copies (or are dropped, if the file is
+already where the fetch would put it), the second job's requirements are added
+to the first job's virtualenv, and fetches by later stages from the second job
+are pointed at the fused job.
+
+Fusion is opt-in per pipeline: see ``IndexedPipeline.enable_stage_fusion``. It
+needs the complete server config, to find the pipelines that use each stage.
+"""
+from collections import OrderedDict
+import posixpath
+import re
+from xml.etree import ElementTree
+
+from edxpipelines import constants, virtualenvs
+from edxpipelines.consistency import SystemIndex
+
+# The order of the children of a job, in the GoCD schema.
+JOB_CHILDREN = ('environmentvariables', 'tasks', 'tabs', 'resources', 'artifacts', 'properties')
+# Job attributes that can differ between fused jobs.
+MERGED_JOB_ATTRIBUTES = ('name', 'timeout')
+# The files that a task writes to the ansible output directory (see patterns.tasks.ansible_playbook_command).
+ANSIBLE_OUTPUT_FILE = re.compile(r'ANSIBLE_OUTPUT_FILE=\S*?/{}/([^/;\s]+)'.format(re.escape(constants.ANSIBLE_OUTPUT_PATH)))
+
+
+def _key(element):
+    """
+    A comparable summary of ``element``: its tag, attributes, text and (recursively) children.
+    """
+    return element.tag, sorted(element.attrib.items()), (element.text or '').strip(), [_key(child) for child in element]
+
+
+def _variables(*elements):
+    """
+    Environment variable name -> (value, or encrypted value) of the variables set on ``elements``, each
+    of which overrides the ones before it.
+    """
+    variables = {}
+    for element in elements:
+        for variable in element.findall('environmentvariables/variable'):
+            variables[variable.get('name')] = _key(variable)
+    return variables
+
+
+def _fetch_pipeline(pipeline_name, fetch):
+    """
+    The name of the pipeline that ``fetch`` (a fetchartifact element in ``pipeline_name``) fetches from.
+    """
+    return (fetch.get('pipeline') or pipeline_name).split('/')[0]
+
+
+def _local_copy(fetch, job):
+    """
+    The path in the working directory of ``job`` that ``fetch`` would download, and where the fetch puts it.
+
+    Returns:
+        (str, str): the path and the destination of the fetch, or None if the
+            fetched path isn't an artifact of ``job``
+    """
+    source = (fetch.get('srcfile') or fetch.get('srcdir') or '').strip('/')
+    for artifact in job.findall('artifacts/*'):
+        src = artifact.get('src', '').rstrip('/')
+        if '*' in src:
+            continue
+        uploaded = posixpath.join(artifact.get('dest') or '', posixpath.basename(src))
+        if source == uploaded or source.startswith(uploaded + '/'):
+            destination = posixpath.join(fetch.get('dest') or '', posixpath.basename(source))
+            return src + source[len(uploaded):], destination
+    return None
+
+
+def _copy_task(path, destination, is_dir):
+    """
+    An exec task element that copies ``path`` to ``destination``, in the working directory.
+    """
+    task = ElementTree.Element('exec', command='/bin/bash')
+    ElementTree.SubElement(task, 'arg').text = '-c'
+    ElementTree.SubElement(task, 'arg').text = 'mkdir -p {} && cp {}{} {}'.format(
+        posixpath.dirname(destination) or '.', '-r ' if is_dir else '', path, destination,
+    )
+    ElementTree.SubElement(task, 'runif', status='passed')
+    return task
+
+
+def _artifacts_overlap(first_job, second_job):
+    """
+    Whether an artifact of ``first_job`` and one of ``second_job`` are uploaded from, or to, the same path,
+    or one inside the other.
+    """
+    def paths(job):
+        for artifact in job.findall('artifacts/*'):
+            src = posixpath.normpath(artifact.get('src', ''))
+            if src == constants.ANSIBLE_OUTPUT_PATH and not artifact.get('dest'):
+                continue
+            yield 'src', src.split('*')[0].rstrip('/') if '*' in src else src
+            yield 'dest', posixpath.normpath(posixpath.join(artifact.get('dest') or '', posixpath.basename(src)))
+
+    def within(path, other):
+        return path == other or path.startswith(other + '/') or other.startswith(path + '/') or not path or not other
+
+    def ansible_output(job):
+        return set(
+            name for arg in job.findall('tasks/exec/arg') for name in ANSIBLE_OUTPUT_FILE.findall(arg.text or '')
+        )
+
+    return bool(ansible_output(first_job) & ansible_output(second_job)) or any(
+        kind == other_kind and within(path, other)
+        for kind, path in paths(first_job)
+        for other_kind, other in paths(second_job)
+    )
+
+
+def _runs_after_failure(task):
+    return any(runif.get('status') != 'passed' for runif in task.findall('runif'))
+
+
+def _job(stage):
+    """
+    The only job of ``stage``, or None if it has several, or runs on several agents.
+    """
+    jobs = stage.findall('jobs/job')
+    if len(jobs) != 1 or jobs[0].get('runInstanceCount') or jobs[0].get('runOnAllAgents') == 'true':
+        return None
+    return jobs[0]
+
+
+def _can_fuse(pipeline_name, first, second, consumed):
+    """
+    Whether the ``second`` stage can be fused into the ``first``, the stage before it.
+    """
+    approval = second.find('approval')
+    if approval is not None and approval.get('type') == 'manual':
+        return False
+    if first.get('name') in consumed or second.get('name') in consumed:
+        return False
+    first_job, second_job = _job(first), _job(second)
+    if first_job is None or second_job is None:
+        return False
+    if dict(first.attrib, name=None) != dict(second.attrib, name=None):
+        return False
+    if any(first_job.get(name) != second_job.get(name) for name in set(first_job.attrib) | set(second_job.attrib)
+           if name not in MERGED_JOB_ATTRIBUTES):
+        return False
+    if sorted(resource.text for resource in first_job.findall('resources/resource')) != sorted(
+            resource.text for resource in second_job.findall('resources/resource')):
+        return False
+    if _variables(first, first_job) != _variables(second, second_job):
+        return False
+    if _artifacts_overlap(first_job, second_job):
+        return False
+
+    for task in second_job.findall('tasks/*'):
+        if _runs_after_failure(task):
+            return False
+        if (task.tag == 'fetchartifact' and _fetch_pipeline(pipeline_name, task) == pipeline_name and
+                task.get('stage') == first.get('name') and _local_copy(task, first_job) is None):
+            return False
+    return True
+
+
+def _child(job, tag):
+    """
+    The ``tag`` child of ``job``, added in schema order if it isn't there.
+    """
+    element = job.find(tag)
+    if element is None:
+        position = len([
+            child for child in job
+            if child.tag in JOB_CHILDREN and JOB_CHILDREN.index(child.tag) < JOB_CHILDREN.index(tag)
+        ])
+        element = ElementTree.Element(tag)
+        job.insert(position, element)
+    return element
+
+
+def _fuse(pipeline, first, second):
+    """
+    Move the job of the ``second`` stage of ``pipeline`` into the job of the ``first``.
+    """
+    pipeline_name = pipeline.get('name')
+    first_job, second_job = _job(first), _job(second)
+
+    known = {variable.get('name') for variable in first_job.findall('environmentvariables/variable')}
+    for variable in second.findall('environmentvariables/variable') + second_job.findall(
+            'environmentvariables/variable'):
+        if variable.get('name') not in known:
+            known.add(variable.get('name'))
+            _child(first_job, 'environmentvariables').append(variable)
+
+    tasks = _child(first_job, 'tasks')
+    for task in second_job.findall('tasks/*'):
+        if (task.tag == 'fetchartifact' and _fetch_pipeline(pipeline_name, task) == pipeline_name and
+                task.get('stage') == first.get('name')):
+            path, destination = _local_copy(task, first_job)
+            if posixpath.normpath(path) == posixpath.normpath(destination):
+                continue
+            task = _copy_task(path, destination, task.get('srcdir') is not None)
+        dirs = virtualenvs.installed_dirs(task)
+        if dirs is not None and virtualenvs.add_requirements(first_job, dirs) is not None:
+            # The job has a single virtualenv, which BASH_ENV activates.
+            continue
+        tasks.append(task)
+
+    for tag in ('tabs', 'resources', 'artifacts'):
+        existing = [_key(child) for child in first_job.findall(tag + '/*')]
+        for child in second_job.findall(tag + '/*'):
+            if _key(child) not in existing:
+                _child(first_job, tag).append(child)
+
+    if first_job.get('timeout') and second_job.get('timeout'):
+        first_job.set('timeout', str(int(first_job.get('timeout')) + int(second_job.get('timeout'))))
+
+    # Later stages fetch what the second job published from the fused job.
+    for stage in pipeline.findall('stage'):
+        for fetch in stage.findall('jobs/job/tasks/fetchartifact'):
+            if _fetch_pipeline(pipeline_name, fetch) == pipeline_name and fetch.get('stage') == second.get('name'):
+                fetch.set('stage', first.get('name'))
+                fetch.set('job', first_job.get('name'))
+    pipeline.remove(second)
+
+
+def fuse_stages(pipeline, consumed=()):
+    """
+    Fuse the consecutive stages of a pipeline element that can run as one job.
+
+    Args:
+        pipeline (Element): the pipeline element to change
+        consumed (set of str): the stages of the pipeline that other pipelines depend on
+
+    Returns:
+        list of list of str: the names of each run of stages that was fused into one (the first of them)
+    """
+    fused = []
+    stages = pipeline.findall('stage')
+    position = 0
+    while position < len(stages) - 1:
+        first, second = stages[position], stages[position + 1]
+        if _can_fuse(pipeline.get('name'), first, second, consumed):
+            _fuse(pipeline, first, second)
+            del stages[position + 1]
+            if fused and fused[-1][0] == first.get('name'):
+                fused[-1].append(second.get('name'))
+            else:
+                fused.append([first.get('name'), second.get('name')])
+        else:
+            position += 1
+    return fused
+
+
+def consumed_stages(pipelines, templates=()):
+    """
+    The stages of each pipeline that other pipelines use as a material, or fetch artifacts from.
+
+    Pipelines built from a template fetch what the template's stages fetch. Every stage of a pipeline
+    that a pipeline with an unknown template depends on is taken to be consumed.
+
+    Args:
+        pipelines (iterable of Element): every pipeline of the config
+        templates (iterable of Element): every template of the config
+
+    Returns:
+        dict: pipeline name -> set of stage names
+    """
+    index = SystemIndex()
+    for template in templates:
+        index.add_template(template)
+    for pipeline in pipelines:
+        index.add_pipeline(pipeline)
+    consumed = {}
+    for reference in index.references:
+        if reference.stage is None:
+            upstream, stage = reference.element.get('pipelineName'), reference.element.get('stageName')
+        else:
+            upstream, stage = _fetch_pipeline(reference.pipeline, reference.element), reference.element.get('stage')
+        if upstream != reference.pipeline:
+            consumed.setdefault(upstream, set()).add(stage)
+            if index.pipelines[reference.pipeline].unresolved and upstream in index.pipelines:
+                # What it fetches is unknown.
+                consumed[upstream].update(index.pipelines[upstream].stages)
+    return consumed
+
+
+def optimize_pipelines(configurator, complete=True):
+    """
+    Fuse the stages of the pipelines of ``configurator`` that have stage fusion enabled.
+
+    Args:
+        configurator (IndexedConfigurator): the configurator, with every pipeline generated
+        complete (bool): whether ``configurator`` holds the complete server config. Which stages other
+            pipelines use can only be told from the complete config, so nothing is fused without it.
+
+    Returns:
+        OrderedDict: pipeline name -> the stages that were fused (see ``fuse_stages``), for each changed pipeline
+    """
+    results = OrderedDict()
+    if not configurator.stage_fusion or not complete:
+        return results
+
+    pipelines = [pipeline for group in configurator.pipeline_groups for pipeline in group.element.findall('pipeline')]
+    consumed = consumed_stages(pipelines, [template.element for template in configurator.templates])
+    for pipeline in pipelines:
+        name = pipeline.get('name')
+        if name in configurator.stage_fusion:
+            fused = fuse_stages(pipeline, consumed.get(name, ()))
+            if fused:
+                results[name] = fused
+                configurator.index.invalidate(pipeline)
+                configurator.artifact_registry.invalidate(name)
+    return results
@@ -0,0 +1,137 @@
+"""
+Saving only some of the pipelines generated by a script.
+
+Scripts such as cd_edxapp_latest.py generate many interdependent pipelines in
+one ``install_pipelines`` call. With ``--only``, the script still runs in
+full (so that every pipeline the selected ones depend on is generated, and
+their references can be checked), but every other change it made is undone
+before the config is saved, so that only the selected pipelines are pushed
+and show up in the diff.
+"""
+from xml.etree import ElementTree
+
+from edxpipelines.consistency import SystemIndex
+
+
+class PartialGenerationError(Exception):
+    pass
+
+
+def _pipelines_by_name(root):
+    """
+    Pipeline name -> (group name, position in the group, element), for the stdlib ``root`` of a config.
+    """
+    return {
+        pipeline.get('name'): (group.get('group'), list(group).index(pipeline), pipeline)
+        for group in root.findall('pipelines')
+        for pipeline in group.findall('pipeline')
+    }
+
+
+def restore_pipelines(configurator, names, original):
+    """
+    Put the pipelines called ``names`` back as they were, in a gomatic configurator.
+
+    Args:
+        configurator (GoCdConfigurator): the configurator to change
+        names (iterable of str): the pipelines to restore
+        original (callable): returns the group name, position in the group and a stdlib
+            element to insert for a pipeline, or None if it didn't exist
+    """
+    groups = {group.name: group for group in configurator.pipeline_groups}
+    for name in names:
+        for group in groups.values():
+            for element in group.element.findall('pipeline'):
+                if element.get('name') == name:
+                    group.element.remove(element)
+        previous = original(name)
+        if previous is not None:
+            group_name, position, element = previous
+            if group_name not in groups:
+                groups[group_name] = configurator.ensure_pipeline_group(group_name)
+            groups[group_name].element.insert(position, element)
+
+
+def upstream_closure(configurator, names):
+    """
+    The pipelines that ``names`` depend on, directly or indirectly, through materials or fetched artifacts.
+
+    Returns:
+        set of str: the names of the upstream pipelines (not including ``names``)
+    """
+    index = SystemIndex()
+    for group in configurator.pipeline_groups:
+        for pipeline in group.element.findall('pipeline'):
+            index.add_pipeline(pipeline)
+
+    upstreams = {}
+    for reference in index.references:
+        if reference.stage is None:
+            upstream = [reference.element.get('pipelineName')]
+        else:
+            upstream = (reference.element.get('pipeline') or reference.pipeline).split('/')
+        upstreams.setdefault(reference.pipeline, set()).update(upstream)
+
+    closure = set()
+    pending = list(names)
+    while pending:
+        for upstream in upstreams.get(pending.pop(), ()):
+            if upstream not in closure and upstream not in names:
+                closure.add(upstream)
+                pending.append(upstream)
+    return closure
+
+
+def select_pipelines(configurator, initial_config, names, check_upstreams=True):
+    """
+    Undo every change that a script made through ``configurator``, except to the pipelines called ``names``.
+
+    Pipeline groups that existed in ``initial_config`` keep their original
+    permissions, and groups that the script created are removed unless one of
+    the selected pipelines is in them.
+
+    Args:
+        configurator (IndexedConfigurator): the configurator the script ran against
+        initial_config (str): the config xml before the script ran
+        names (iterable of str): the pipelines to keep
+        check_upstreams (bool): whether to require the upstream pipelines of ``names`` to be in ``initial_config``
+
+    Returns:
+        set of str: the upstream pipelines that the selected ones were generated with
+
+    Raises:
+        PartialGenerationError: if a selected pipeline wasn't generated by the
+            script, or (if ``check_upstreams``) needs an upstream pipeline that isn't in ``initial_config``
+    """
+    names = set(names)
+    unknown = names - set(configurator.changed_pipelines)
+    if unknown:
+        raise PartialGenerationError('The script does not generate {}. It generates: {}'.format(
+            ', '.join(sorted(unknown)), ', '.join(configurator.changed_pipelines),
+        ))
+
+    initial_root = ElementTree.fromstring(initial_config)
+    initial_pipelines = _pipelines_by_name(initial_root)
+    closure = upstream_closure(configurator, names)
+    missing = sorted(name for name in closure if name not in initial_pipelines)
+    if check_upstreams and missing:
+        raise PartialGenerationError(
+            '{} needs {}, which is not on the server yet. Select it too, with --only.'.format(
+                ', '.join(sorted(names)), ', '.join(missing),
+            )
+        )
+
+    restore_pipelines(
+        configurator, [name for name in configurator.changed_pipelines if name not in names], initial_pipelines.get,
+    )
+
+    initial_groups = {group.get('group'): group for group in initial_root.findall('pipelines')}
+    for group in configurator.pipeline_groups:
+        if group.name in initial_groups:
+            for authorization in group.element.findall('authorization'):
+                group.element.remove(authorization)
+            for position, authorization in enumerate(initial_groups[group.name].findall('authorization')):
+                group.element.insert(position, authorization)
+        elif not group.element.findall('pipeline'):
+            configurator.ensure_removal_of_pipeline_group(group.name)
+    return closure
@@ -8,6 +8,7 @@ from gomatic import *
 sys.path.append(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
 
 from edxpipelines import utils
+from edxpipelines.artifacts import UnpublishedArtifact
 from edxpipelines.patterns import stages
 from edxpipelines.patterns import tasks
 from edxpipelines.patterns import pipelines
@@ -82,12 +83,16 @@ def prerelease_materials(edxapp_group, config):
 def build_migrate_deploy_subset_pipeline(
         pipeline_group, stage_builders, config,
         pipeline_name, ami_artifact=None, auto_run=False,
-        post_cleanup_builders=None):
+        post_cleanup_builders=None, reuse_ami=False):
     """
     Arguments:
         ami_artifact (ArtifactLocation): The ami to use to launch the
             instances on. If None, select that ami based on the
             edx_deployment and edx_environment.
+        reuse_ami (bool): Skip building the AMI when one was built from the
+            same inputs before (see stages.skip_build_when_ami_reused). Only
+            for pipelines that build an AMI, and don't use the instance to
+            do anything else.
 
     Variables needed for this pipeline:
     - aws_access_key_id
@@ -100,8 +105,13 @@ def build_migrate_deploy_subset_pipeline(
     Optional variables:
     - configuration_secure_version
     - configuration_internal_version
+    - fuse_stages: run consecutive automatic stages as one job (see edxpipelines.optimize)
+    - ansible_options: how ansible runs, and whether the migrations reuse the facts of the play
+      (see pipelines.apply_ansible_options)
     """
     pipeline = pipeline_group.ensure_replacement_of_pipeline(pipeline_name)
+    if config.get('fuse_stages', False):
+        pipeline.enable_stage_fusion()
 
     base_ami_id = config.get('base_ami_id')
 
@@ -125,6 +135,9 @@ def build_migrate_deploy_subset_pipeline(
             FetchArtifactFile(constants.BASE_AMI_OVERRIDE_FILENAME),
         )
 
+    if reuse_ami:
+        stages.generate_find_reusable_ami(pipeline, ami_artifact)
+
     launch_stage = stages.generate_launch_instance(
         pipeline,
         config['aws_access_key_id'],
@@ -144,10 +157,30 @@ def build_migrate_deploy_subset_pipeline(
     # Add the cleanup stage
     generate_cleanup_stages(pipeline, config, launch_stage)
 
+    if reuse_ami:
+        build_stages = [
+            constants.LAUNCH_INSTANCE_STAGE_NAME,
+            constants.RUN_PLAY_STAGE_NAME,
+            constants.BUILD_AMI_STAGE_NAME,
+            constants.TERMINATE_INSTANCE_STAGE_NAME,
+        ]
+        other_stages = [
+            stage.name for stage in pipeline.stages
+            if stage.name not in build_stages + [
+                constants.BASE_AMI_SELECTION_STAGE_NAME, constants.FIND_REUSABLE_AMI_STAGE_NAME
+            ]
+        ]
+        if other_stages:
+            raise ValueError('{} uses the instance in {}, so it must build its AMI every time'.format(
+                pipeline.name, ', '.join(other_stages)
+            ))
+        stages.skip_build_when_ami_reused(pipeline, build_stages)
+
     if post_cleanup_builders:
         for builder in post_cleanup_builders:
             builder(pipeline, config)
 
+    pipelines.apply_ansible_options(pipeline, config)
     return pipeline
 
 
@@ -174,7 +207,8 @@ def generate_build_stages(app_repo, theme_url, configuration_secure_repo,
             edxapp_theme_name='$EDXAPP_THEME_NAME',
             disable_edx_services='true',
             COMMON_TAG_EC2_INSTANCE='true',
-            cache_id='$GO_PIPELINE_COUNTER'
+            cache_id='$GO_PIPELINE_COUNTER',
+            fact_cache=config.get('ansible_options', {}).get('fact_caching', False)
         )
 
         stages.generate_create_ami_from_instance(
@@ -206,30 +240,26 @@ def generate_migrate_stages(pipeline, config):
     #
     # Create the DB migration running stage.
     #
-    ansible_inventory_location = utils.ArtifactLocation(
-        pipeline.name,
-        constants.LAUNCH_INSTANCE_STAGE_NAME,
-        constants.LAUNCH_INSTANCE_JOB_NAME,
-        'ansible_inventory'
-    )
-    instance_ssh_key_location = utils.ArtifactLocation(
-        pipeline.name,
-        constants.LAUNCH_INSTANCE_STAGE_NAME,
-        constants.LAUNCH_INSTANCE_JOB_NAME,
-        'key.pem'
-    )
-    launch_info_location = utils.ArtifactLocation(
-        pipeline.name,
-        constants.LAUNCH_INSTANCE_STAGE_NAME,
-        constants.LAUNCH_INSTANCE_JOB_NAME,
-        constants.LAUNCH_INSTANCE_FILENAME
-    )
+    # The launch stage publishes these, so they're found in the pipeline's artifact registry.
+    locate = pipeline.artifact_registry.locate
+    ansible_inventory_location = locate(pipeline.name, 'ansible_inventory')
+    instance_ssh_key_location = locate(pipeline.name, 'key.pem')
+    launch_info_location = locate(pipeline.name, constants.LAUNCH_INSTANCE_FILENAME)
+    instance_access_location = locate(pipeline.name, constants.INSTANCE_ACCESS_FILENAME)
+    # The facts are only there to reuse if the play ran in this pipeline, with fact caching on.
+    fact_cache_location = None
+    if config.get('ansible_options', {}).get('fact_caching', False):
+        try:
+            fact_cache_location = locate(pipeline.name, constants.ANSIBLE_FACT_CACHE_NAME)
+        except UnpublishedArtifact:
+            pass
     # Check the migration duration on the stage environment only.
     if pipeline.name.startswith('STAGE'):
         duration_threshold = config['migration_duration_threshold']
     else:
         duration_threshold = None
 
+    # The lms and cms share a database, so their migrations run one after the other, in a stage each.
     for sub_app in config['edxapp_subapps']:
         stages.generate_run_migrations(
             pipeline,
@@ -243,7 +273,9 @@ def generate_migrate_stages(pipeline, config):
             sub_application_name=sub_app,
             duration_threshold=duration_threshold,
             from_address=config['alert_from_address'],
-            to_addresses=config['alert_to_addresses']
+            to_addresses=config['alert_to_addresses'],
+            instance_access_location=instance_access_location,
+            fact_cache_location=fact_cache_location
         )
 
     return pipeline
@@ -254,12 +286,7 @@ def generate_deploy_stages(pipeline_name_build, auto_deploy_ami=False):
     # Create the stage to deploy the AMI.
     #
     def builder(pipeline, config):
-        built_ami_file_location = utils.ArtifactLocation(
-            pipeline_name_build,
-            constants.BUILD_AMI_STAGE_NAME,
-            constants.BUILD_AMI_JOB_NAME,
-            constants.BUILD_AMI_FILENAME,
-        )
+        built_ami_file_location = pipeline.artifact_registry.locate(pipeline_name_build, constants.BUILD_AMI_FILENAME)
         stages.generate_deploy_ami(
             pipeline,
             config['asgard_api_endpoints'],
@@ -270,11 +297,8 @@ def generate_deploy_stages(pipeline_name_build, auto_deploy_ami=False):
             manual_approval=not auto_deploy_ami
         )
 
-        base_ami_file_location = utils.ArtifactLocation(
-            pipeline_name_build,
-            constants.BASE_AMI_SELECTION_STAGE_NAME,
-            constants.BASE_AMI_SELECTION_JOB_NAME,
-            constants.BASE_AMI_OVERRIDE_FILENAME
+        base_ami_file_location = pipeline.artifact_registry.locate(
+            pipeline_name_build, constants.BASE_AMI_OVERRIDE_FILENAME
         )
 
         pipeline.ensure_unencrypted_secure_environment_variables({'GITHUB_TOKEN': config['github_token']})
@@ -343,6 +367,7 @@ def manual_verification(edxapp_deploy_group, config):
     manual_verification_stage = pipeline.ensure_stage(constants.MANUAL_VERIFICATION_STAGE_NAME)
     manual_verification_stage.set_has_manual_approval()
     manual_verification_job = manual_verification_stage.ensure_job(constants.MANUAL_VERIFICATION_JOB_NAME)
+    stages.set_job_class(manual_verification_job, stages.JobClass.LIGHT)
     manual_verification_job.add_task(
         ExecTask(
             [
@@ -375,7 +400,8 @@ def generate_e2e_test_stage(pipeline, config):
     jenkins_url = "https://build.testeng.edx.org"
 
     e2e_tests = jenkins_stage.ensure_job('edx-e2e-test')
-    tasks.generate_requirements_install(e2e_tests, 'tubular')
+    stages.set_job_class(e2e_tests, stages.JobClass.LONG_WAIT)
+    tasks.generate_virtualenv_install(e2e_tests, ['tubular'])
     tasks.trigger_jenkins_build(
         e2e_tests,
         jenkins_url,
@@ -386,7 +412,8 @@ def generate_e2e_test_stage(pipeline, config):
     )
 
     microsites_tests = jenkins_stage.ensure_job('microsites-staging-tests')
-    tasks.generate_requirements_install(microsites_tests, 'tubular')
+    stages.set_job_class(microsites_tests, stages.JobClass.LONG_WAIT)
+    tasks.generate_virtualenv_install(microsites_tests, ['tubular'])
     tasks.trigger_jenkins_build(
         microsites_tests,
         jenkins_url,
@@ -504,8 +531,13 @@ def merge_back_branches(edxapp_deploy_group, pipeline_name, deploy_artifact, con
         release_to_master_branch
         master_branch
         github_token
+
+    Configuration Optional:
+        fuse_stages: run consecutive automatic stages as one job (see edxpipelines.optimize)
     """
     pipeline = edxapp_deploy_group.ensure_replacement_of_pipeline(pipeline_name)
+    if config.get('fuse_stages', False):
+        pipeline.enable_stage_fusion()
 
     for material in (
         TUBULAR, CONFIGURATION, EDX_PLATFORM, EDX_SECURE, EDGE_SECURE,
@@ -6,6 +6,44 @@ from gomatic.gocd.materials import PipelineMaterial
 from edxpipelines import utils
 from edxpipelines import constants
 from edxpipelines.patterns import stages
+from edxpipelines.patterns import tasks
+
+
+def apply_ansible_options(pipeline, config):
+    """
+    Set the ansible options of ``pipeline``, and of its stages, from its config.
+
+    Optional variables:
+    - ansible_options:
+        verbosity: number of -v flags to pass to ansible-playbook (default: constants.ANSIBLE_VERBOSITY)
+        output: one of constants.ANSIBLE_OUTPUTS (default: console)
+        pipelining, forks, strategy: see tasks.ensure_ansible_options (default: from ansible.cfg)
+        stages: stage name -> any of the options above, for stages of the pipeline that need
+            something else
+        fact_caching: reuse the facts the run_play stage gathers in the migration stages (read by the
+            pipeline patterns, which pass it to the stages)
+
+    Args:
+        pipeline (gomatic.Pipeline): the pipeline, with its stages generated
+        config (dict): the pipeline's config
+
+    Returns:
+        gomatic.Pipeline
+    """
+    def ensure_options(environment, options, **defaults):
+        tasks.ensure_ansible_options(environment, **{
+            name: options.get(name, defaults.get(name))
+            for name in ('verbosity', 'output', 'pipelining', 'forks', 'strategy')
+        })
+
+    options = config.get('ansible_options', {})
+    ensure_options(pipeline, options, verbosity=constants.ANSIBLE_VERBOSITY, output='console')
+    # The stage options are shared by every pipeline the config is used for, which don't all have every stage.
+    stage_names = set(stage.name for stage in pipeline.stages)
+    for stage_name, stage_options in sorted(options.get('stages', {}).items()):
+        if stage_name in stage_names:
+            ensure_options(pipeline.ensure_stage(stage_name), stage_options)
+    return pipeline
 
 
 def generate_deploy_pipeline(configurator,
@@ -87,6 +125,7 @@ def generate_basic_multistage_pipeline(
     application_path = '/edx/app/' + service_name
     application_user = service_name
     hipchat_token = config['hipchat_token']
+    fact_cache = config.get('ansible_options', {}).get('fact_caching', False)
 
     pipeline = configurator.ensure_pipeline_group(pipeline_group) \
         .ensure_replacement_of_pipeline('-'.join([environment, deployment, play])) \
@@ -170,6 +209,7 @@ def generate_basic_multistage_pipeline(
                              hipchat_room=hipchat_room,
                              disable_edx_services='true',
                              COMMON_TAG_EC2_INSTANCE='true',
+                             fact_cache=fact_cache,
                              **kwargs
                              )
 
@@ -210,6 +250,18 @@ def generate_basic_multistage_pipeline(
         constants.LAUNCH_INSTANCE_JOB_NAME,
         'launch_info.yml'
     )
+    instance_access_location = utils.ArtifactLocation(
+        pipeline.name,
+        constants.LAUNCH_INSTANCE_STAGE_NAME,
+        constants.LAUNCH_INSTANCE_JOB_NAME,
+        constants.INSTANCE_ACCESS_FILENAME
+    )
+    fact_cache_location = utils.ArtifactLocation(
+        pipeline.name,
+        constants.RUN_PLAY_STAGE_NAME,
+        constants.RUN_PLAY_JOB_NAME,
+        constants.ANSIBLE_FACT_CACHE_NAME
+    ) if fact_cache else None
 
     if not skip_migrations:
         stages.generate_run_migrations(pipeline,
@@ -219,7 +271,9 @@ def generate_basic_multistage_pipeline(
                                        launch_info_location,
                                        application_user=application_user,
                                        application_name=application_name,
-                                       application_path=application_path
+                                       application_path=application_path,
+                                       instance_access_location=instance_access_location,
+                                       fact_cache_location=fact_cache_location
                                        )
 
     # Run post-migration stages/tasks
@@ -233,7 +287,8 @@ def generate_basic_multistage_pipeline(
             application_name=application_name,
             application_path=application_path,
             hipchat_token=hipchat_token,
-            hipchat_room=hipchat_room
+            hipchat_room=hipchat_room,
+            instance_access_location=instance_access_location
         )
 
     # Deploy the AMI (after user manually approves)
@@ -269,3 +324,5 @@ def generate_basic_multistage_pipeline(
         hipchat_token=hipchat_token,
         runif='any'
     )
+
+    apply_ansible_options(pipeline, config)
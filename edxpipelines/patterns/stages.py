@@ -1,6 +1,11 @@
+import hashlib
+import json
+
 from gomatic import *
 
 from edxpipelines import constants
+from edxpipelines import utils
+from edxpipelines.job_classes import JobClass, set_job_class
 from edxpipelines.patterns import tasks
 
 
@@ -38,11 +43,13 @@ def generate_asg_cleanup(pipeline,
         stage.set_has_manual_approval()
 
     job = stage.ensure_job("Cleanup-ASGS")
-    tasks.generate_requirements_install(job, 'tubular')
+    set_job_class(job, JobClass.LIGHT)
+    tasks.generate_virtualenv_install(job, ['tubular'])
     job.add_task(ExecTask(
         [
-            '/usr/bin/python',
-            'scripts/cleanup-asgs.py'
+            '/bin/bash',
+            '-c',
+            'python scripts/cleanup-asgs.py'
         ],
         working_dir="tubular")
     )
@@ -100,7 +107,8 @@ def generate_base_ami_selection(pipeline,
 
     # Install the requirements.
     job = stage.ensure_job(constants.BASE_AMI_SELECTION_JOB_NAME)
-    tasks.generate_requirements_install(job, 'tubular')
+    set_job_class(job, JobClass.LIGHT)
+    tasks.generate_virtualenv_install(job, ['tubular'])
 
     # Generate an base-AMI-ID-overriding artifact.
     base_ami_override_artifact = '{artifact_path}/{file_name}'.format(
@@ -116,10 +124,10 @@ def generate_base_ami_selection(pipeline,
                 'mkdir -p {artifact_path};'
                 'if [[ $BASE_AMI_ID_OVERRIDE != \'yes\' ]];'
                 '  then echo "Finding base AMI ID from active ELB/ASG in EDP.";'
-                '  /usr/bin/python {ami_script} --environment $EDX_ENVIRONMENT --deployment $DEPLOYMENT --play $PLAY --out_file {override_artifact};'
+                '  python {ami_script} --environment $EDX_ENVIRONMENT --deployment $DEPLOYMENT --play $PLAY --out_file {override_artifact};'
                 'elif [[ -n $BASE_AMI_ID ]];'
                 '  then echo "Using specified base AMI ID of \'$BASE_AMI_ID\'";'
-                '  /usr/bin/python {ami_script} --override $BASE_AMI_ID --out_file {override_artifact};'
+                '  python {ami_script} --override $BASE_AMI_ID --out_file {override_artifact};'
                 'else echo "Using environment base AMI ID";'
                 '  echo "{empty_dict}" > {override_artifact}; fi;'.format(
                     artifact_path='../' + constants.ARTIFACT_PATH,
@@ -135,6 +143,132 @@ def generate_base_ami_selection(pipeline,
     return stage
 
 
+def generate_find_reusable_ami(pipeline, base_ami_artifact=None, manual_approval=False):
+    """
+    Pattern to look for an AMI that was built from the same inputs as this run of the pipeline, to reuse instead of
+    building another (see skip_build_when_ami_reused). Generates 1 artifact:
+        ami_reuse.yml   - the fingerprint of the build inputs, and the id of the AMI built from them, if there is one
+
+    Args:
+        pipeline (gomatic.Pipeline):
+        base_ami_artifact (edxpipelines.utils.ArtifactLocation): the base AMI the instance will be launched from,
+            such as the ami_override.yml of generate_base_ami_selection, if it isn't the pipeline's BASE_AMI_ID
+        manual_approval (bool): Should this stage require manual approval?
+
+    Returns:
+        gomatic.Stage
+    """
+    stage = pipeline.ensure_stage(constants.FIND_REUSABLE_AMI_STAGE_NAME)
+    if manual_approval:
+        stage.set_has_manual_approval()
+
+    job = stage.ensure_job(constants.FIND_REUSABLE_AMI_JOB_NAME)
+    set_job_class(job, JobClass.LIGHT)
+    input_files = []
+    if base_ami_artifact:
+        job.add_task(
+            FetchArtifactTask(
+                pipeline=base_ami_artifact.pipeline,
+                stage=base_ami_artifact.stage,
+                job=base_ami_artifact.job,
+                src=base_ami_artifact.file_name,
+                dest=constants.ARTIFACT_PATH,
+            )
+        )
+        _, file_name = base_ami_artifact.file_name.as_xml_type_and_value
+        input_files.append('{}/{}'.format(constants.ARTIFACT_PATH, file_name))
+    tasks.generate_find_reusable_ami(job, input_files)
+    return stage
+
+
+def _build_config_hash(pipeline, stage_names):
+    """
+    A hash of everything in the generated config of ``pipeline`` that can change the AMI its ``stage_names``
+    stages build: the tasks of their jobs, the plain environment variables (secure ones can't be read), and
+    the git materials of the pipeline.
+    """
+    def summary(element):
+        return [element.tag, sorted(element.attrib.items()), (element.text or '').strip(), [
+            summary(child) for child in element
+            if not (child.tag == 'variable' and child.get('secure') == 'true')
+        ]]
+
+    config = [
+        summary(element) for element in pipeline.element.findall('environmentvariables') +
+        pipeline.element.findall('materials/git')
+    ]
+    for stage_name in stage_names:
+        stage = pipeline.ensure_stage(stage_name)
+        config.append([stage_name] + [summary(element) for element in stage.element.findall('environmentvariables')])
+        for job in stage.jobs:
+            config.append([
+                summary(element) for element in job.element.findall('environmentvariables') +
+                job.element.findall('tasks')
+            ])
+    return hashlib.sha1(json.dumps(config, sort_keys=True)).hexdigest()
+
+
+def skip_build_when_ami_reused(pipeline, stage_names):
+    """
+    Make the jobs of the ``stage_names`` stages of ``pipeline`` do nothing when generate_find_reusable_ami found an
+    AMI to reuse, except publish empty artifacts, and have the build_ami job publish the reused AMI in its ami.yml.
+    When there's no AMI to reuse, the build_ami job tags the AMI it built for later runs to reuse.
+
+    GoCD always runs every stage, so each bash task of the jobs checks the ami_reuse.yml artifact first. Only
+    build pipelines can skip their stages: later stages of the pipeline can't use the instance it didn't launch.
+
+    The generated config of the stages (their tasks, and the variables and materials they see) is hashed into
+    the fingerprint, so that an AMI is only reused by pipelines that would build it the same way.
+
+    Args:
+        pipeline (gomatic.Pipeline): a pipeline with a generate_find_reusable_ami stage
+        stage_names (list): the stages that launch, provision, bake and clean up the instance
+
+    Returns:
+        gomatic.Pipeline
+    """
+    reuse_location = utils.ArtifactLocation(
+        pipeline.name,
+        constants.FIND_REUSABLE_AMI_STAGE_NAME,
+        constants.FIND_REUSABLE_AMI_JOB_NAME,
+        constants.AMI_REUSE_FILENAME,
+    )
+    pipeline.ensure_stage(constants.FIND_REUSABLE_AMI_STAGE_NAME).ensure_job(
+        constants.FIND_REUSABLE_AMI_JOB_NAME
+    ).ensure_environment_variables({constants.AMI_BUILD_CONFIG_VARIABLE: _build_config_hash(pipeline, stage_names)})
+    for stage_name in stage_names:
+        for job in pipeline.ensure_stage(stage_name).jobs:
+            for element in job.element.findall('tasks/exec'):
+                args = element.findall('arg')
+                if element.get('command') != '/bin/bash' or [arg.text for arg in args[:1]] != ['-c']:
+                    continue
+                depth = len([part for part in (element.get('workingdir') or '').split('/') if part not in ('', '.')])
+                args[-1].text = 'if {reused}; then echo "Skipped: reusing an AMI"; else {command}; fi'.format(
+                    reused=tasks.ami_reused_condition('/'.join(['..'] * depth)),
+                    command=args[-1].text.strip().rstrip(';'),
+                )
+            runif = 'any' if any(task.runif == 'any' for task in job.tasks) else 'passed'
+            job.add_task(
+                FetchArtifactTask(
+                    pipeline=reuse_location.pipeline,
+                    stage=reuse_location.stage,
+                    job=reuse_location.job,
+                    src=FetchArtifactFile(reuse_location.file_name),
+                    dest=constants.ARTIFACT_PATH,
+                    runif=runif,
+                )
+            )
+            # The reuse file is fetched first, since every other task checks it.
+            task_elements = job.element.find('tasks')
+            fetch_reuse = task_elements[-1]
+            task_elements.remove(fetch_reuse)
+            task_elements.insert(0, fetch_reuse)
+            if stage_name == constants.BUILD_AMI_STAGE_NAME:
+                tasks.generate_record_ami_fingerprint(job)
+            tasks.generate_reused_ami_placeholders(job, runif=runif)
+    return pipeline
+
+
 def generate_launch_instance(pipeline,
                              aws_access_key_id,
                              aws_secret_access_key,
@@ -150,10 +284,11 @@ def generate_launch_instance(pipeline,
                              upstream_build_artifact=None
                              ):
     """
-    Pattern to launch an AMI. Generates 3 artifacts:
-        key.pem             - Private key material generated for this instance launch
-        launch_info.yml     - yaml file that contains information about the instance launched
-        ansible_inventory   - a list of private aws IP addresses that can be fed in to ansible to run playbooks
+    Pattern to launch an AMI. Generates 4 artifacts:
+        key.pem                 - Private key material generated for this instance launch
+        launch_info.yml         - yaml file that contains information about the instance launched
+        ansible_inventory       - a list of private aws IP addresses that can be fed in to ansible to run playbooks
+        instance_access.tar.gz  - the three files above, for stages that fetch them all
 
         Please check here for further information:
         https://github.com/edx/configuration/blob/master/playbooks/continuous_delivery/launch_instance.yml
@@ -207,8 +342,8 @@ def generate_launch_instance(pipeline,
 
     # Install the requirements.
     job = stage.ensure_job(constants.LAUNCH_INSTANCE_JOB_NAME)
-    tasks.generate_requirements_install(job, 'tubular')
-    tasks.generate_requirements_install(job, 'configuration')
+    set_job_class(job, JobClass.ANSIBLE_HEAVY)
+    tasks.generate_virtualenv_install(job, ['tubular', 'configuration'])
 
     # fetch the artifacts if there are any
     artifacts = []
@@ -249,6 +384,7 @@ def generate_run_play(pipeline,
                       manual_approval=False,
                       configuration_secure_dir=constants.PRIVATE_CONFIGURATION_LOCAL_DIR,
                       configuration_internal_dir=constants.INTERNAL_CONFIGURATION_LOCAL_DIR,
+                      fact_cache=False,
                       **kwargs):
     """
     TODO: This currently runs from the configuration/playbooks/continuous_delivery/ directory. Need to figure out how to
@@ -272,6 +408,7 @@ def generate_run_play(pipeline,
         hipchat_room (str):
         manual_approval (bool):
         configuration_secure_dir (str): The secure config directory to use for this play.
+        fact_cache (bool): publish the facts of the instance, for later stages (see tasks.ansible_playbook_command)
         **kwargs (dict):
             k,v pairs:
                 k: the name of the option to pass to ansible
@@ -305,29 +442,23 @@ def generate_run_play(pipeline,
 
     # Install the requirements.
     job = stage.ensure_job(constants.RUN_PLAY_JOB_NAME)
-    tasks.generate_requirements_install(job, 'tubular')
-    tasks.generate_requirements_install(job, 'configuration')
-    tasks.generate_target_directory(job)
-
-    # fetch the key material
-    artifact_params = {
-        'pipeline': pipeline.name,
-        'stage': constants.LAUNCH_INSTANCE_STAGE_NAME,
-        'job': constants.LAUNCH_INSTANCE_JOB_NAME,
-        'src': FetchArtifactFile("key.pem"),
-        'dest': constants.ARTIFACT_PATH
-    }
-    job.add_task(FetchArtifactTask(**artifact_params))
-
-    # fetch the launch_info.yml
-    artifact_params['src'] = FetchArtifactFile('launch_info.yml')
-    job.add_task(FetchArtifactTask(**artifact_params))
-
-    # fetch the inventory file
-    artifact_params['src'] = FetchArtifactFile('ansible_inventory')
-    job.add_task(FetchArtifactTask(**artifact_params))
+    set_job_class(job, JobClass.ANSIBLE_HEAVY)
+    tasks.generate_virtualenv_install(job, ['tubular', 'configuration'])
+
+    # fetch the key material, launch_info.yml and inventory file
+    tasks.generate_fetch_instance_access(
+        job,
+        utils.ArtifactLocation(
+            pipeline.name,
+            constants.LAUNCH_INSTANCE_STAGE_NAME,
+            constants.LAUNCH_INSTANCE_JOB_NAME,
+            constants.INSTANCE_ACCESS_FILENAME
+        )
+    )
 
-    tasks.generate_run_app_playbook(job, configuration_internal_dir, configuration_secure_dir, playbook_with_path, **kwargs)
+    tasks.generate_run_app_playbook(
+        job, configuration_internal_dir, configuration_secure_dir, playbook_with_path, fact_cache=fact_cache, **kwargs
+    )
     return stage
 
 
@@ -408,8 +539,8 @@ def generate_create_ami_from_instance(pipeline,
 
     # Install the requirements.
     job = stage.ensure_job(constants.BUILD_AMI_JOB_NAME)
-    tasks.generate_requirements_install(job, 'tubular')
-    tasks.generate_requirements_install(job, 'configuration')
+    set_job_class(job, JobClass.ANSIBLE_HEAVY)
+    tasks.generate_virtualenv_install(job, ['tubular', 'configuration'])
 
     tasks.generate_target_directory(job)
 
@@ -474,7 +605,8 @@ def generate_deploy_ami(pipeline,
     if manual_approval:
         stage.set_has_manual_approval()
     job = stage.ensure_job(constants.DEPLOY_AMI_JOB_NAME)
-    tasks.generate_requirements_install(job, 'tubular')
+    set_job_class(job, JobClass.LONG_WAIT)
+    tasks.generate_virtualenv_install(job, ['tubular'])
     # Make the artifact directory if it does not exist
     job.add_task(ExecTask(
         [
@@ -493,7 +625,7 @@ def generate_deploy_ami(pipeline,
     job.ensure_artifacts(set([BuildArtifact(artifact_path)]))
 
     deploy_command =\
-        '/usr/bin/python ' \
+        'python ' \
         'scripts/asgard-deploy.py ' \
         '--out_file ../{} '.format(artifact_path)
 
@@ -554,12 +686,14 @@ def generate_edp_validation(pipeline,
     if manual_approval:
         stage.set_has_manual_approval()
     job = stage.ensure_job("EDPValidation")
-    tasks.generate_requirements_install(job, 'tubular')
+    set_job_class(job, JobClass.LIGHT)
+    tasks.generate_virtualenv_install(job, ['tubular'])
     job.add_task(
         ExecTask(
             [
-                '/usr/bin/python',
-                'scripts/validate_edp.py'
+                '/bin/bash',
+                '-c',
+                'python scripts/validate_edp.py'
             ],
             working_dir='tubular'
         )
@@ -569,7 +703,7 @@ def generate_edp_validation(pipeline,
             [
                 '/bin/bash',
                 '-c',
-                '/usr/bin/python '
+                'python '
                 'scripts/submit_hipchat_msg.py '
                 '-m '
                 '"${AMI_ID} is not tagged for ${AMI_ENVIRONMENT}-${AMI_DEPLOYMENT}-${AMI_PLAY}. '
@@ -584,39 +718,10 @@ def generate_edp_validation(pipeline,
     return stage
 
 
-def generate_run_migrations(pipeline,
-                            db_migration_pass,
-                            inventory_location,
-                            instance_key_location,
-                            launch_info_location,
-                            application_user,
-                            application_name,
-                            application_path,
-                            duration_threshold=None,
-                            from_address=None,
-                            to_addresses=None,
-                            sub_application_name=None,
-                            manual_approval=False):
+def _ensure_migration_environment(pipeline, db_migration_pass, application_user, application_name,
+                                  application_path, duration_threshold):
     """
-    Generate the stage that applies/runs migrations.
-
-    Args:
-        pipeline (gomatic.Pipeline): Pipeline to which to add the run migrations stage.
-        db_migration_pass (str): Password for the DB user used to run migrations.
-        inventory_location (ArtifactLocation): Location of inventory containing the IP address of the EC2 instance, for fetching.
-        instance_key_location (ArtifactLocation): Location of SSH key used to access the EC2 instance, for fetching.
-        launch_info_location (ArtifactLocation): Location of the launch_info.yml file for fetching
-        application_user (str): Username to use while running the migrations
-        application_name (str): Name of the application (e.g. edxapp, programs, etc...)
-        application_path (str): path of the application installed on the target machine
-        duration_threshold (int): Threshold in seconds over which a migration duration will be alerted.
-        from_address (str): Any migration duration email alert will be from this address.
-        to_addresses (list(str)): List of To: addresses for migration duration email alerts.
-        sub_application_name (str): any sub application to insert in to the migrations commands {cms|lms}
-        manual_approval (bool): Should this stage require manual approval?
-
-    Returns:
-        gomatic.Stage
+    Set the pipeline environment variables used by migration jobs.
     """
     pipeline.ensure_environment_variables(
         {
@@ -640,15 +745,22 @@ def generate_run_migrations(pipeline,
         }
     )
 
-    if sub_application_name is not None:
-        stage_name = "{}_{}".format(constants.APPLY_MIGRATIONS_STAGE, sub_application_name)
-    else:
-        stage_name = constants.APPLY_MIGRATIONS_STAGE
-    stage = pipeline.ensure_stage(stage_name)
 
-    if manual_approval:
-        stage.set_has_manual_approval()
-    job = stage.ensure_job(constants.APPLY_MIGRATIONS_JOB)
+def _prepare_migration_job(job, inventory_location, instance_key_location, launch_info_location,
+                           instance_access_location=None, fact_cache_location=None):
+    """
+    Fetch what a migration job needs to reach the EC2 instance, and install the configuration and tubular
+    requirements (the job checks the migration durations with tubular).
+
+    The files are fetched from ``instance_access_location`` in one bundle, if it's given, and the ansible
+    facts of the instance from ``fact_cache_location``, if it's given.
+    """
+    if fact_cache_location is not None:
+        tasks.generate_fetch_ansible_facts(job, fact_cache_location)
+    if instance_access_location is not None:
+        tasks.generate_fetch_instance_access(job, instance_access_location)
+        tasks.generate_virtualenv_install(job, ['tubular', 'configuration'])
+        return
 
     # Fetch the Ansible inventory to use in reaching the EC2 instance.
     artifact_params = {
@@ -691,8 +803,69 @@ def generate_run_migrations(pipeline,
         )
     )
 
-    tasks.generate_requirements_install(job, 'configuration')
-    tasks.generate_run_migrations(job, sub_application_name)
+    tasks.generate_virtualenv_install(job, ['tubular', 'configuration'])
+
+
+def generate_run_migrations(pipeline,
+                            db_migration_pass,
+                            inventory_location,
+                            instance_key_location,
+                            launch_info_location,
+                            application_user,
+                            application_name,
+                            application_path,
+                            duration_threshold=None,
+                            from_address=None,
+                            to_addresses=None,
+                            sub_application_name=None,
+                            manual_approval=False,
+                            instance_access_location=None,
+                            fact_cache_location=None):
+    """
+    Generate the stage that applies/runs migrations.
+
+    Args:
+        pipeline (gomatic.Pipeline): Pipeline to which to add the run migrations stage.
+        db_migration_pass (str): Password for the DB user used to run migrations.
+        inventory_location (ArtifactLocation): Location of inventory containing the IP address of the EC2 instance, for fetching.
+        instance_key_location (ArtifactLocation): Location of SSH key used to access the EC2 instance, for fetching.
+        launch_info_location (ArtifactLocation): Location of the launch_info.yml file for fetching
+        application_user (str): Username to use while running the migrations
+        application_name (str): Name of the application (e.g. edxapp, programs, etc...)
+        application_path (str): path of the application installed on the target machine
+        duration_threshold (int): Threshold in seconds over which a migration duration will be alerted.
+        from_address (str): Any migration duration email alert will be from this address.
+        to_addresses (list(str)): List of To: addresses for migration duration email alerts.
+        sub_application_name (str): any sub application to insert in to the migrations commands {cms|lms}
+        manual_approval (bool): Should this stage require manual approval?
+        instance_access_location (ArtifactLocation): Location of the instance_access.tar.gz bundle of the
+            three files above. If given, it's fetched instead of them.
+        fact_cache_location (ArtifactLocation): Location of the ansible fact cache of an earlier stage that ran
+            on the instance, to reuse (see tasks.ansible_playbook_command).
+
+    Returns:
+        gomatic.Stage
+    """
+    _ensure_migration_environment(
+        pipeline, db_migration_pass, application_user, application_name, application_path, duration_threshold
+    )
+
+    if sub_application_name is not None:
+        stage_name = "{}_{}".format(constants.APPLY_MIGRATIONS_STAGE, sub_application_name)
+    else:
+        stage_name = constants.APPLY_MIGRATIONS_STAGE
+    stage = pipeline.ensure_stage(stage_name)
+
+    if manual_approval:
+        stage.set_has_manual_approval()
+    job = stage.ensure_job(constants.APPLY_MIGRATIONS_JOB)
+    set_job_class(job, JobClass.ANSIBLE_HEAVY)
+
+    _prepare_migration_job(
+        job, inventory_location, instance_key_location, launch_info_location, instance_access_location,
+        fact_cache_location
+    )
+    tasks.generate_run_migrations(job, sub_application_name, fact_cache=fact_cache_location is not None)
 
     if duration_threshold:
         tasks.generate_check_migration_duration(
@@ -760,7 +933,8 @@ def generate_terminate_instance(pipeline,
         'dest': constants.ARTIFACT_PATH
     }
     job = stage.ensure_job(constants.TERMINATE_INSTANCE_JOB_NAME)
-    tasks.generate_requirements_install(job, 'configuration')
+    set_job_class(job, JobClass.ANSIBLE_HEAVY)
+    tasks.generate_virtualenv_install(job, ['configuration'])
     job.add_task(FetchArtifactTask(**artifact_params))
 
     tasks.generate_ami_cleanup(job, runif=runif)
@@ -814,7 +988,8 @@ def generate_rollback_asg_stage(
     # Important: Do *not* automatically rollback! Always manual...
     stage.set_has_manual_approval()
     job = stage.ensure_job(constants.ROLLBACK_ASGS_JOB_NAME)
-    tasks.generate_requirements_install(job, 'tubular')
+    set_job_class(job, JobClass.LONG_WAIT)
+    tasks.generate_virtualenv_install(job, ['tubular'])
 
     artifact_params = {
         "pipeline": deploy_file_location.pipeline,
@@ -842,10 +1017,11 @@ def generate_rollback_asg_stage(
 
     job.add_task(ExecTask(
         [
-            '/usr/bin/python',
-            'scripts/rollback_asg.py',
-            '--config_file', deploy_file_location.file_name,
-            '--out_file', '../{}'.format(artifact_path),
+            '/bin/bash',
+            '-c',
+            'python scripts/rollback_asg.py --config_file {} --out_file ../{}'.format(
+                deploy_file_location.file_name, artifact_path
+            ),
         ],
         working_dir="tubular")
     )
@@ -864,7 +1040,8 @@ def generate_ansible_stage(
     application_path,
     hipchat_token,
     hipchat_room=constants.HIPCHAT_ROOM,
-    manual_approval=False
+    manual_approval=False,
+    instance_access_location=None
 ):
     """
         Generate the stage with the given name, that runs the specified task.
@@ -882,6 +1059,8 @@ def generate_ansible_stage(
             hipchat_token (str): HipChat authentication token
             hipchat_room (str): HipChat room where announcements should be made
             manual_approval (bool): Should this stage require manual approval?
+            instance_access_location (ArtifactLocation): Location of the instance_access.tar.gz bundle of the
+                inventory, key and launch info. If given, it's fetched instead of them.
 
         Returns:
             gomatic.Stage
@@ -906,6 +1085,13 @@ def generate_ansible_stage(
     if manual_approval:
         stage.set_has_manual_approval()
     job = stage.ensure_job(stage_name + '_job')
+    set_job_class(job, JobClass.ANSIBLE_HEAVY)
+
+    if instance_access_location is not None:
+        tasks.generate_fetch_instance_access(job, instance_access_location, key_dir='configuration')
+        tasks.generate_virtualenv_install(job, ['configuration'])
+        task(job)
+        return stage
 
     # Fetch the Ansible inventory to use in reaching the EC2 instance.
     artifact_params = {
@@ -948,7 +1134,7 @@ def generate_ansible_stage(
         )
     )
 
-    tasks.generate_requirements_install(job, 'configuration')
+    tasks.generate_virtualenv_install(job, ['configuration'])
     task(job)
 
     return stage
@@ -964,7 +1150,8 @@ def generate_refresh_metadata(
     application_path,
     hipchat_token='',
     hipchat_room=constants.HIPCHAT_ROOM,
-    manual_approval=False
+    manual_approval=False,
+    instance_access_location=None
 ):
     """
     Generate the stage that refreshes metadata for the discovery service.
@@ -980,6 +1167,8 @@ def generate_refresh_metadata(
         hipchat_token (str): HipChat authentication token
         hipchat_room (str): HipChat room where announcements should be made
         manual_approval (bool): Should this stage require manual approval?
+        instance_access_location (ArtifactLocation): Location of the instance_access.tar.gz bundle of the
+            inventory, key and launch info. If given, it's fetched instead of them.
 
     Returns:
         gomatic.Stage
@@ -996,7 +1185,8 @@ def generate_refresh_metadata(
         application_path,
         hipchat_token,
         hipchat_room,
-        manual_approval
+        manual_approval,
+        instance_access_location
     )
 
 
@@ -1010,7 +1200,8 @@ def generate_update_index(
     application_path,
     hipchat_token='',
     hipchat_room=constants.HIPCHAT_ROOM,
-    manual_approval=False
+    manual_approval=False,
+    instance_access_location=None
 ):
     """
     Generate the stage that refreshes metadata for the discovery service.
@@ -1026,6 +1217,8 @@ def generate_update_index(
         hipchat_token (str): HipChat authentication token
         hipchat_room (str): HipChat room where announcements should be made
         manual_approval (bool): Should this stage require manual approval?
+        instance_access_location (ArtifactLocation): Location of the instance_access.tar.gz bundle of the
+            inventory, key and launch info. If given, it's fetched instead of them.
 
     Returns:
         gomatic.Stage
@@ -1042,7 +1235,8 @@ def generate_update_index(
         application_path,
         hipchat_token,
         hipchat_room,
-        manual_approval
+        manual_approval,
+        instance_access_location
     )
 
 
@@ -1066,6 +1260,7 @@ def generate_armed_stage(pipeline, stage_name):
     """
     armed_stage = pipeline.ensure_stage(stage_name)
     armed_job = armed_stage.ensure_job(constants.ARMED_JOB_NAME)
+    set_job_class(armed_job, JobClass.LIGHT)
     armed_job.add_task(
         ExecTask(
             [
@@ -1112,6 +1307,7 @@ def generate_create_pr_stage(pipeline,
     )
     git_stage = pipeline.ensure_stage(stage_name)
     git_job = git_stage.ensure_job(constants.GIT_SETUP_JOB_NAME)
+    set_job_class(git_job, JobClass.LIGHT)
     tasks.generate_target_directory(git_job)
     tasks.generate_create_release_candidate_branch_and_pr(
         git_job,
@@ -1163,6 +1359,7 @@ def generate_create_branch(pipeline,
     if manual_approval:
         git_stage.set_has_manual_approval()
     git_job = git_stage.ensure_job(constants.GIT_CREATE_BRANCH_JOB_NAME)
+    set_job_class(git_job, JobClass.LIGHT)
     tasks.generate_target_directory(git_job)
     tasks.generate_create_branch(
         git_job,
@@ -1233,6 +1430,7 @@ def generate_message_prs(pipeline,
     if manual_approval:
         message_stage.set_has_manual_approval()
     message_job = message_stage.ensure_job(meta.pop('job_name'))
+    set_job_class(message_job, JobClass.LIGHT)
     meta.pop('method')(
         message_job, org, repo, token, head_sha,
         base_sha=base_sha, base_ami_artifact=base_ami_artifact, ami_tag_app=ami_tag_app
@@ -1281,6 +1479,7 @@ def generate_merge_branch_and_tag(pipeline,
         git_stage.set_has_manual_approval()
 
     merge_branch_job = git_stage.ensure_job(constants.GIT_MERGE_RC_BRANCH_JOB_NAME)
+    set_job_class(merge_branch_job, JobClass.LIGHT)
     tasks.generate_target_directory(merge_branch_job)
     tasks.generate_merge_branch(
         merge_branch_job,
@@ -1294,6 +1493,7 @@ def generate_merge_branch_and_tag(pipeline,
     # Generate a job/task which tags the head commit of the source branch.
     # Instruct the task to auto-generate tag name/message by not sending them in.
     tag_job = git_stage.ensure_job(constants.GIT_TAG_SHA_JOB_NAME)
+    set_job_class(tag_job, JobClass.LIGHT)
 
     if deploy_artifact:
         # Fetch the AMI-deployment artifact to extract deployment time.
@@ -1357,6 +1557,7 @@ def generate_create_branch_and_pr(pipeline,
     if manual_approval:
         git_stage.set_has_manual_approval()
     git_job = git_stage.ensure_job(constants.CREATE_MASTER_MERGE_PR_JOB_NAME)
+    set_job_class(git_job, JobClass.LIGHT)
     tasks.generate_target_directory(git_job)
 
     # Generate a task that creates a new branch off the HEAD of a source branch.
@@ -1423,6 +1624,7 @@ def generate_poll_tests_and_merge_pr(pipeline,
     if manual_approval:
         git_stage.set_has_manual_approval()
     git_job = git_stage.ensure_job(constants.CHECK_PR_TESTS_AND_MERGE_JOB_NAME)
+    set_job_class(git_job, JobClass.LONG_WAIT)
 
     # Fetch the PR-creation material.
     git_job.add_task(
@@ -1472,6 +1674,7 @@ def generate_build_value_stream_map_url(pipeline):
 
     # Create the job
     job = stage.ensure_job(constants.BUILD_VALUE_STREAM_MAP_URL_JOB_NAME)
+    set_job_class(job, JobClass.LIGHT)
 
     # Add task to generate the directory where the value_stream_map.yaml file will be written.
     tasks.generate_target_directory(job)
@@ -1,6 +1,6 @@
 from gomatic import *
 
-from edxpipelines import constants
+from edxpipelines import constants, virtualenvs
 
 
 def generate_requirements_install(job, working_dir, runif="passed"):
@@ -30,6 +30,205 @@ def generate_requirements_install(job, working_dir, runif="passed"):
     )
 
 
+def generate_virtualenv_install(job, working_dirs, runif="passed"):
+    """
+    Generates a task that activates a virtualenv with the requirements.txt of each of ``working_dirs``
+    installed (in order) for the rest of the job.
+
+    Virtualenvs are cached on the agent (in $EDX_VIRTUALENV_CACHE, or ~/.cache/edx-virtualenvs), keyed by a hash
+    of the requirements files and the python version, so they are only built when the requirements change.
+    On a miss, packages are installed from $EDX_WHEELHOUSE (a directory or url of wheels), if the agent sets it,
+    before the package index. Every later bash task in the job uses the virtualenv, through BASH_ENV.
+
+    A job has a single virtualenv (see edxpipelines.virtualenvs): if the job already installs one, the
+    requirements of ``working_dirs`` are added to it instead.
+
+    Args:
+        job (gomatic.job.Job): the gomatic job which to add install requirements
+        working_dirs (list): the directories with the requirements.txt files to install, relative to the job's
+                             root directory
+        runif (str): one of ['passed', 'failed', 'any'] Default: passed
+
+    Returns:
+        The task that installs the virtualenv (gomatic.gocd.tasks.ExecTask)
+
+    """
+    job.ensure_environment_variables({'BASH_ENV': constants.VIRTUALENV_ACTIVATE_SCRIPT})
+
+    existing = virtualenvs.add_requirements(job.element, working_dirs)
+    if existing is not None:
+        return ExecTask(
+            [existing.get('command')] + [arg.text for arg in existing.findall('arg')],
+            runif=existing.find('runif').get('status'),
+        )
+    return job.add_task(
+        ExecTask(
+            [
+                '/bin/bash',
+                '-c',
+                virtualenvs.install_command(working_dirs)
+            ],
+            runif=runif
+        )
+    )
+
+
+def _verbosity_flags(verbosity):
+    return '-' + 'v' * verbosity if verbosity > 0 else ''
+
+
+def ensure_ansible_options(environment, verbosity=None, output=None, pipelining=None, forks=None, strategy=None):
+    """
+    Set how the ansible-playbook tasks of a pipeline, stage or job run, and report what they do.
+
+    The options are environment variables, so a stage or job can override those of its pipeline, and they can
+    be changed when a pipeline is triggered. Options that aren't given are left as they are, and those ansible
+    reads itself (pipelining, forks and strategy) are then taken from its config file.
+
+    Args:
+        environment (gomatic.Pipeline, gomatic.Stage or gomatic.Job): where to set the options
+        verbosity (int): the number of -v flags to pass to ansible-playbook
+        output (str): one of constants.ANSIBLE_OUTPUTS. 'json' and 'profile' write the output of the json
+            callback, or of the default one with the profile_tasks callback, to constants.ANSIBLE_OUTPUT_PATH
+            instead of the console.
+        pipelining (bool): run modules through the open SSH connection, instead of copying them over first.
+            The hosts must not require a tty for sudo.
+        forks (int): the number of hosts to run on at once
+        strategy (str): the ansible strategy plugin to run plays with, such as 'free'
+    """
+    variables = {}
+    if pipelining is not None:
+        variables['ANSIBLE_PIPELINING'] = str(bool(pipelining))
+    if forks is not None:
+        variables['ANSIBLE_FORKS'] = str(forks)
+    if strategy is not None:
+        variables['ANSIBLE_STRATEGY'] = strategy
+    if verbosity is not None:
+        variables['ANSIBLE_VERBOSITY_FLAGS'] = _verbosity_flags(verbosity)
+    if output is not None:
+        if output not in constants.ANSIBLE_OUTPUTS:
+            raise ValueError(
+                'ansible output must be one of {}, not {!r}'.format(', '.join(constants.ANSIBLE_OUTPUTS), output)
+            )
+        variables['ANSIBLE_OUTPUT'] = '' if output == 'console' else output
+    environment.ensure_environment_variables(variables)
+
+
+def _ansible_output(job, name, root='..'):
+    """
+    The start of a bash command that runs ansible-playbook with the options set by ensure_ansible_options.
+
+    It sets $ANSIBLE_VERBOSITY_FLAGS, for the ansible-playbook call, and sends the rest of the command's output
+    to the file ``name`` (plus an extension) in constants.ANSIBLE_OUTPUT_PATH if $ANSIBLE_OUTPUT asks for it.
+
+    Args:
+        job (gomatic.job.Job): the job the command runs in, which publishes the output
+        name (str): the name of the output file, unique in the job
+        root (str): the path of the job's working directory, from the command's
+
+    Returns:
+        str
+    """
+    job.ensure_artifacts(set([BuildArtifact(constants.ANSIBLE_OUTPUT_PATH)]))
+    return (
+        'ANSIBLE_VERBOSITY_FLAGS=${{ANSIBLE_VERBOSITY_FLAGS-{verbosity}}};'
+        'mkdir -p {output_path};'
+        'case "$ANSIBLE_OUTPUT" in'
+        ' json) export ANSIBLE_STDOUT_CALLBACK=json; ANSIBLE_OUTPUT_FILE={output_path}/{name}.json;;'
+        ' profile) export ANSIBLE_CALLBACK_WHITELIST=profile_tasks; ANSIBLE_OUTPUT_FILE={output_path}/{name}.log;;'
+        ' *) ANSIBLE_OUTPUT_FILE=;;'
+        ' esac;'
+        'if [ -n "$ANSIBLE_OUTPUT_FILE" ]; then'
+        ' echo "Writing the ansible output to $ANSIBLE_OUTPUT_FILE"; exec > $ANSIBLE_OUTPUT_FILE;'
+        ' fi;'
+    ).format(
+        verbosity=_verbosity_flags(constants.ANSIBLE_VERBOSITY),
+        output_path='{}/{}'.format(root, constants.ANSIBLE_OUTPUT_PATH),
+        name=name,
+    )
+
+
+def ansible_playbook_command(job, name, playbook, extra_vars=(), inventory=None, private_key=None, user='ubuntu',
+                             module_path='playbooks/library', fact_cache=False, root='..'):
+    """
+    The bash command that runs an ansible playbook, the way every generated ansible task runs one.
+
+    The playbook runs with the options set by ensure_ansible_options. Without an inventory it runs on localhost
+    with a local connection. With one, SSH connections to its hosts are kept open from one task to the next,
+    and host keys aren't checked, since the hosts have just been launched.
+
+    With ``fact_cache``, the facts of the hosts are cached in constants.ANSIBLE_FACT_CACHE_PATH, which the job
+    publishes, and only gathered if they aren't there. Later stages can carry the cache on with
+    generate_fetch_ansible_facts.
+
+    Args:
+        job (gomatic.job.Job): the job the command runs in
+        name (str): the name of the run, unique in the job, for its output file
+        playbook (str): the path of the playbook, from the command's working directory
+        extra_vars (list): the extra variables to pass, each with -e
+        inventory (str): the path of the inventory, from the job's working directory, or None for localhost
+        private_key (str): the path of the SSH key for the hosts of the inventory, from the job's working directory
+        user (str): the user to connect to the hosts of the inventory as
+        module_path (str): the path of the modules the playbook uses, from the command's working directory
+        fact_cache (bool): cache facts in constants.ANSIBLE_FACT_CACHE_PATH?
+        root (str): the path of the job's working directory, from the command's
+
+    Returns:
+        str
+    """
+    command = _ansible_output(job, name, root)
+    arguments = ['ansible-playbook', '$ANSIBLE_VERBOSITY_FLAGS']
+    if module_path:
+        arguments.append('--module-path={}'.format(module_path))
+
+    if inventory is None:
+        arguments += ['-i "localhost,"', '-c local']
+    else:
+        command += (
+            'export ANSIBLE_HOST_KEY_CHECKING=False;'
+            'export ANSIBLE_SSH_ARGS="-o ControlMaster=auto -o ControlPersist=30m";'
+            'PRIVATE_KEY=`/bin/pwd`/{root}/{private_key};'
+            'chmod 600 $PRIVATE_KEY;'
+        ).format(root=root, private_key=private_key)
+        arguments += ['-i {}/{}'.format(root, inventory), '--private-key=$PRIVATE_KEY', '--user={}'.format(user)]
+
+    if fact_cache:
+        job.ensure_artifacts(set([BuildArtifact(constants.ANSIBLE_FACT_CACHE_PATH)]))
+        command += (
+            'mkdir -p {root}/{path};'
+            'export ANSIBLE_GATHERING=smart ANSIBLE_CACHE_PLUGIN=jsonfile '
+            'ANSIBLE_CACHE_PLUGIN_CONNECTION=`/bin/pwd`/{root}/{path};'
+        ).format(root=root, path=constants.ANSIBLE_FACT_CACHE_PATH)
+
+    arguments += ['-e {}'.format(extra_var) for extra_var in extra_vars]
+    arguments.append(playbook)
+    return command + ' '.join(arguments)
+
+
+def generate_fetch_ansible_facts(job, fact_cache_location, runif="passed"):
+    """
+    Fetch the ansible fact cache of an earlier job (see ansible_playbook_command), to carry it on.
+
+    Args:
+        job (gomatic.job.Job): the gomatic job to add the task to
+        fact_cache_location (ArtifactLocation): the job that published the cache, and its name
+        runif (str): one of ['passed', 'failed', 'any'] Default: passed
+
+    Returns:
+        The newly created task (gomatic.gocd.tasks.FetchArtifactTask)
+    """
+    return job.add_task(
+        FetchArtifactTask(
+            pipeline=fact_cache_location.pipeline,
+            stage=fact_cache_location.stage,
+            job=fact_cache_location.job,
+            src=FetchArtifactDir(fact_cache_location.file_name),
+            dest=constants.ARTIFACT_PATH,
+            runif=runif
+        )
+    )
+
+
 def generate_launch_instance(job, optional_override_files=[], runif="passed"):
     """
     Generate the launch AMI job. This ansible script generates 3 artifacts:
@@ -37,6 +236,9 @@ def generate_launch_instance(job, optional_override_files=[], runif="passed"):
         launch_info.yml     - yaml file that contains information about the instance launched
         ansible_inventory   - a list of private aws IP addresses that can be fed in to ansible to run playbooks
 
+    and a bundle of the three, instance_access.tar.gz, for stages that need all of them (see
+    generate_fetch_instance_access).
+
     Args:
         job (gomatic.job.Job): the gomatic job which to add the launch instance task
         runif (str): one of ['passed', 'failed', 'any'] Default: passed
@@ -52,33 +254,28 @@ def generate_launch_instance(job, optional_override_files=[], runif="passed"):
     """
     job.ensure_artifacts(set([BuildArtifact('{}/key.pem'.format(constants.ARTIFACT_PATH)),
                              BuildArtifact('{}/ansible_inventory'.format(constants.ARTIFACT_PATH)),
-                             BuildArtifact('{}/launch_info.yml'.format(constants.ARTIFACT_PATH))]))
-
-    command = ' '.join(
-        [
-            'ansible-playbook ',
-            '-vvvv ',
-            '--module-path=playbooks/library ',
-            '-i "localhost," ',
-            '-c local ',
-            '-e artifact_path=`/bin/pwd`/../{artifact_path} ',
-            '-e base_ami_id=$BASE_AMI_ID ',
-            '-e ec2_vpc_subnet_id=$EC2_VPC_SUBNET_ID ',
-            '-e ec2_security_group_id=$EC2_SECURITY_GROUP_ID ',
-            '-e ec2_instance_type=$EC2_INSTANCE_TYPE ',
-            '-e ec2_instance_profile_name=$EC2_INSTANCE_PROFILE_NAME ',
-            '-e ebs_volume_size=$EBS_VOLUME_SIZE ',
-            '-e hipchat_token=$HIPCHAT_TOKEN ',
-            '-e hipchat_room="$HIPCHAT_ROOM" ',
-            '-e ec2_timeout=900 '
-        ]
-    )
-    command = command.format(artifact_path=constants.ARTIFACT_PATH)
+                             BuildArtifact('{}/launch_info.yml'.format(constants.ARTIFACT_PATH)),
+                             BuildArtifact('{}/{}'.format(constants.ARTIFACT_PATH, constants.INSTANCE_ACCESS_FILENAME))]))
+
+    extra_vars = [
+        'artifact_path=`/bin/pwd`/../{}'.format(constants.ARTIFACT_PATH),
+        'base_ami_id=$BASE_AMI_ID',
+        'ec2_vpc_subnet_id=$EC2_VPC_SUBNET_ID',
+        'ec2_security_group_id=$EC2_SECURITY_GROUP_ID',
+        'ec2_instance_type=$EC2_INSTANCE_TYPE',
+        'ec2_instance_profile_name=$EC2_INSTANCE_PROFILE_NAME',
+        'ebs_volume_size=$EBS_VOLUME_SIZE',
+        'hipchat_token=$HIPCHAT_TOKEN',
+        'hipchat_room="$HIPCHAT_ROOM"',
+        'ec2_timeout=900',
+    ]
     for override_file in optional_override_files:
-        command += ' -e @../{override_file} '.format(override_file=override_file)
-    command += ' playbooks/continuous_delivery/launch_instance.yml'
+        extra_vars.append('@../{override_file}'.format(override_file=override_file))
+    command = ansible_playbook_command(
+        job, 'launch_instance', 'playbooks/continuous_delivery/launch_instance.yml', extra_vars
+    )
 
-    return job.add_task(
+    launch_task = job.add_task(
         ExecTask(
             [
                 '/bin/bash',
@@ -89,6 +286,62 @@ def generate_launch_instance(job, optional_override_files=[], runif="passed"):
             runif=runif
         )
     )
+    job.add_task(
+        ExecTask(
+            [
+                '/bin/bash',
+                '-c',
+                'tar -czf {} {}'.format(constants.INSTANCE_ACCESS_FILENAME, ' '.join(constants.INSTANCE_ACCESS_FILES))
+            ],
+            working_dir=constants.ARTIFACT_PATH,
+            runif=runif
+        )
+    )
+    return launch_task
+
+
+def generate_fetch_instance_access(job, instance_access_location, key_dir=constants.ARTIFACT_PATH, runif="passed"):
+    """
+    Fetch the instance access bundle published by generate_launch_instance, and unpack it.
+
+    The key.pem, launch_info.yml and ansible_inventory files end up in constants.ARTIFACT_PATH, which
+    is created if needed, and the key is made readable only by the agent's user.
+
+    Args:
+        job (gomatic.job.Job): the gomatic job to add the tasks to
+        instance_access_location (ArtifactLocation): Location of the instance_access.tar.gz bundle, for fetching
+        key_dir (str): another directory to also unpack the files in, for tasks that look for them there
+        runif (str): one of ['passed', 'failed', 'any'] Default: passed
+
+    Returns:
+        The newly created unpacking task (gomatic.gocd.tasks.ExecTask)
+    """
+    generate_target_directory(job, runif=runif)
+    job.add_task(
+        FetchArtifactTask(
+            pipeline=instance_access_location.pipeline,
+            stage=instance_access_location.stage,
+            job=instance_access_location.job,
+            src=FetchArtifactFile(instance_access_location.file_name),
+            dest=constants.ARTIFACT_PATH,
+            runif=runif
+        )
+    )
+
+    bundle = '{}/{}'.format(constants.ARTIFACT_PATH, instance_access_location.file_name)
+    commands = []
+    for directory in sorted({constants.ARTIFACT_PATH, key_dir}):
+        commands.append('mkdir -p {0} && tar -xzf {1} -C {0} && chmod 600 {0}/key.pem'.format(directory, bundle))
+    return job.add_task(
+        ExecTask(
+            [
+                '/bin/bash',
+                '-c',
+                ' && '.join(commands)
+            ],
+            runif=runif
+        )
+    )
 
 
 def generate_create_ami(job, runif="passed", **kwargs):
@@ -108,36 +361,27 @@ def generate_create_ami(job, runif="passed", **kwargs):
 
     """
     job.ensure_artifacts(set([BuildArtifact('{}/ami.yml'.format(constants.ARTIFACT_PATH))]))
-    command = ' '.join(
-        [
-            'ansible-playbook',
-            '-vvvv',
-            '--module-path=playbooks/library',
-            '-i "localhost,"',
-            '-c local',
-            '-e @../{artifact_path}/launch_info.yml',
-            '-e play=$PLAY',
-            '-e deployment=$DEPLOYMENT',
-            '-e edx_environment=$EDX_ENVIRONMENT',
-            '-e app_repo=$APP_REPO',
-            '-e configuration_repo=$CONFIGURATION_REPO',
-            '-e configuration_version=$GO_REVISION_CONFIGURATION',
-            '-e configuration_secure_repo=$CONFIGURATION_SECURE_REPO',
-            '-e cache_id=$GO_PIPELINE_COUNTER',
-            '-e ec2_region=$EC2_REGION',
-            '-e artifact_path=`/bin/pwd`/../{artifact_path}',
-            '-e hipchat_token=$HIPCHAT_TOKEN',
-            '-e hipchat_room="$HIPCHAT_ROOM"',
-            '-e ami_wait=$AMI_WAIT',
-            '-e no_reboot=$NO_REBOOT',
-            '-e extra_name_identifier=$GO_PIPELINE_COUNTER'
-        ]
-    )
-
-    command = command.format(artifact_path=constants.ARTIFACT_PATH)
+    extra_vars = [
+        '@../{}/launch_info.yml'.format(constants.ARTIFACT_PATH),
+        'play=$PLAY',
+        'deployment=$DEPLOYMENT',
+        'edx_environment=$EDX_ENVIRONMENT',
+        'app_repo=$APP_REPO',
+        'configuration_repo=$CONFIGURATION_REPO',
+        'configuration_version=$GO_REVISION_CONFIGURATION',
+        'configuration_secure_repo=$CONFIGURATION_SECURE_REPO',
+        'cache_id=$GO_PIPELINE_COUNTER',
+        'ec2_region=$EC2_REGION',
+        'artifact_path=`/bin/pwd`/../{}'.format(constants.ARTIFACT_PATH),
+        'hipchat_token=$HIPCHAT_TOKEN',
+        'hipchat_room="$HIPCHAT_ROOM"',
+        'ami_wait=$AMI_WAIT',
+        'no_reboot=$NO_REBOOT',
+        'extra_name_identifier=$GO_PIPELINE_COUNTER',
+    ]
     for k, v in sorted(kwargs.items()):
-        command += ' -e {key}={value} '.format(key=k, value=v)
-    command += 'playbooks/continuous_delivery/create_ami.yml'
+        extra_vars.append('{key}={value}'.format(key=k, value=v))
+    command = ansible_playbook_command(job, 'create_ami', 'playbooks/continuous_delivery/create_ami.yml', extra_vars)
 
     return job.add_task(
         ExecTask(
@@ -169,16 +413,17 @@ def generate_ami_cleanup(job, runif="passed"):
             [
                 '/bin/bash',
                 '-c',
-                'ansible-playbook '
-                '-vvvv '
-                '--module-path=playbooks/library '
-                '-i "localhost," '
-                '-c local '
-                '-e @../{artifact_path}/launch_info.yml '
-                '-e ec2_region=$EC2_REGION '
-                '-e hipchat_token=$HIPCHAT_TOKEN '
-                '-e hipchat_room="$HIPCHAT_ROOM" '
-                'playbooks/continuous_delivery/cleanup.yml'.format(artifact_path=constants.ARTIFACT_PATH)
+                ansible_playbook_command(
+                    job,
+                    'cleanup',
+                    'playbooks/continuous_delivery/cleanup.yml',
+                    [
+                        '@../{}/launch_info.yml'.format(constants.ARTIFACT_PATH),
+                        'ec2_region=$EC2_REGION',
+                        'hipchat_token=$HIPCHAT_TOKEN',
+                        'hipchat_room="$HIPCHAT_ROOM"',
+                    ]
+                )
             ],
             working_dir=constants.PUBLIC_CONFIGURATION_DIR,
             runif=runif
@@ -186,7 +431,165 @@ def generate_ami_cleanup(job, runif="passed"):
     )
 
 
-def generate_run_migrations(job, sub_application_name=None, runif="passed"):
+def ami_reused_condition(root=None):
+    """
+    The bash condition that holds when generate_find_reusable_ami found an AMI to reuse.
+
+    Args:
+        root (str): the path of the job's working directory, from the directory the condition is checked in,
+            if it isn't the job's working directory
+
+    Returns:
+        str
+    """
+    reuse_file = '{}/{}'.format(constants.ARTIFACT_PATH, constants.AMI_REUSE_FILENAME)
+    return "grep -q '^ami_id: ami-' {}".format('{}/{}'.format(root, reuse_file) if root else reuse_file)
+
+
+def generate_find_reusable_ami(job, input_files=(), runif="passed"):
+    """
+    Fingerprint the inputs of an AMI build, and look for an AMI tagged with the fingerprint
+    (see generate_record_ami_fingerprint).
+
+    The fingerprint covers the play, deployment and environment, the base AMI, the revision of every git material
+    of the pipeline except tubular, the hash of the generated build config in the job's EDX_AMI_BUILD_CONFIG
+    variable (see stages.skip_build_when_ami_reused), and the contents of ``input_files``. It is written to the
+    constants.AMI_REUSE_FILENAME artifact, with the ``ami_id`` of the AMI built from the same inputs, or an empty one.
+
+    Args:
+        job (gomatic.job.Job): the gomatic job to add the task to
+        input_files (list): paths of other inputs of the build, from the job's working directory
+        runif (str): one of ['passed', 'failed', 'any'] Default: passed
+
+    Returns:
+        The newly created task (gomatic.gocd.tasks.ExecTask)
+    """
+    reuse_file = '{}/{}'.format(constants.ARTIFACT_PATH, constants.AMI_REUSE_FILENAME)
+    job.ensure_artifacts(set([BuildArtifact(reuse_file)]))
+    inputs = ' '.join([
+        'echo version={};'.format(constants.AMI_FINGERPRINT_VERSION),
+        'echo build_config=${};'.format(constants.AMI_BUILD_CONFIG_VARIABLE),
+        'echo play=$PLAY deployment=$DEPLOYMENT edx_environment=$EDX_ENVIRONMENT base_ami_id=$BASE_AMI_ID;',
+        "env | grep '^GO_REVISION_' | grep -v '^GO_REVISION_TUBULAR=' | sort;",
+    ] + ['cat {};'.format(input_file) for input_file in input_files])
+    command = '; '.join([
+        'set -e',
+        'mkdir -p {}'.format(constants.ARTIFACT_PATH),
+        'FINGERPRINT=$({{ {} }} | sha1sum | cut -d" " -f1)'.format(inputs),
+        'AMI_ID=$(aws ec2 describe-images --region ${{EC2_REGION:-{region}}} --owners self '
+        '--filters Name=tag:{tag},Values=$FINGERPRINT Name=state,Values=available '
+        "--query 'Images[0].ImageId' --output text)".format(
+            region=constants.EC2_REGION, tag=constants.AMI_FINGERPRINT_TAG
+        ),
+        'case "$AMI_ID" in ami-*) echo "Reusing $AMI_ID, built from the same inputs";; '
+        '*) AMI_ID=; echo "No AMI was built from the same inputs";; esac',
+        'printf "fingerprint: %s\\nami_id: %s\\n" "$FINGERPRINT" "$AMI_ID" > {}'.format(reuse_file),
+    ])
+    return job.add_task(
+        ExecTask(
+            [
+                '/bin/bash',
+                '-c',
+                command
+            ],
+            runif=runif
+        )
+    )
+
+
+def generate_reused_ami_placeholders(job, runif="passed"):
+    """
+    When an AMI is reused, create empty files for the artifacts of ``job`` that it didn't build, since GoCD
+    fails jobs that don't publish all of their artifacts.
+
+    Args:
+        job (gomatic.job.Job): the gomatic job to add the task to
+        runif (str): one of ['passed', 'failed', 'any'] Default: passed
+
+    Returns:
+        The newly created task (gomatic.gocd.tasks.ExecTask)
+    """
+    paths = ' '.join(sorted(artifact.get('src') for artifact in job.element.findall('artifacts/artifact')))
+    return job.add_task(
+        ExecTask(
+            [
+                '/bin/bash',
+                '-c',
+                'if {reused}; then for path in {paths}; do mkdir -p `dirname $path`; '
+                '[ -e $path ] || touch $path; done; fi'.format(reused=ami_reused_condition(), paths=paths)
+            ],
+            runif=runif
+        )
+    )
+
+
+def generate_record_ami_fingerprint(job, runif="passed"):
+    """
+    Tag the AMI that generate_create_ami built with the build fingerprint that generate_find_reusable_ami
+    computed, so that later builds from the same inputs reuse it. If an AMI was reused instead, write its id to
+    the ami.yml artifact, as generate_create_ami does.
+
+    Args:
+        job (gomatic.job.Job): the gomatic job to add the task to
+        runif (str): one of ['passed', 'failed', 'any'] Default: passed
+
+    Returns:
+        The newly created task (gomatic.gocd.tasks.ExecTask)
+    """
+    reuse_file = '{}/{}'.format(constants.ARTIFACT_PATH, constants.AMI_REUSE_FILENAME)
+    ami_file = '{}/{}'.format(constants.ARTIFACT_PATH, constants.BUILD_AMI_FILENAME)
+    return job.add_task(
+        ExecTask(
+            [
+                '/bin/bash',
+                '-c',
+                'set -e; if {reused}; then grep "^ami_id:" {reuse_file} > {ami_file}; '
+                'else aws ec2 create-tags --region ${{EC2_REGION:-{region}}} '
+                '--resources `python -c "import sys, yaml; print(yaml.safe_load(open(sys.argv[1]))[\'ami_id\'])" '
+                '{ami_file}` --tags Key={tag},Value=`sed -n "s/^fingerprint: //p" {reuse_file}`; fi'.format(
+                    reused=ami_reused_condition(), reuse_file=reuse_file, ami_file=ami_file,
+                    region=constants.EC2_REGION, tag=constants.AMI_FINGERPRINT_TAG,
+                )
+            ],
+            runif=runif
+        )
+    )
+
+
+def _run_migrations_command(job, sub_application_name=None, fact_cache=False):
+    """
+    The shell command that runs the migrations playbook, from the configuration directory.
+
+    Args:
+        job (gomatic.job.Job): the job the command runs in
+        sub_application_name (str): additional command to be passed to the migrate app {cms|lms}
+        fact_cache (bool): cache the facts of the instance (see ansible_playbook_command)
+    """
+    migrations_path = '{}/migrations'.format(constants.ARTIFACT_PATH)
+    command = 'mkdir -p {};'.format(migrations_path)
+
+    extra_vars = [
+        'APPLICATION_PATH=$APPLICATION_PATH',
+        'APPLICATION_NAME=$APPLICATION_NAME',
+        'APPLICATION_USER=$APPLICATION_USER',
+        'ARTIFACT_PATH=`/bin/pwd`/../{}'.format(migrations_path),
+        'DB_MIGRATION_USER=$DB_MIGRATION_USER',
+        'DB_MIGRATION_PASS=$DB_MIGRATION_PASS',
+    ]
+    if sub_application_name is not None:
+        extra_vars.append('SUB_APPLICATION_NAME={}'.format(sub_application_name))
+    return command + ansible_playbook_command(
+        job,
+        '_'.join(filter(None, ['run_migrations', sub_application_name])),
+        'playbooks/continuous_delivery/run_migrations.yml',
+        extra_vars,
+        inventory='{}/ansible_inventory'.format(constants.ARTIFACT_PATH),
+        private_key='{}/key.pem'.format(constants.ARTIFACT_PATH),
+        fact_cache=fact_cache,
+    )
+
+
+def generate_run_migrations(job, sub_application_name=None, runif="passed", fact_cache=False):
     """
     Generates GoCD task that runs migrations via an Ansible script.
 
@@ -197,6 +600,7 @@ def generate_run_migrations(job, sub_application_name=None, runif="passed"):
         job (gomatic.job.Job): the gomatic job to which the run migrations task will be added
         sub_application_name (str): additional command to be passed to the migrate app {cms|lms}
         runif (str): one of ['passed', 'failed', 'any'] Default: passed
+        fact_cache (bool): cache the facts of the instance (see ansible_playbook_command)
 
     Returns:
         The newly created task (gomatic.gocd.tasks.ExecTask)
@@ -208,38 +612,12 @@ def generate_run_migrations(job, sub_application_name=None, runif="passed"):
         )
     )
 
-    command = ' '.join(
-        [
-            'mkdir -p {artifact_path}/migrations;'
-            'export ANSIBLE_HOST_KEY_CHECKING=False;'
-            'export ANSIBLE_SSH_ARGS="-o ControlMaster=auto -o ControlPersist=30m";'
-            'PRIVATE_KEY=`/bin/pwd`/../{artifact_path}/key.pem;'
-            'ansible-playbook '
-            '-vvvv '
-            '-i ../{artifact_path}/ansible_inventory '
-            '--private-key=$PRIVATE_KEY '
-            '--module-path=playbooks/library '
-            '--user=ubuntu '
-            '-e APPLICATION_PATH=$APPLICATION_PATH '
-            '-e APPLICATION_NAME=$APPLICATION_NAME '
-            '-e APPLICATION_USER=$APPLICATION_USER '
-            '-e ARTIFACT_PATH=`/bin/pwd`/../{artifact_path}/migrations '
-            '-e DB_MIGRATION_USER=$DB_MIGRATION_USER '
-            '-e DB_MIGRATION_PASS=$DB_MIGRATION_PASS '
-        ]
-    )
-
-    command = command.format(artifact_path=constants.ARTIFACT_PATH)
-    if sub_application_name is not None:
-        command += '-e SUB_APPLICATION_NAME={sub_application_name} '.format(sub_application_name=sub_application_name)
-    command += 'playbooks/continuous_delivery/run_migrations.yml'
-
     return job.add_task(
         ExecTask(
             [
                 '/bin/bash',
                 '-c',
-                command
+                _run_migrations_command(job, sub_application_name, fact_cache)
             ],
             working_dir=constants.PUBLIC_CONFIGURATION_DIR,
             runif=runif
@@ -331,6 +709,11 @@ def _fetch_secure_repo(job, secure_dir, secure_repo_envvar, secure_version_envva
     """
     Setup a secure repo for use in providing secrets.
 
+    Only the commit of the version is fetched (with --depth 1), falling back to the whole history for
+    versions the server won't serve that way, such as a sha that isn't the head of a branch or tag.
+    On agents that set $EDX_GIT_REFERENCE_CACHE, a bare reference repository of the secure repo is kept there,
+    and updated incrementally, and the checkout borrows its objects, so that only new objects are downloaded.
+
     Args:
         job (gomatic.job.Job): the gomatic job to which the task will be added
         secure_dir (str): name of dir containing the edx-ops/configuration-secure repo
@@ -343,26 +726,39 @@ def _fetch_secure_repo(job, secure_dir, secure_repo_envvar, secure_version_envva
         The newly created task (gomatic.gocd.tasks.ExecTask)
 
     """
+    command = '; '.join([
+        'set -e',
+        'touch github_key.pem',
+        'chmod 600 github_key.pem',
+        'python tubular/scripts/format_rsa_key.py --key "$PRIVATE_GITHUB_KEY" --output-file github_key.pem',
+        "export GIT_SSH_COMMAND=\"/usr/bin/ssh -o StrictHostKeyChecking=no -i `/bin/pwd`/github_key.pem\"",
+        'REFERENCE_CACHE="{}"'.format(constants.GIT_REFERENCE_CACHE_DIR),
+        'if [ -n "$REFERENCE_CACHE" ]; then '
+        'REFERENCE="$REFERENCE_CACHE/{name}.git"; mkdir -p "$REFERENCE_CACHE"; '
+        # Jobs sharing the cache wait for each other to update the reference, rather than update it at once.
+        'exec 9>"$REFERENCE.lock"; flock 9; '
+        '[ -d "$REFERENCE" ] || /usr/bin/git init --quiet --bare "$REFERENCE"; '
+        '/usr/bin/git --git-dir="$REFERENCE" fetch --quiet --prune "${repo}" '
+        '"+refs/heads/*:refs/heads/*" "+refs/tags/*:refs/tags/*"; '
+        'flock -u 9; fi'.format(name=secure_repo_name, repo=secure_repo_envvar),
+        '/usr/bin/git init --quiet {}'.format(secure_dir),
+        'cd {}'.format(secure_dir),
+        '[ -z "$REFERENCE" ] || echo "$REFERENCE/objects" > .git/objects/info/alternates',
+        '/usr/bin/git remote add origin "${}"'.format(secure_repo_envvar),
+        'if /usr/bin/git fetch --quiet --depth 1 origin "${version}"; then '
+        '/usr/bin/git checkout --quiet FETCH_HEAD; '
+        'else /usr/bin/git fetch --quiet --tags origin; /usr/bin/git checkout --quiet "${version}"; fi'.format(
+            version=secure_version_envvar
+        ),
+        'mkdir -p ../{}'.format(constants.ARTIFACT_PATH),
+        '/usr/bin/git rev-parse HEAD > ../{}/{}_sha'.format(constants.ARTIFACT_PATH, secure_repo_name),
+    ])
     return job.add_task(
         ExecTask(
             [
                 '/bin/bash',
                 '-c',
-                'touch github_key.pem && '
-                'chmod 600 github_key.pem && '
-                'python tubular/scripts/format_rsa_key.py --key "$PRIVATE_GITHUB_KEY" --output-file github_key.pem && '
-                "GIT_SSH_COMMAND='/usr/bin/ssh -o StrictHostKeyChecking=no -i github_key.pem' "
-                '/usr/bin/git clone ${secure_repo_envvar} {secure_dir} && '
-                'cd {secure_dir} && '
-                '/usr/bin/git checkout ${secure_version_envvar} && '
-                '[ -d ../{artifact_path}/ ] && echo "Target Directory Exists" || mkdir ../{artifact_path}/ && '
-                '/usr/bin/git rev-parse HEAD > ../{artifact_path}/{secure_repo_name}_sha'.format(
-                    secure_dir=secure_dir,
-                    secure_repo_envvar=secure_repo_envvar,
-                    secure_version_envvar=secure_version_envvar,
-                    secure_repo_name=secure_repo_name,
-                    artifact_path=constants.ARTIFACT_PATH
-                )
+                command
             ]
         )
     )
@@ -456,7 +852,8 @@ def fetch_edx_mktg(job, secure_dir, runif="passed"):
     )
 
 
-def generate_run_app_playbook(job, internal_dir, secure_dir, playbook_path, runif="passed", **kwargs):
+def generate_run_app_playbook(job, internal_dir, secure_dir, playbook_path, runif="passed", fact_cache=False,
+                              **kwargs):
     """
     Generates:
         a GoCD task that runs an Ansible playbook against a server inventory.
@@ -479,6 +876,7 @@ def generate_run_app_playbook(job, internal_dir, secure_dir, playbook_path, runi
         secure_dir (str): name of dir containing the edx-ops/configuration-secure repo
         playbook_path (str): path to playbook relative to the top-level 'configuration' directory
         runif (str): one of ['passed', 'failed', 'any'] Default: passed
+        fact_cache (bool): cache the facts of the host, for later stages (see ansible_playbook_command)
         **kwargs (dict):
             k,v pairs:
                 k: the name of the option to pass to ansible
@@ -488,29 +886,24 @@ def generate_run_app_playbook(job, internal_dir, secure_dir, playbook_path, runi
         The newly created task (gomatic.gocd.tasks.ExecTask)
 
     """
-    command = ' '.join(
-        [
-            'chmod 600 ../{artifact_path}/key.pem;',
-            'export ANSIBLE_HOST_KEY_CHECKING=False;',
-            'export ANSIBLE_SSH_ARGS="-o ControlMaster=auto -o ControlPersist=30m";',
-            'PRIVATE_KEY=$(/bin/pwd)/../{artifact_path}/key.pem;'
-            'ansible-playbook',
-            '-vvvv',
-            '--private-key=$PRIVATE_KEY',
-            '--user=ubuntu',
-            '--module-path=playbooks/library ',
-            '-i ../{artifact_path}/ansible_inventory '
-            '-e @../{artifact_path}/launch_info.yml',
-            '-e @../{internal_dir}/ansible/vars/${{DEPLOYMENT}}.yml',
-            '-e @../{internal_dir}/ansible/vars/${{EDX_ENVIRONMENT}}-${{DEPLOYMENT}}.yml',
-            '-e @../{secure_dir}/ansible/vars/${{DEPLOYMENT}}.yml',
-            '-e @../{secure_dir}/ansible/vars/${{EDX_ENVIRONMENT}}-${{DEPLOYMENT}}.yml',
-        ]
-    )
-    command = command.format(secure_dir=secure_dir, internal_dir=internal_dir, artifact_path=constants.ARTIFACT_PATH)
+    extra_vars = [
+        '@../{}/launch_info.yml'.format(constants.ARTIFACT_PATH),
+        '@../{}/ansible/vars/${{DEPLOYMENT}}.yml'.format(internal_dir),
+        '@../{}/ansible/vars/${{EDX_ENVIRONMENT}}-${{DEPLOYMENT}}.yml'.format(internal_dir),
+        '@../{}/ansible/vars/${{DEPLOYMENT}}.yml'.format(secure_dir),
+        '@../{}/ansible/vars/${{EDX_ENVIRONMENT}}-${{DEPLOYMENT}}.yml'.format(secure_dir),
+    ]
     for k, v in sorted(kwargs.items()):
-        command += ' -e {key}={value} '.format(key=k, value=v)
-    command += playbook_path
+        extra_vars.append('{key}={value}'.format(key=k, value=v))
+    command = ansible_playbook_command(
+        job,
+        'run_app_playbook',
+        playbook_path,
+        extra_vars,
+        inventory='{}/ansible_inventory'.format(constants.ARTIFACT_PATH),
+        private_key='{}/key.pem'.format(constants.ARTIFACT_PATH),
+        fact_cache=fact_cache,
+    )
 
     return job.add_task(
         ExecTask(
@@ -690,23 +1083,21 @@ def generate_refresh_metadata(job, runif='passed'):
         The newly created task (gomatic.gocd.tasks.ExecTask)
 
     """
-    command = ' '.join(
+    command = ansible_playbook_command(
+        job,
+        'refresh_metadata',
+        'discovery_refresh_metadata.yml',
         [
-            'export ANSIBLE_HOST_KEY_CHECKING=False;',
-            'export ANSIBLE_SSH_ARGS="-o ControlMaster=auto -o ControlPersist=30m";',
-            'PRIVATE_KEY=`/bin/pwd`/../../key.pem;',
-            'ansible-playbook',
-            '-vvvv',
-            '-i ../../ansible_inventory',
-            '--private-key=$PRIVATE_KEY',
-            '--user=ubuntu',
-            '-e APPLICATION_PATH=$APPLICATION_PATH',
-            '-e APPLICATION_NAME=$APPLICATION_NAME',
-            '-e APPLICATION_USER=$APPLICATION_USER',
-            '-e HIPCHAT_TOKEN=$HIPCHAT_TOKEN',
-            '-e HIPCHAT_ROOM="$HIPCHAT_ROOM"',
-            'discovery_refresh_metadata.yml',
-        ]
+            'APPLICATION_PATH=$APPLICATION_PATH',
+            'APPLICATION_NAME=$APPLICATION_NAME',
+            'APPLICATION_USER=$APPLICATION_USER',
+            'HIPCHAT_TOKEN=$HIPCHAT_TOKEN',
+            'HIPCHAT_ROOM="$HIPCHAT_ROOM"',
+        ],
+        inventory='configuration/ansible_inventory',
+        private_key='configuration/key.pem',
+        module_path=None,
+        root='../../..',
     )
 
     return job.add_task(
@@ -734,23 +1125,21 @@ def generate_update_index(job, runif='passed'):
         The newly created task (gomatic.gocd.tasks.ExecTask)
 
     """
-    command = ' '.join(
+    command = ansible_playbook_command(
+        job,
+        'update_index',
+        'haystack_update_index.yml',
         [
-            'export ANSIBLE_HOST_KEY_CHECKING=False;',
-            'export ANSIBLE_SSH_ARGS="-o ControlMaster=auto -o ControlPersist=30m";',
-            'PRIVATE_KEY=`/bin/pwd`/../../key.pem;',
-            'ansible-playbook',
-            '-vvvv',
-            '-i ../../ansible_inventory',
-            '--private-key=$PRIVATE_KEY',
-            '--user=ubuntu',
-            '-e APPLICATION_PATH=$APPLICATION_PATH',
-            '-e APPLICATION_NAME=$APPLICATION_NAME',
-            '-e APPLICATION_USER=$APPLICATION_USER',
-            '-e HIPCHAT_TOKEN=$HIPCHAT_TOKEN',
-            '-e HIPCHAT_ROOM="$HIPCHAT_ROOM"',
-            'haystack_update_index.yml',
-        ]
+            'APPLICATION_PATH=$APPLICATION_PATH',
+            'APPLICATION_NAME=$APPLICATION_NAME',
+            'APPLICATION_USER=$APPLICATION_USER',
+            'HIPCHAT_TOKEN=$HIPCHAT_TOKEN',
+            'HIPCHAT_ROOM="$HIPCHAT_ROOM"',
+        ],
+        inventory='configuration/ansible_inventory',
+        private_key='configuration/key.pem',
+        module_path=None,
+        root='../../..',
     )
 
     return job.add_task(
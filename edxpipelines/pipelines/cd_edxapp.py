@@ -34,9 +34,12 @@ def install_pipelines(configurator, config, env_configs):
     Optional variables:
     - configuration_secure_version
     - configuration_internal_version
+    - ansible_options: how ansible runs, and whether the migrations reuse the facts of the play
+      (see patterns.pipelines.apply_ansible_options)
     """
     pipeline = configurator.ensure_pipeline_group(config['pipeline_group'])\
                            .ensure_replacement_of_pipeline(config['pipeline_name'])
+    fact_cache = config.get('ansible_options', {}).get('fact_caching', False)
 
     # Example materials yaml
     # materials:
@@ -104,7 +107,8 @@ def install_pipelines(configurator, config, env_configs):
         edxapp_theme_name='$EDXAPP_THEME_NAME',
         disable_edx_services='true',
         COMMON_TAG_EC2_INSTANCE='true',
-        cache_id='$GO_PIPELINE_COUNTER'
+        cache_id='$GO_PIPELINE_COUNTER',
+        fact_cache=fact_cache
     )
 
     stages.generate_create_ami_from_instance(
@@ -149,6 +153,18 @@ def install_pipelines(configurator, config, env_configs):
         constants.LAUNCH_INSTANCE_JOB_NAME,
         'launch_info.yml'
     )
+    instance_access_location = utils.ArtifactLocation(
+        pipeline.name,
+        constants.LAUNCH_INSTANCE_STAGE_NAME,
+        constants.LAUNCH_INSTANCE_JOB_NAME,
+        constants.INSTANCE_ACCESS_FILENAME
+    )
+    fact_cache_location = utils.ArtifactLocation(
+        pipeline.name,
+        constants.RUN_PLAY_STAGE_NAME,
+        constants.RUN_PLAY_JOB_NAME,
+        constants.ANSIBLE_FACT_CACHE_NAME
+    ) if fact_cache else None
     for sub_app in config['edxapp_subapps']:
         stages.generate_run_migrations(
             pipeline,
@@ -159,7 +175,9 @@ def install_pipelines(configurator, config, env_configs):
             application_user=config['db_migration_user'],
             application_name=config['play_name'],
             application_path=config['application_path'],
-            sub_application_name=sub_app
+            sub_application_name=sub_app,
+            instance_access_location=instance_access_location,
+            fact_cache_location=fact_cache_location
         )
 
     #
@@ -199,6 +217,8 @@ def install_pipelines(configurator, config, env_configs):
         runif='any'
     )
 
+    pipelines.apply_ansible_options(pipeline, config)
+
 
 if __name__ == "__main__":
     pipeline_script(install_pipelines)
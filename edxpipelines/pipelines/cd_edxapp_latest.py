@@ -45,6 +45,7 @@ def install_pipelines(configurator, config, env_configs):
     Optional variables:
     - configuration_secure_version
     - configuration_internal_version
+    - reuse_amis (per environment): reuse the AMI built from the same inputs, instead of building another
     """
     configurator.ensure_removal_of_pipeline_group('edxapp')
     configurator.ensure_removal_of_pipeline_group('edxapp_prod_deploys')
@@ -83,6 +84,7 @@ def install_pipelines(configurator, config, env_configs):
         pipeline_name="STAGE_edxapp_B",
         ami_artifact=None,
         auto_run=True,
+        reuse_ami=env_configs['stage'].get('reuse_amis', False),
     )
 
     stage_md = edxapp.build_migrate_deploy_subset_pipeline(
@@ -132,6 +134,7 @@ def install_pipelines(configurator, config, env_configs):
         pipeline_name="PROD_edx_edxapp_B",
         ami_artifact=None,
         auto_run=True,
+        reuse_ami=env_configs['prod-edx'].get('reuse_amis', False),
     )
 
     prod_edge_b = edxapp.build_migrate_deploy_subset_pipeline(
@@ -149,6 +152,7 @@ def install_pipelines(configurator, config, env_configs):
         pipeline_name="PROD_edge_edxapp_B",
         ami_artifact=None,
         auto_run=True,
+        reuse_ami=env_configs['prod-edge'].get('reuse_amis', False),
     )
 
     for pipeline in (stage_b, prod_edx_b, prod_edge_b):
@@ -64,17 +64,14 @@ def install_pipelines(configurator, config, env_configs):
 
     stage = pipeline.ensure_stage('deploy_gomatic_stage')
     job = stage.ensure_job('deploy_gomatic_scripts_job')
-    tasks.generate_requirements_install(job, 'edx-gomatic')
+    tasks.generate_virtualenv_install(job, ['edx-gomatic'])
 
     job.add_task(
         ExecTask(
             [
-                '/usr/bin/python',
-                './deploy_pipelines.py',
-                '-v',
-                'tools',
-                '-f',
-                'config.yml'
+                '/bin/bash',
+                '-c',
+                'python ./deploy_pipelines.py -v tools -f config.yml'
             ],
             working_dir='edx-gomatic'
         )
@@ -9,6 +9,7 @@ sys.path.append(path.dirname(path.dirname(path.dirname(path.abspath(__file__))))
 
 from edxpipelines import utils
 from edxpipelines import constants
+from edxpipelines.patterns import stages
 from edxpipelines.patterns import tasks
 from edxpipelines.constants import *
 from edxpipelines.pipelines.script import pipeline_script
@@ -46,7 +47,7 @@ def install_pipelines(configurator, config, env_configs):
     fetch_tag_stage = pipeline.ensure_stage(FETCH_TAG_STAGE_NAME)
     fetch_tag_stage.set_has_manual_approval()
     fetch_tag_job = fetch_tag_stage.ensure_job(FETCH_TAG_JOB_NAME)
-    tasks.generate_requirements_install(fetch_tag_job, 'tubular')
+    tasks.generate_virtualenv_install(fetch_tag_job, ['tubular'])
     tasks.generate_target_directory(fetch_tag_job)
     path_name = '../target/{env}_tag_name.txt'
     tasks.generate_fetch_tag(fetch_tag_job, STAGE_ENV, path_name)
@@ -65,9 +66,10 @@ def install_pipelines(configurator, config, env_configs):
         set([BuildArtifact('target/{new_tag}.txt'.format(new_tag=NEW_TAG_NAME))])
     )
 
-    tasks.generate_requirements_install(push_to_acquia_job, 'tubular')
+    tasks.generate_virtualenv_install(push_to_acquia_job, ['tubular'])
     tasks.generate_target_directory(push_to_acquia_job)
     tasks.fetch_edx_mktg(push_to_acquia_job, 'edx-mktg')
+    stages.set_job_class(push_to_acquia_job, stages.JobClass.SECRETS)
 
     # Create a tag from MARKETING_REPOSITORY_VERSION branch of marketing repo
     push_to_acquia_job.add_task(
@@ -113,14 +115,14 @@ def install_pipelines(configurator, config, env_configs):
     backup_stage_database_stage = pipeline.ensure_stage(BACKUP_STAGE_DATABASE_STAGE_NAME)
     backup_stage_database_job = backup_stage_database_stage.ensure_job(BACKUP_STAGE_DATABASE_JOB_NAME)
 
-    tasks.generate_requirements_install(backup_stage_database_job, 'tubular')
+    tasks.generate_virtualenv_install(backup_stage_database_job, ['tubular'])
     tasks.generate_backup_drupal_database(backup_stage_database_job, STAGE_ENV)
 
     # Stage to deploy to stage
     deploy_stage_for_stage = pipeline.ensure_stage(DEPLOY_STAGE_STAGE_NAME)
     deploy_job_for_stage = deploy_stage_for_stage.ensure_job(DEPLOY_STAGE_JOB_NAME)
 
-    tasks.generate_requirements_install(deploy_job_for_stage, 'tubular')
+    tasks.generate_virtualenv_install(deploy_job_for_stage, ['tubular'])
     tasks.generate_target_directory(deploy_job_for_stage)
 
     # fetch the tag name
@@ -139,7 +141,8 @@ def install_pipelines(configurator, config, env_configs):
     clear_stage_caches_job = clear_stage_caches_stage.ensure_job(CLEAR_STAGE_CACHES_JOB_NAME)
 
     tasks.fetch_edx_mktg(clear_stage_caches_job, 'edx-mktg')
-    tasks.generate_requirements_install(clear_stage_caches_job, 'tubular')
+    stages.set_job_class(clear_stage_caches_job, stages.JobClass.SECRETS)
+    tasks.generate_virtualenv_install(clear_stage_caches_job, ['tubular'])
     tasks.format_RSA_key(clear_stage_caches_job, 'edx-mktg/docroot/acquia_github_key.pem', '$PRIVATE_ACQUIA_GITHUB_KEY')
     tasks.generate_flush_drupal_caches(clear_stage_caches_job, STAGE_ENV)
     tasks.generate_clear_varnish_cache(clear_stage_caches_job, STAGE_ENV)
@@ -149,14 +152,14 @@ def install_pipelines(configurator, config, env_configs):
     backup_prod_database_stage.set_has_manual_approval()
     backup_prod_database_job = backup_prod_database_stage.ensure_job(BACKUP_PROD_DATABASE_JOB_NAME)
 
-    tasks.generate_requirements_install(backup_prod_database_job, 'tubular')
+    tasks.generate_virtualenv_install(backup_prod_database_job, ['tubular'])
     tasks.generate_backup_drupal_database(backup_prod_database_job, PROD_ENV)
 
     # Stage to deploy to prod
     deploy_stage_for_prod = pipeline.ensure_stage(DEPLOY_PROD_STAGE_NAME)
     deploy_job_for_prod = deploy_stage_for_prod.ensure_job(DEPLOY_PROD_JOB_NAME)
 
-    tasks.generate_requirements_install(deploy_job_for_prod, 'tubular')
+    tasks.generate_virtualenv_install(deploy_job_for_prod, ['tubular'])
     tasks.generate_target_directory(deploy_job_for_prod)
     deploy_job_for_prod.add_task(FetchArtifactTask(**new_tag_name_artifact_params))
     tasks.generate_drupal_deploy(deploy_job_for_prod, PROD_ENV, '{new_tag}.txt'.format(new_tag=NEW_TAG_NAME))
@@ -166,7 +169,8 @@ def install_pipelines(configurator, config, env_configs):
     clear_prod_caches_job = clear_prod_caches_stage.ensure_job(CLEAR_PROD_CACHES_JOB_NAME)
 
     tasks.fetch_edx_mktg(clear_prod_caches_job, 'edx-mktg')
-    tasks.generate_requirements_install(clear_prod_caches_job, 'tubular')
+    stages.set_job_class(clear_prod_caches_job, stages.JobClass.SECRETS)
+    tasks.generate_virtualenv_install(clear_prod_caches_job, ['tubular'])
     tasks.format_RSA_key(clear_prod_caches_job, 'edx-mktg/docroot/acquia_github_key.pem', '$PRIVATE_ACQUIA_GITHUB_KEY')
     tasks.generate_flush_drupal_caches(clear_prod_caches_job, PROD_ENV)
     tasks.generate_clear_varnish_cache(clear_prod_caches_job, PROD_ENV)
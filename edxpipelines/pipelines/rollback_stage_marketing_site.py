@@ -9,6 +9,7 @@ sys.path.append(path.dirname(path.dirname(path.dirname(path.abspath(__file__))))
 
 from edxpipelines import utils
 from edxpipelines import constants
+from edxpipelines.patterns import stages
 from edxpipelines.patterns import tasks
 from edxpipelines.constants import *
 from edxpipelines.pipelines.script import pipeline_script
@@ -56,7 +57,7 @@ def install_pipelines(configurator, config, env_configs):
     rollback_stage.set_has_manual_approval()
     rollback_job = rollback_stage.ensure_job(ROLLBACK_JOB_NAME)
 
-    tasks.generate_requirements_install(rollback_job, 'tubular')
+    tasks.generate_virtualenv_install(rollback_job, ['tubular'])
     tasks.generate_target_directory(rollback_job)
     rollback_job.add_task(FetchArtifactTask(**stage_tag_name_artifact_params))
     tasks.generate_drupal_deploy(rollback_job, STAGE_ENV, '{stage_tag}.txt'.format(stage_tag=STAGE_TAG_NAME))
@@ -66,7 +67,8 @@ def install_pipelines(configurator, config, env_configs):
     clear_stage_caches_job = clear_stage_caches_stage.ensure_job(CLEAR_STAGE_CACHES_JOB_NAME)
 
     tasks.fetch_edx_mktg(clear_stage_caches_job, 'edx-mktg')
-    tasks.generate_requirements_install(clear_stage_caches_job, 'tubular')
+    stages.set_job_class(clear_stage_caches_job, stages.JobClass.SECRETS)
+    tasks.generate_virtualenv_install(clear_stage_caches_job, ['tubular'])
     tasks.format_RSA_key(clear_stage_caches_job, 'edx-mktg/docroot/acquia_github_key.pem', '$PRIVATE_ACQUIA_GITHUB_KEY')
     tasks.generate_flush_drupal_caches(clear_stage_caches_job, STAGE_ENV)
     tasks.generate_clear_varnish_cache(clear_stage_caches_job, STAGE_ENV)
@@ -1,10 +1,50 @@
 import functools
+import hashlib
+import inspect
 from itertools import groupby
+import os.path
 
 import click
 from gomatic import *
 
+import edxpipelines.artifacts as artifacts
+import edxpipelines.config_repo as config_repo
+import edxpipelines.encryption as encryption
+import edxpipelines.job_classes as job_classes
+import edxpipelines.materials as materials
+import edxpipelines.optimize as optimize
+from edxpipelines.index import IndexedConfigurator
+import edxpipelines.partial as partial
 import edxpipelines.utils as utils
+import edxpipelines.validation as validation
+
+
+def gocd_host(url):
+    """
+    Split a GoCD url into the host (and port) and whether to use ssl.
+
+    Urls without a scheme are reached with https.
+
+    Returns:
+        (str, bool): the host, and whether to use ssl
+    """
+    for scheme, ssl in (('https://', True), ('http://', False)):
+        if url.startswith(scheme):
+            return url[len(scheme):].rstrip('/'), ssl
+    return url, True
+
+
+def script_owner(install_pipelines, variable_files):
+    """
+    A name for a script run with ``variable_files``, telling apart the runs of the same script
+    that generate different pipelines.
+
+    Returns:
+        str: the name of the script, and a hash of the names of its variable files
+    """
+    script_name = os.path.splitext(os.path.basename(inspect.getfile(install_pipelines)))[0]
+    files = ','.join(os.path.basename(path) for path in variable_files)
+    return '{}-{}'.format(script_name, hashlib.sha1(files).hexdigest()[:8])
 
 
 def pipeline_script(install_pipelines, environments=()):
@@ -23,7 +63,8 @@ def pipeline_script(install_pipelines, environments=()):
     @click.option(
         '--dry-run',
         envvar='DRY_RUN',
-        help='Perform a dry run of the pipeline installation, and save the pre/post xml configurations locally.',
+        help='Perform a dry run of the pipeline installation, and save the pre/post xml configurations locally '
+             '(with --config-repo-dir, list the files that would change). Secrets are not sent to the server.',
         required=False,
         default=False,
         is_flag=True
@@ -52,7 +93,53 @@ def pipeline_script(install_pipelines, environments=()):
         nargs=2,
         default={}
     )
-    def cli(save_config_locally, dry_run, variable_files, env_variable_files, cmd_line_vars):
+    @click.option(
+        '--encryption-cache', 'encryption_cache_path',
+        envvar='GOCD_ENCRYPTION_CACHE',
+        help='Path to the local cache of encrypted secure variable values.',
+        required=False,
+        default='.gocd_encryption_cache.json',
+        type=click.Path(dir_okay=False),
+    )
+    @click.option(
+        '--config-repo-dir',
+        envvar='CONFIG_REPO_DIR',
+        help='Write each pipeline to a config-repo file in this directory, instead of saving the server config.',
+        required=False,
+        default=None,
+        type=click.Path(file_okay=False),
+    )
+    @click.option(
+        '--config-repo-format',
+        help='The format of the config-repo files.',
+        required=False,
+        default='yaml',
+        type=click.Choice(sorted(config_repo.FILE_EXTENSIONS)),
+    )
+    @click.option(
+        '--gocd-url',
+        envvar='GOCD_URL',
+        help='The GoCD server to use, instead of the gocd_url variable. Use an http:// url to connect without ssl.',
+        required=False,
+        default=None,
+    )
+    @click.option(
+        '--skip-validation',
+        help='Save the config without first validating it against the GoCD schema.',
+        required=False,
+        default=False,
+        is_flag=True,
+    )
+    @click.option(
+        '--only', 'only_pipelines',
+        multiple=True,
+        metavar='PIPELINE',
+        help='Only save this pipeline, leaving the others the script generates as they are. Can be repeated.',
+        required=False,
+        default=[],
+    )
+    def cli(save_config_locally, dry_run, variable_files, env_variable_files, cmd_line_vars, encryption_cache_path,
+            config_repo_dir, config_repo_format, gocd_url, skip_validation, only_pipelines):
         # Merge the configuration files/variables together
         config = utils.merge_files_and_dicts(variable_files, list(cmd_line_vars,))
         env_vars = {
@@ -68,15 +155,82 @@ def pipeline_script(install_pipelines, environments=()):
             for env, files in env_vars.items()
         }
 
+        host, ssl = gocd_host(gocd_url or config['gocd_url'])
+        # How the shared materials are polled and cloned, in every pipeline of the script.
+        materials.configure(**config.get('material_defaults', {}))
+        # The agents each class of job runs on.
+        job_classes.configure_job_classes(config.get('job_classes', {}))
+
         # Create the pipeline
-        configurator = GoCdConfigurator(HostRestClient(
-            config['gocd_url'],
-            config['gocd_username'],
-            config['gocd_password'],
-            ssl=True
-        ))
+        if config_repo_dir:
+            # Config-repo files only need the generated pipelines, not the server config.
+            configurator = IndexedConfigurator(GoCdConfigurator(empty_config()))
+        else:
+            configurator = IndexedConfigurator(GoCdConfigurator(HostRestClient(
+                host,
+                config['gocd_username'],
+                config['gocd_password'],
+                ssl=ssl
+            )))
+        initial_config = configurator.config if only_pipelines else None
         return_val = install_pipelines(configurator, config, env_configs)
-        configurator.save_updated_config(save_config_locally=save_config_locally, dry_run=dry_run)
+        # Fetches from pipelines that were only created later in the script can only be checked now.
+        unresolved_fetches = configurator.artifact_registry.unresolved()
+        if unresolved_fetches:
+            raise artifacts.UnpublishedArtifact('\n'.join(unresolved_fetches))
+        # Other pipelines on the server could use any stage, unless the whole script is saved to the server.
+        complete_config = not (config_repo_dir or only_pipelines)
+        if configurator.stage_fusion and not complete_config:
+            click.echo('Warning: not fusing the stages of {}, without the complete server config'.format(
+                ', '.join(sorted(configurator.stage_fusion)),
+            ), err=True)
+        for pipeline_name, fused_stages in optimize.optimize_pipelines(configurator, complete_config).items():
+            for stage_names in fused_stages:
+                click.echo('Fused stages {} of {}'.format(', '.join(stage_names), pipeline_name))
+        if only_pipelines:
+            # The whole script runs, so that the selected pipelines see everything they depend on,
+            # but only they are saved.
+            try:
+                upstreams = partial.select_pipelines(
+                    configurator, initial_config, only_pipelines, check_upstreams=not config_repo_dir,
+                )
+            except partial.PartialGenerationError as error:
+                raise click.UsageError(str(error))
+            if upstreams:
+                click.echo('Generated {} with upstream pipelines {}'.format(
+                    ', '.join(only_pipelines), ', '.join(sorted(upstreams)),
+                ))
+        cache = encryption.EncryptionCache(
+            encryption_cache_path,
+            encryption.credentials_secret(config['gocd_username'], config['gocd_password']),
+        )
+        if dry_run:
+            # A dry run never sends secrets to the server: values that aren't cached get stand-in
+            # ciphertexts, which are not saved to the cache.
+            encrypter = encryption.LocalEncrypter()
+            cache.path = None
+        else:
+            encrypter = encryption.GoCdEncrypter(host, config['gocd_username'], config['gocd_password'], ssl=ssl)
+        encryption.encrypt_secure_variables(
+            configurator, encrypter, cache, encryption.cipher_identity(host, None if config_repo_dir else configurator),
+        )
+        if not skip_validation:
+            # References to other pipelines can only be checked against the full server config.
+            warnings = validation.validate_config(
+                configurator.config, check_references=not config_repo_dir, pipelines=configurator.changed_pipelines,
+            )
+            for warning in warnings:
+                click.echo('Warning: {}'.format(warning), err=True)
+        if config_repo_dir:
+            for path in config_repo.export_pipelines(configurator, config_repo_dir, config_repo_format, dry_run):
+                click.echo('{} {}'.format('Would write' if dry_run else 'Wrote', path))
+            owner = script_owner(install_pipelines, variable_files + tuple(file for _, file in env_variable_files))
+            for path in config_repo.remove_stale_pipelines(
+                    configurator, config_repo_dir, owner, config_repo_format, dry_run, complete=not only_pipelines,
+            ):
+                click.echo('{} {}'.format('Would remove' if dry_run else 'Removed', path))
+        else:
+            configurator.save_updated_config(save_config_locally=save_config_locally, dry_run=dry_run)
         return return_val
 
     cli()
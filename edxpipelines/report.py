@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+"""
+Reports on generated GoCD configurations.
+"""
+from collections import Counter
+import sys
+
+import click
+import lxml.etree as ElementTree
+import yaml
+
+from edxpipelines import constants
+from edxpipelines.canonicalize import PARSER
+from edxpipelines.job_classes import JobClass
+
+LEVELS = ('group', 'pipeline', 'stage', 'job', 'task')
+
+# Elements whose text is a free-form string that tends to be repeated across pipelines.
+STRING_TAGS = ('arg', 'value', 'encryptedValue')
+
+
+def _task_name(index, element):
+    """
+    A short, human-readable name for a task.
+    """
+    if element.tag == 'fetchartifact':
+        summary = '/'.join(
+            element.get(attr) or '' for attr in ('pipeline', 'stage', 'job')
+        ) + '/' + (element.get('srcfile') or element.get('srcdir') or '')
+    else:
+        args = [arg.text or '' for arg in element.findall('arg') if arg.text != '-c']
+        summary = ' '.join([element.get('command') or ''] + args[:1])
+    summary = ' '.join(summary.split())
+    if len(summary) > 60:
+        summary = summary[:57] + '...'
+    return '{}: {} {}'.format(index, element.tag, summary)
+
+
+def _children(level, element):
+    """
+    The named children of ``element`` at the next level of the report.
+    """
+    if level is None:
+        return [(group.get('group'), group) for group in element.findall('pipelines')]
+    elif level == 'group':
+        return [(pipeline.get('name'), pipeline) for pipeline in element.findall('pipeline')]
+    elif level == 'pipeline':
+        return [(stage.get('name'), stage) for stage in element.findall('stage')]
+    elif level == 'stage':
+        return [(job.get('name'), job) for job in element.findall('jobs/job')]
+    elif level == 'job':
+        return [(_task_name(index, task), task) for index, task in enumerate(element.findall('tasks/*'))]
+    return []
+
+
+def _node(level, name, element, string_counts, depth):
+    node = {
+        'level': level,
+        'name': name,
+        'bytes': len(ElementTree.tostring(element)),
+        'tasks': 1 if level == 'task' else len(element.findall('.//tasks/*')),
+        'env_vars': len(element.findall('.//variable')),
+        'duplicated_strings': sum(
+            1 for child in element.iter(*STRING_TAGS)
+            if child.text and string_counts[child.text] > 1
+        ),
+    }
+    next_level = LEVELS[LEVELS.index(level) + 1] if level != LEVELS[-1] else None
+    if next_level is not None and LEVELS.index(next_level) <= depth:
+        children = [
+            _node(next_level, child_name, child, string_counts, depth)
+            for child_name, child in _children(level, element)
+        ]
+        # Tasks stay in execution order; everything else is listed largest first.
+        if next_level != 'task':
+            children.sort(key=lambda child: -child['bytes'])
+        node['children'] = children
+    return node
+
+
+def size_report(config_xml, depth='job'):
+    """
+    Break down the size of a GoCD configuration by group, pipeline, stage, job and task.
+
+    Args:
+        config_xml (ElementTree): a GoCD config xml tree
+        depth (str): the most detailed level to report on, one of ``LEVELS``
+
+    Returns:
+        list of dict: one node per pipeline group, each with ``bytes``, ``tasks``,
+            ``env_vars`` and ``duplicated_strings`` counts, and ``children`` nodes
+            for the next level down, largest first (except tasks, which are in
+            execution order). ``duplicated_strings`` counts
+            the argument and variable values that occur more than once in the
+            whole configuration.
+    """
+    root = config_xml.getroot()
+    string_counts = Counter(element.text for element in root.iter(*STRING_TAGS) if element.text)
+    return sorted(
+        (
+            _node('group', name, group, string_counts, LEVELS.index(depth))
+            for name, group in _children(None, root)
+        ),
+        key=lambda node: -node['bytes'],
+    )
+
+
+def polling_report(config_xml):
+    """
+    Break down the git materials of a GoCD configuration by repository and branch.
+
+    The server polls each repository and branch that any pipeline polls once per material update interval,
+    however many pipelines poll it, but it checks each polling material of each pipeline for changes.
+
+    Args:
+        config_xml (ElementTree): a GoCD config xml tree
+
+    Returns:
+        dict: ``repos``, a list of dicts with the ``url`` and ``branch`` of each repository, and the number of
+            ``pipelines`` that use it, of them that ``poll`` it, and of them that clone it ``shallow``,
+            most polled first; and the ``totals`` of those counts (with ``repos`` and ``polled_repos``
+            instead of url and branch)
+    """
+    repos = {}
+    for pipeline in config_xml.getroot().findall('pipelines/pipeline'):
+        for material in pipeline.findall('materials/git'):
+            key = (material.get('url'), material.get('branch') or 'master')
+            repo = repos.setdefault(key, {'url': key[0], 'branch': key[1], 'pipelines': 0, 'poll': 0, 'shallow': 0})
+            repo['pipelines'] += 1
+            repo['poll'] += material.get('autoUpdate', 'true') == 'true'
+            repo['shallow'] += material.get('shallowClone') == 'true'
+    repos = sorted(repos.values(), key=lambda repo: (-repo['poll'], -repo['pipelines'], repo['url'], repo['branch']))
+    totals = {
+        count: sum(repo[count] for repo in repos) for count in ('pipelines', 'poll', 'shallow')
+    }
+    totals.update(repos=len(repos), polled_repos=sum(1 for repo in repos if repo['poll']))
+    return {'repos': repos, 'totals': totals}
+
+
+UNCLASSIFIED = 'unclassified'
+JOB_CLASSES = tuple(job_class.value for job_class in JobClass) + (UNCLASSIFIED,)
+
+
+def job_class_report(config_xml):
+    """
+    Count the jobs of each pipeline of a GoCD configuration by class (see edxpipelines.job_classes).
+
+    Args:
+        config_xml (ElementTree): a GoCD config xml tree
+
+    Returns:
+        dict: ``pipelines``, a list of dicts with the ``name`` of each pipeline and its number of ``jobs``
+            of each of ``JOB_CLASSES``, in the order of the config; and the ``totals`` of each class
+    """
+    pipelines = []
+    for pipeline in config_xml.getroot().findall('pipelines/pipeline'):
+        jobs = Counter()
+        for job in pipeline.findall('stage/jobs/job'):
+            job_class = job.find("environmentvariables/variable[@name='{}']/value".format(constants.JOB_CLASS_VARIABLE))
+            jobs[job_class.text if job_class is not None else UNCLASSIFIED] += 1
+        pipelines.append({
+            'name': pipeline.get('name'), 'jobs': {job_class: jobs[job_class] for job_class in JOB_CLASSES},
+        })
+    totals = {job_class: sum(pipeline['jobs'][job_class] for pipeline in pipelines) for job_class in JOB_CLASSES}
+    return {'pipelines': pipelines, 'totals': totals}
+
+
+def _print_table(nodes, output, indent=0):
+    for node in nodes:
+        output.write('{bytes:>10} {tasks:>6} {env_vars:>6} {duplicated_strings:>6}  {indent}{name}\n'.format(
+            indent='  ' * indent, **node
+        ))
+        _print_table(node.get('children', []), output, indent + 1)
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.argument('config_file', nargs=1, type=click.File('rb'))
+@click.option('--depth', type=click.Choice(LEVELS), default='job', help='The most detailed level to report on.')
+@click.option(
+    '--output-format', type=click.Choice(['table', 'yaml']), default='table',
+    help='Print a table, or yaml that can be stored and compared over time.',
+)
+def size(config_file, depth, output_format):
+    """
+    Report the size of CONFIG_FILE (such as config-after.xml) by group, pipeline, stage, job and task.
+    """
+    report = size_report(ElementTree.parse(config_file, parser=PARSER), depth)
+    if output_format == 'yaml':
+        yaml.safe_dump(report, sys.stdout, default_flow_style=False)
+    else:
+        sys.stdout.write('{:>10} {:>6} {:>6} {:>6}  {}\n'.format('bytes', 'tasks', 'vars', 'dups', 'name'))
+        _print_table(report, sys.stdout)
+
+
+@cli.command()
+@click.argument('config_file', nargs=1, type=click.File('rb'))
+@click.option(
+    '--output-format', type=click.Choice(['table', 'yaml']), default='table',
+    help='Print a table, or yaml that can be stored and compared over time.',
+)
+def polling(config_file, output_format):
+    """
+    Report how many pipelines of CONFIG_FILE (such as config-after.xml) use, poll and shallow clone each git
+    repository and branch.
+    """
+    report = polling_report(ElementTree.parse(config_file, parser=PARSER))
+    if output_format == 'yaml':
+        yaml.safe_dump(report, sys.stdout, default_flow_style=False)
+        return
+    sys.stdout.write('{:>9} {:>6} {:>7}  {}\n'.format('pipelines', 'poll', 'shallow', 'repository'))
+    for repo in report['repos']:
+        sys.stdout.write('{pipelines:>9} {poll:>6} {shallow:>7}  {url} {branch}\n'.format(**repo))
+    sys.stdout.write(
+        '{pipelines:>9} {poll:>6} {shallow:>7}  total: {polled_repos} of {repos} repositories polled\n'.format(
+            **report['totals']
+        )
+    )
+
+
+@cli.command('job-classes')
+@click.argument('config_file', nargs=1, type=click.File('rb'))
+@click.option(
+    '--output-format', type=click.Choice(['table', 'yaml']), default='table',
+    help='Print a table, or yaml that can be stored and compared over time.',
+)
+def job_classes(config_file, output_format):
+    """
+    Report how many jobs of each class each pipeline of CONFIG_FILE (such as config-after.xml) has.
+    """
+    report = job_class_report(ElementTree.parse(config_file, parser=PARSER))
+    if output_format == 'yaml':
+        yaml.safe_dump(report, sys.stdout, default_flow_style=False)
+        return
+    row = ' '.join('{{{}:>{}}}'.format(index, len(job_class)) for index, job_class in enumerate(JOB_CLASSES))
+    row += '  {name}\n'
+    sys.stdout.write(row.format(*JOB_CLASSES, name='pipeline'))
+    for pipeline in report['pipelines']:
+        sys.stdout.write(row.format(*(pipeline['jobs'][job_class] for job_class in JOB_CLASSES), name=pipeline['name']))
+    sys.stdout.write(row.format(*(report['totals'][job_class] for job_class in JOB_CLASSES), name='total'))
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,112 @@
+"""
+Select the pipeline scripts affected by a change, so that the script tests
+(and live dry runs) can skip the scripts whose output can't have changed.
+
+A script is affected if it, any repository module it imports, or any of its
+variable files has changed. Changes to the test harness or the shared test
+config, and to data files that the modules might read, affect every script.
+"""
+import os.path
+import subprocess
+
+from edxpipelines.dependencies import module_dependencies
+
+MAIN_BRANCHES = ('master', 'main')
+
+# Files that every script test depends on.
+FULL_RUN_FILES = ('config.yml', 'test-config.yml', 'tox.ini', 'requirements.txt')
+FULL_RUN_DIRECTORIES = ('requirements/', 'edxpipelines/tests/scripts/')
+
+
+def _git(root, *args):
+    return subprocess.check_output(('git',) + args, cwd=root).splitlines()
+
+
+def changed_files(ref, root):
+    """
+    The files under ``root`` that differ from the commit ``ref``, including uncommitted and untracked files.
+
+    Returns:
+        set of str: paths relative to ``root``
+    """
+    changed = set(_git(root, 'diff', '--name-only', '--relative', ref))
+    changed.update(_git(root, 'ls-files', '--others', '--exclude-standard'))
+    return changed
+
+
+def on_main_branch(root):
+    """
+    Whether the working tree is on one of the ``MAIN_BRANCHES``, locally or in a Travis branch build.
+    """
+    if os.environ.get('TRAVIS_PULL_REQUEST') == 'false' and os.environ.get('TRAVIS_BRANCH') in MAIN_BRANCHES:
+        return True
+    return _git(root, 'rev-parse', '--abbrev-ref', 'HEAD')[0] in MAIN_BRANCHES
+
+
+def variable_files(script):
+    """
+    The variable files that a script entry from config.yml reads.
+    """
+    files = list(script.get('variable_file', []))
+    files.extend(path for _, path in script.get('env-variable-file', []))
+    return files
+
+
+def script_inputs(script, root):
+    """
+    The files under ``root`` that the output of a script entry from config.yml depends on.
+
+    Returns:
+        set of str: paths relative to ``root``
+    """
+    inputs = {os.path.relpath(path, root) for path in module_dependencies(os.path.join(root, script['script']), root)}
+    inputs.update(os.path.normpath(path) for path in variable_files(script))
+    return inputs
+
+
+def needs_full_run(path, known_inputs):
+    """
+    Whether a change to ``path`` could affect every script.
+
+    Args:
+        path (str): a changed file, relative to the repository root
+        known_inputs (set of str): the modules and variable files that some script is known to depend on
+    """
+    if os.path.basename(path) == 'conftest.py' or path in FULL_RUN_FILES:
+        return True
+    if path.startswith(FULL_RUN_DIRECTORIES):
+        return True
+    # Data files (schemas, templates, ...) are read by modules in ways that imports don't show.
+    return (
+        path.startswith('edxpipelines/') and not path.startswith('edxpipelines/tests/') and
+        not path.endswith('.py') and path not in known_inputs
+    )
+
+
+def affected_scripts(scripts, changed, root, harness=()):
+    """
+    The script entries from config.yml whose output may be affected by the ``changed`` files.
+
+    Args:
+        scripts (list of dict): script entries from config.yml
+        changed (set of str): changed paths, relative to ``root``
+        root (str): the repository root
+        harness (list of str): the modules that test the scripts. A change to
+            any of them, or to a module they import, affects every script.
+
+    Returns:
+        list of dict: the affected entries, in their original order
+    """
+    harness_files = {
+        os.path.relpath(path, root)
+        for module in harness
+        for path in module_dependencies(module, root)
+    }
+    if harness_files & changed:
+        return list(scripts)
+
+    inputs = [script_inputs(script, root) for script in scripts]
+    known_inputs = set().union(*inputs)
+    if any(needs_full_run(path, known_inputs) for path in changed):
+        return list(scripts)
+    return [script for script, script_files in zip(scripts, inputs) if script_files & changed]
@@ -0,0 +1,138 @@
+"""
+Golden snapshots of generated pipelines, stored as hashes.
+
+Each pipeline is summarised by a tree of hashes of its canonical xml: one for
+the whole pipeline, and one for each of its top-level settings, stages and
+jobs. Each hash covers the hashes of everything below it, so comparing two
+snapshots shows which parts of which pipelines changed without keeping (or
+diffing) the xml itself.
+"""
+from collections import Counter, OrderedDict
+import hashlib
+
+import yaml
+
+HASH_LENGTH = 16
+# The path of the hash of a whole pipeline, including the group it's in.
+PIPELINE_PATH = 'pipeline'
+
+
+def element_hash(element):
+    """
+    A hash of ``element``, its attributes and text, and (recursively) its children.
+    """
+    digest = hashlib.sha1()
+    digest.update(element.tag)
+    for name, value in sorted(element.attrib.items()):
+        digest.update('\0{}={}'.format(name, value.encode('utf-8')))
+    digest.update('\0' + (element.text or '').strip().encode('utf-8'))
+    for child in element:
+        if isinstance(child.tag, basestring):
+            digest.update(element_hash(child))
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def _child_path(element, seen):
+    """
+    The snapshot path of a child of a pipeline. ``seen`` counts the tags already used.
+    """
+    if element.tag == 'stage':
+        name = 'stage {}'.format(element.get('name'))
+    else:
+        name = element.tag
+    seen[name] += 1
+    return name if seen[name] == 1 else '{} {}'.format(name, seen[name])
+
+
+def pipeline_snapshot(group_name, pipeline):
+    """
+    The hash tree of a pipeline element, as a flat mapping of paths to hashes.
+
+    The path of the whole pipeline is ``PIPELINE_PATH``.
+    Stages are at ``stage <name>``, their jobs at ``stage <name>/job <name>``,
+    and every other setting is at its tag (``materials``, ``timer``, ...).
+    """
+    digest = hashlib.sha1(group_name.encode('utf-8'))
+    digest.update(element_hash(pipeline))
+    snapshot = {PIPELINE_PATH: digest.hexdigest()[:HASH_LENGTH]}
+    seen = Counter()
+    for child in pipeline:
+        if not isinstance(child.tag, basestring):
+            continue
+        path = _child_path(child, seen)
+        snapshot[path] = element_hash(child)
+        for job in child.iterfind('jobs/job') if child.tag == 'stage' else ():
+            snapshot['{}/job {}'.format(path, job.get('name'))] = element_hash(job)
+    return snapshot
+
+
+def config_snapshot(config):
+    """
+    The hash trees of every pipeline in a cruise-config tree or element.
+
+    Returns:
+        dict: pipeline name -> the pipeline's ``pipeline_snapshot``
+    """
+    root = config.getroot() if hasattr(config, 'getroot') else config
+    return {
+        pipeline.get('name'): pipeline_snapshot(group.get('group'), pipeline)
+        for group in root.iterfind('pipelines')
+        for pipeline in group.iterfind('pipeline')
+    }
+
+
+def _changed_paths(expected, actual):
+    """
+    Describe the differences between two pipeline snapshots, at the deepest level that changed.
+    """
+    changes = []
+    for path in sorted(set(expected) | set(actual)):
+        if path == PIPELINE_PATH or expected.get(path) == actual.get(path):
+            continue
+        if path not in actual:
+            changes.append('removed {}'.format(path))
+        elif path not in expected:
+            changes.append('added {}'.format(path))
+        elif not any(
+            other.startswith(path + '/') and expected.get(other) != actual.get(other)
+            for other in set(expected) | set(actual)
+        ):
+            # A stage that only changed within its jobs is described by its jobs.
+            changes.append('changed {}'.format(path))
+    if not changes and expected.get(PIPELINE_PATH) != actual.get(PIPELINE_PATH):
+        changes.append('changed pipeline settings or group')
+    return changes
+
+
+def diff_snapshots(expected, actual):
+    """
+    Describe how the pipelines in two config snapshots differ.
+
+    Returns:
+        OrderedDict: pipeline name -> list of str, for each pipeline that was added, removed or changed
+    """
+    differences = OrderedDict()
+    for name in sorted(set(expected) | set(actual)):
+        if name not in actual:
+            differences[name] = ['pipeline removed']
+        elif name not in expected:
+            differences[name] = ['pipeline added']
+        elif expected[name][PIPELINE_PATH] != actual[name][PIPELINE_PATH]:
+            differences[name] = _changed_paths(expected[name], actual[name])
+    return differences
+
+
+def load_snapshots(path):
+    """
+    The snapshots saved in ``path``, or an empty dict if there are none.
+    """
+    try:
+        with open(path) as snapshot_file:
+            return yaml.safe_load(snapshot_file) or {}
+    except IOError:
+        return {}
+
+
+def save_snapshots(path, snapshots):
+    with open(path, 'w') as snapshot_file:
+        yaml.safe_dump(snapshots, snapshot_file, default_flow_style=False)
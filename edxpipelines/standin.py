@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+"""
+A local stand-in for the parts of the GoCD API used by the pipeline scripts.
+
+It serves and accepts the cruise-config xml, rejecting saves based on a stale
+md5 as GoCD does, and encrypts secure variable values. Latency and failures
+can be injected, and the requests and payload sizes for each endpoint are
+counted, so that deploys can be run and measured end to end without a real
+GoCD server:
+
+    python -m edxpipelines.standin run -- python deploy_pipelines.py tools -f config.yml
+
+``run`` sets ``GOCD_URL``, which the pipeline scripts use in place of the
+``gocd_url`` variable.
+"""
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from collections import defaultdict
+import hashlib
+import json
+import os
+import random
+from SocketServer import ThreadingMixIn
+import subprocess
+import sys
+import threading
+import time
+import urlparse
+
+import click
+from gomatic.fake import empty_config_xml
+import yaml
+
+from edxpipelines.encryption import ENCRYPT_PATH, LocalEncrypter
+
+VERSION_PATH = '/go/api/version'
+CONFIG_GET_PATH = '/go/admin/restful/configuration/file/GET/xml'
+CONFIG_POST_PATH = '/go/admin/restful/configuration/file/POST/xml'
+STATS_PATH = '/standin/stats'
+
+SERVER_VERSION = '16.12.0'
+
+
+class StandinState(object):
+    """
+    The config held by the stand-in, its behaviour settings, and its request statistics.
+
+    Args:
+        config (str): the initial cruise-config xml
+        latency (float): seconds to wait before answering each request
+        failure_rate (float): the fraction of GoCD API requests to fail
+        failure_status (int): the http status of injected failures
+        seed (int): the seed for choosing which requests fail, so that runs are reproducible
+    """
+    def __init__(self, config=empty_config_xml, latency=0, failure_rate=0, failure_status=503, seed=0):
+        self.lock = threading.Lock()
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.random = random.Random(seed)
+        self.encrypter = LocalEncrypter(key='standin')
+        self.set_config(config)
+        self.stats = defaultdict(lambda: defaultdict(int))
+
+    def set_config(self, config):
+        self.config = config
+        self.md5 = hashlib.md5(config).hexdigest()
+
+    def record(self, path, name, amount=1):
+        with self.lock:
+            self.stats[path][name] += amount
+
+    def should_fail(self):
+        with self.lock:
+            return self.failure_rate > 0 and self.random.random() < self.failure_rate
+
+    def summary(self):
+        with self.lock:
+            return {path: dict(counts) for path, counts in self.stats.items()}
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """
+    Answers GoCD API requests from the ``StandinState`` of the server.
+    """
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def _respond(self, path, status, body, content_type='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.state.record(path, 'bytes_out', len(body))
+        self.state.record(path, 'status_{}'.format(status))
+
+    def _start(self):
+        """
+        Count the request, and read its body. Returns (path, body, whether the request should fail).
+        """
+        path = urlparse.urlparse(self.path).path
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.state.record(path, 'requests')
+        self.state.record(path, 'bytes_in', len(body))
+        if self.state.latency:
+            time.sleep(self.state.latency)
+        failed = path != STATS_PATH and self.state.should_fail()
+        if failed:
+            self.state.record(path, 'injected_failures')
+            self._respond(path, self.state.failure_status, json.dumps({'message': 'Injected failure'}))
+        return path, body, failed
+
+    def do_GET(self):
+        path, _, failed = self._start()
+        if failed:
+            return
+        if path == VERSION_PATH:
+            self._respond(path, 200, json.dumps({'version': SERVER_VERSION}))
+        elif path == CONFIG_GET_PATH:
+            with self.state.lock:
+                config, md5 = self.state.config, self.state.md5
+            self._respond(path, 200, config, 'text/xml', {'X-CRUISE-CONFIG-MD5': md5})
+        elif path == STATS_PATH:
+            self._respond(path, 200, json.dumps(self.state.summary()))
+        else:
+            self._respond(path, 404, json.dumps({'message': 'Not found'}))
+
+    def do_POST(self):
+        path, body, failed = self._start()
+        if failed:
+            return
+        if path == CONFIG_POST_PATH:
+            form = urlparse.parse_qs(body)
+            config, md5 = form.get('xmlFile', [''])[0], form.get('md5', [''])[0]
+            with self.state.lock:
+                conflict = md5 != self.state.md5
+                if not conflict:
+                    self.state.set_config(config)
+            if conflict:
+                self._respond(path, 409, json.dumps({
+                    'result': 'Configuration file has been modified by someone else.',
+                }))
+            else:
+                self._respond(path, 200, json.dumps({'result': 'Configuration file updated successfully.'}))
+        elif path == ENCRYPT_PATH:
+            value = json.loads(body)['value']
+            with self.state.lock:
+                encrypted = self.state.encrypter.encrypt(value)
+            self._respond(path, 200, json.dumps({'encrypted_value': encrypted}))
+        else:
+            self._respond(path, 404, json.dumps({'message': 'Not found'}))
+
+
+class StandinServer(ThreadingMixIn, HTTPServer):
+    """
+    A threaded http server for a ``StandinState``, so that concurrent deploys can be served.
+    """
+    daemon_threads = True
+
+    def __init__(self, state, host='127.0.0.1', port=0):
+        HTTPServer.__init__(self, (host, port), StandinHandler)
+        self.state = state
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address)
+
+    def start(self):
+        """
+        Serve requests on a background thread.
+        """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+def server_options(command):
+    """
+    The click options that configure a ``StandinState``.
+    """
+    options = [
+        click.option(
+            '--config', 'config_file', type=click.File('rb'), default=None,
+            help='The initial cruise-config xml (an empty config by default).',
+        ),
+        click.option(
+            '--latency', envvar='STANDIN_LATENCY', type=float, default=0,
+            help='Seconds to wait before answering each request.',
+        ),
+        click.option(
+            '--failure-rate', envvar='STANDIN_FAILURE_RATE', type=float, default=0,
+            help='The fraction of requests to fail.',
+        ),
+        click.option(
+            '--failure-status', envvar='STANDIN_FAILURE_STATUS', type=int, default=503,
+            help='The http status of failed requests.',
+        ),
+        click.option(
+            '--seed', envvar='STANDIN_SEED', type=int, default=0,
+            help='Seed for choosing which requests fail.',
+        ),
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
+
+
+def _state(config_file, latency, failure_rate, failure_status, seed):
+    config = config_file.read() if config_file else empty_config_xml
+    return StandinState(config, latency, failure_rate, failure_status, seed)
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@server_options
+@click.option('--port', type=int, default=8153, help='The port to listen on.')
+def serve(config_file, latency, failure_rate, failure_status, seed, port):
+    """
+    Run the stand-in server until interrupted.
+    """
+    server = StandinServer(_state(config_file, latency, failure_rate, failure_status, seed), port=port)
+    click.echo('Serving a GoCD stand-in on {}'.format(server.url))
+    server.serve_forever()
+
+
+@cli.command(context_settings={'ignore_unknown_options': True})
+@server_options
+@click.option(
+    '--stats-file', type=click.File('wb'), default=None,
+    help='Write the request statistics to this file as json, as well as printing them.',
+)
+@click.option(
+    '--final-config', type=click.File('wb'), default=None,
+    help='Write the config held by the stand-in at the end of the run to this file.',
+)
+@click.option(
+    '--port', type=int, default=0,
+    help='The port to listen on (any free port by default). Ciphertexts are cached per server url, '
+         'so use a fixed port to reuse them across runs.',
+)
+@click.argument('command', nargs=-1, type=click.UNPROCESSED, required=True)
+def run(config_file, latency, failure_rate, failure_status, seed, stats_file, final_config, port, command):
+    """
+    Run COMMAND with GOCD_URL pointing at a stand-in server, then report what it sent.
+    """
+    server = StandinServer(_state(config_file, latency, failure_rate, failure_status, seed), port=port).start()
+    environment = dict(os.environ, GOCD_URL=server.url)
+
+    start = time.time()
+    returncode = subprocess.call(list(command), env=environment)
+    stats = {
+        'command': ' '.join(command),
+        'returncode': returncode,
+        'seconds': round(time.time() - start, 3),
+        'config_bytes': len(server.state.config),
+        'endpoints': server.state.summary(),
+    }
+    server.shutdown()
+
+    yaml.safe_dump(stats, sys.stdout, default_flow_style=False)
+    if stats_file:
+        json.dump(stats, stats_file, indent=2, sort_keys=True)
+    if final_config:
+        final_config.write(server.state.config)
+    sys.exit(returncode)
+
+
+if __name__ == '__main__':
+    cli()
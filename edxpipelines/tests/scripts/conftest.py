@@ -1,45 +1,96 @@
-from collections import defaultdict
-import io
+from collections import OrderedDict, defaultdict
+import copy
+import hashlib
 import imp
+import json
+import os
+import re
+import tempfile
 
-import os.path
+import lxml.etree as ElementTree
+import pkg_resources
 import pytest
 import yaml
-from xml.etree import ElementTree
 
 from gomatic import GoCdConfigurator, empty_config
+from edxpipelines.consistency import SystemIndex
 from edxpipelines.deploy import ensure_pipeline
+from edxpipelines.dependencies import module_dependencies
+from edxpipelines.encryption import EncryptionCache, LocalEncrypter, encrypt_secure_variables
+from edxpipelines.index import IndexedConfigurator
+from edxpipelines.optimize import optimize_pipelines
 from edxpipelines.canonicalize import canonicalize_gocd, PARSER
+from edxpipelines import job_classes, materials, selection
 
 
-def pytest_generate_tests(metafunc):
+def load_script_configs(config):
     """
-    Generate test instances for all scripts to be checked.
+    Read the enabled scripts from the config.yml file being tested.
     """
+    config_file = config.rootdir.join(config.option.config_file)
 
-    if 'script' in metafunc.fixturenames:
-        config_file = metafunc.config.rootdir.join(metafunc.config.option.config_file)
+    with config_file.open() as config_file_stream:
+        config_data = yaml.safe_load(config_file_stream)
+
+    return [
+        script
+        for environment, scripts in config_data.items()
+        for script in scripts
+        if environment != 'anchors' and script.pop('enabled')
+    ]
 
-        with config_file.open() as config_file_stream:
-            config_data = yaml.safe_load(config_file_stream)
 
-        # Read all of the scripts from the specified config.yml file.
-        script_configs = [
-            script
-            for environment, scripts in config_data.items()
-            for script in scripts
-            if environment != 'anchors' and script.pop('enabled')
-        ]
+def pytest_generate_tests(metafunc):
+    """
+    Generate test instances for all scripts to be checked.
+    """
 
-        # Inject those scripts via the `script` argument to tests and fixtures
+    if 'script' in metafunc.fixturenames:
+        # Inject the scripts via the `script` argument to tests and fixtures
         metafunc.parametrize(
             'script',
-            script_configs,
+            load_script_configs(metafunc.config),
             ids=lambda script: script.get('script'),
             scope='module'
         )
 
 
+def pytest_collection_modifyitems(config, items):
+    """
+    With ``--changed-since REF``, deselect the tests of scripts that aren't
+    affected by the changes since REF, unless on the main branch.
+    """
+    ref = config.getoption('changed_since')
+    if ref is None:
+        return
+
+    root = str(config.rootdir)
+    reporter = config.pluginmanager.get_plugin('terminalreporter')
+    if selection.on_main_branch(root):
+        if reporter:
+            reporter.write_line('Testing every script on the main branch')
+        return
+
+    scripts = load_script_configs(config)
+    harness = [__file__, os.path.join(os.path.dirname(__file__), 'test_scripts.py')]
+    affected = selection.affected_scripts(scripts, selection.changed_files(ref, root), root, harness)
+    if reporter:
+        reporter.write_line('Testing {} of {} script configs, affected by changes since {}'.format(
+            len(affected), len(scripts), ref,
+        ))
+
+    selected, deselected = [], []
+    for item in items:
+        params = getattr(getattr(item, 'callspec', None), 'params', {})
+        if 'script' in params and params['script'] not in affected:
+            deselected.append(item)
+        else:
+            selected.append(item)
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+        items[:] = selected
+
+
 class MirrorDict(dict):
     """
     A dict that returns a dummy string for any missing keys.
@@ -48,35 +99,170 @@ class MirrorDict(dict):
         return "dummy_{}".format(key)
 
 
-def dummy_ensure_pipeline(script_name):
+def script_test_config(test_config, script_name):
+    """
+    The test config for ``script_name``: a copy of ``test_config``, with the
+    script's overrides from its ``script-config`` section applied to the
+    ``global-config``.
+
+    The overrides give each script's pipelines distinct names, and point
+    their upstream references at pipelines generated by other scripts, so
+    that the output of all of the scripts forms one consistent system.
+    """
+    # Scripts are free to modify their config, so each gets a fresh copy.
+    test_config = copy.deepcopy(test_config)
+    overrides = test_config.pop('script-config', {}).get(script_name, {})
+    test_config.setdefault('global-config', {}).update(overrides)
+    return test_config
+
+
+def dummy_ensure_pipeline(script_name, test_config):
     """
-    Run ``script_name`` against a dummy GoCdConfigurator set to
-    export the config-after.xml.
+    Run ``script_name`` against a dummy GoCdConfigurator, configured from
+    the parsed ``test_config``.
+
+    Returns:
+        GoCdConfigurator: the configurator, with the script's pipelines installed.
     """
-    configurator = GoCdConfigurator(empty_config())
+    configurator = IndexedConfigurator(GoCdConfigurator(empty_config()))
 
     env_configs = defaultdict(MirrorDict)
     config = MirrorDict()
 
-    with open('test-config.yml') as test_config_file:
-        test_config = yaml.safe_load(test_config_file)
-
-    if 'global-config' in test_config:
-        config.update(test_config.pop('global-config'))
+    test_config = script_test_config(test_config, script_name)
+    config.update(test_config.pop('global-config'))
+    # As pipeline_script does, so that no script sees the material settings of the one before.
+    materials.configure(**config.get('material_defaults', {}))
+    job_classes.configure_job_classes(config.get('job_classes', {}))
 
     for env, values in test_config.items():
         env_configs[env].update(values)
 
     script = imp.load_source('pipeline_script', script_name)
     script.install_pipelines(configurator, config, env_configs)
-    configurator.save_updated_config(save_config_locally=True, dry_run=True)
+    assert configurator.artifact_registry.unresolved() == []
+    optimize_pipelines(configurator)
+    encrypt_secure_variables(configurator, LocalEncrypter(), EncryptionCache(), 'local')
+    return configurator
+
+
+@pytest.fixture(scope='session')
+def test_config():
+    """
+    The parsed test-config.yml, loaded once per test session.
+    """
+    with open('test-config.yml') as test_config_file:
+        return yaml.safe_load(test_config_file)
+
+
+class GeneratedConfigCache(object):
+    """
+    Canonicalized script results, kept for the test session and saved in the
+    pytest cache directory for later sessions.
+
+    Results are keyed by the script, and a hash of everything that goes into
+    generating them: the source of the script and of every repository module
+    that it (or this harness) imports, the test config, and the installed
+    gomatic version. Only the latest result of each script is kept on disk.
+    """
+    def __init__(self, directory, root):
+        self.directory = directory
+        self.root = root
+        self._results = {}
+        self._file_digests = {}
+
+    def _file_digest(self, path):
+        if path not in self._file_digests:
+            with open(path, 'rb') as source:
+                self._file_digests[path] = hashlib.sha256(source.read()).hexdigest()
+        return self._file_digests[path]
+
+    @staticmethod
+    def _script_slug(script_name):
+        return os.path.splitext(os.path.basename(script_name))[0]
+
+    def key(self, script_name, test_config):
+        """
+        The cache key for running ``script_name`` with ``test_config``.
+        """
+        paths = set(module_dependencies(script_name, self.root)) | set(module_dependencies(__file__, self.root))
+        digest = hashlib.sha256()
+        digest.update(pkg_resources.get_distribution('gomatic').version)
+        digest.update(json.dumps(script_test_config(test_config, script_name), sort_keys=True))
+        for path in sorted(paths):
+            digest.update(os.path.relpath(path, self.root))
+            digest.update(self._file_digest(path))
+        return '{}-{}'.format(self._script_slug(script_name), digest.hexdigest())
+
+    def get(self, key):
+        """
+        The cached result for ``key``, or None.
+        """
+        if key not in self._results:
+            path = self.directory.join(key + '.xml')
+            if not path.check():
+                return None
+            self._results[key] = ElementTree.parse(str(path), parser=PARSER)
+        return self._results[key]
+
+    def set(self, key, result):
+        self._results[key] = result
+        # Written to a temporary file and renamed, so that parallel workers never read a partial file.
+        handle, temp_path = tempfile.mkstemp(dir=str(self.directory))
+        with os.fdopen(handle, 'wb') as result_file:
+            result.write(result_file)
+        os.rename(temp_path, str(self.directory.join(key + '.xml')))
+        # Earlier results of the same script are out of date.
+        slug = key.rsplit('-', 1)[0]
+        for path in self.directory.listdir('*.xml'):
+            if path.purebasename != key and path.purebasename.rsplit('-', 1)[0] == slug:
+                path.remove(ignore_errors=True)
+
+    def prune(self, script_names):
+        """
+        Remove the saved results of any scripts other than ``script_names``, and any
+        saved with an old naming scheme. (Temporary files may belong to other workers.)
+        """
+        slugs = set(self._script_slug(script_name) for script_name in script_names)
+        for path in self.directory.listdir('*.xml'):
+            match = re.match(r'(.+)-[0-9a-f]{64}\.xml$', path.basename)
+            if not match or match.group(1) not in slugs:
+                path.remove(ignore_errors=True)
+
+
+@pytest.fixture(scope='session')
+def generated_configs(pytestconfig):
+    """
+    The session-wide cache of canonicalized script results. Results of scripts
+    that are no longer configured are removed at the end of the session.
+    """
+    cache = GeneratedConfigCache(pytestconfig.cache.makedir('edxpipelines_configs'), str(pytestconfig.rootdir))
+    yield cache
+    cache.prune(script['script'] for script in load_script_configs(pytestconfig))
+
+
+def generate_script_result(script_name, test_config, generated_configs):
+    """
+    Run ``script_name`` against a dummy server, and return its result in canonical format.
+    """
+    key = generated_configs.key(script_name, test_config)
+    result = generated_configs.get(key)
+    if result is None:
+        configurator = dummy_ensure_pipeline(script_name, test_config)
+        result = canonicalize_gocd(ElementTree.ElementTree(ElementTree.fromstring(configurator.config, parser=PARSER)))
+        generated_configs.set(key, result)
+    return result
 
 
 @pytest.fixture(scope='module')
-def script_result(script, pytestconfig):
+def script_result(script, pytestconfig, test_config, generated_configs):
     """
     A pytest fixture that loads executes a script (either against a live server
     or a dummy server), and returns the parsed results in canonical format.
+
+    Against a dummy server, the script runs in-process and nothing is written
+    to disk, so scripts can be checked in parallel with ``pytest -n``. Results
+    are reused from ``generated_configs`` when nothing they depend on has changed.
     """
     script_name = script.get('script')
 
@@ -86,11 +272,37 @@ def script_result(script, pytestconfig):
             save_config_locally=True,
             **script
         )
-    else:
-        dummy_ensure_pipeline(script_name)
+        return canonicalize_gocd(ElementTree.parse('config-after.xml', parser=PARSER))
+
+    return generate_script_result(script_name, test_config, generated_configs)
+
+
+@pytest.fixture(scope='session')
+def script_results(pytestconfig, test_config, generated_configs):
+    """
+    The results of every script in the config file, by script name, or None
+    when running against a live server (where each script's result is the
+    complete server config).
+    """
+    if pytestconfig.getoption('live'):
+        return None
+
+    script_names = sorted(set(script['script'] for script in load_script_configs(pytestconfig)))
+    return OrderedDict(
+        (script_name, generate_script_result(script_name, test_config, generated_configs))
+        for script_name in script_names
+    )
 
-    input_tree = ElementTree.parse('config-after.xml', parser=PARSER)
-    return canonicalize_gocd(input_tree)
+
+@pytest.fixture(scope='session')
+def system_index(script_results):
+    """
+    A ``SystemIndex`` of the pipelines generated by every script in the config
+    file, or None when running against a live server.
+    """
+    if script_results is None:
+        return None
+    return SystemIndex.from_configs(script_results.items())
 
 
 @pytest.fixture(scope='module')
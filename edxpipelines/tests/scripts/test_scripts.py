@@ -1,119 +1,106 @@
 import os.path
 import os
+import re
 
-from edxpipelines.utils import ArtifactLocation
+import lxml.etree as ElementTree
 import pytest
 
-KNOWN_FAILING_PIPELINES = [
-    'edxpipelines/pipelines/api_deploy.py',
-    'edxpipelines/pipelines/rollback_asgs.py'
-]
+from edxpipelines import snapshots, virtualenvs
+from edxpipelines.consistency import SystemIndex
+from edxpipelines.validation import schema_errors
 
+SNAPSHOT_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'snapshots.yml')
 
-def test_upstream_artifacts(script_result, script_name):
-    if script_name in KNOWN_FAILING_PIPELINES:
-        pytest.xfail("{} is known to be non-independent".format(script_name))
 
-    required_artifacts = set(
-        ArtifactLocation(
-            pipeline=fetch.get('pipeline'),
-            stage=fetch.get('stage'),
-            job=fetch.get('job'),
-            file_name=fetch.get('srcfile', fetch.get('srcdir')),
-        )
-        for fetch in script_result.iter('fetchartifact')
-    )
-
-    provided_artifacts = set(
-        ArtifactLocation(
-            pipeline=pipeline.get('name'),
-            stage=stage.get('name'),
-            job=job.get('name'),
-            file_name=os.path.basename(artifact.get('src')),
-        )
-        for pipeline in script_result.iter('pipeline')
-        for stage in pipeline.findall('stage')
-        for job in stage.iter('job')
-        for artifact in job.iter('artifact')
-    )
-
-    assert required_artifacts - provided_artifacts == set([])
-
-
-def test_upstream_stages(script_result, script_name):
-    if script_name in KNOWN_FAILING_PIPELINES:
-        pytest.xfail("{} is known to be non-independent".format(script_name))
+def test_upstream_references(script_result, system_index):
+    """
+    Every material and fetched artifact of the script's pipelines is provided
+    by a pipeline generated by one of the scripts.
+    """
+    index = system_index or SystemIndex.from_configs([script_result])
+    pipelines = set(pipeline.get('name') for pipeline in script_result.iterfind('pipelines/pipeline'))
+    assert index.errors(pipelines=pipelines, check_artifacts=True) == []
 
-    required_stages = set(
-        (
-            pipeline_material.get('pipelineName'),
-            pipeline_material.get('stageName')
-        )
-        for materials in script_result.iter('materials')
-        for pipeline_material in materials.findall('pipeline')
-    )
-
-    provided_stages = set(
-        (
-            pipeline.get('name'),
-            stage.get('name'),
-        )
-        for pipeline in script_result.iter('pipeline')
-        for stage in pipeline.findall('stage')
-    )
 
-    assert required_stages - provided_stages == set([])
+def test_config_schema(script_result):
+    assert schema_errors(script_result) == []
 
 
 def test_scripts_are_executable(script_name):
     assert os.access(script_name, os.X_OK)
 
 
-def find_available_stages(script_result, target_pipeline, target_stage):
-    """
-    Yields the names of all stages inside ``target_pipeline`` that are available
-    by depending on ``target_stage``.
+def test_snapshots(pytestconfig, script_results):
     """
-    for pipeline in script_result.iter('pipeline'):
-        if pipeline.get('name') != target_pipeline:
-            continue
-
-        for stage in pipeline.iter('stage'):
-            stage_name = stage.get('name')
-            yield stage_name
-            if stage_name == target_stage:
-                return
+    The pipelines generated by every script match the golden snapshots.
 
+    Run with ``--update-snapshots`` to accept changes to the generated pipelines.
+    The xml of each pipeline that doesn't match is saved in the pytest cache.
+    """
+    if script_results is None:
+        pytest.skip('Snapshots are only checked against the dummy server')
+
+    actual = {
+        script_name: snapshots.config_snapshot(result)
+        for script_name, result in script_results.items()
+    }
+    if pytestconfig.getoption('update_snapshots'):
+        snapshots.save_snapshots(SNAPSHOT_FILE, actual)
+        return
+
+    failure_dir = pytestconfig.cache.makedir('edxpipelines_snapshot_failures')
+    for stale in failure_dir.listdir():
+        stale.remove()
+
+    expected = snapshots.load_snapshots(SNAPSHOT_FILE)
+    messages = []
+    for script_name in sorted(set(expected) | set(actual)):
+        differences = snapshots.diff_snapshots(expected.get(script_name, {}), actual.get(script_name, {}))
+        for pipeline_name, changes in differences.items():
+            messages.append('{} {}: {}'.format(script_name, pipeline_name, '; '.join(changes)))
+            for pipeline in script_results.get(script_name, ElementTree.Element('cruise')).iterfind(
+                    'pipelines/pipeline[@name="{}"]'.format(pipeline_name)
+            ):
+                failure_dir.join(pipeline_name + '.xml').write(ElementTree.tostring(pipeline, pretty_print=True))
+
+    if messages:
+        pytest.fail(
+            'Generated pipelines differ from {}:\n{}\n\nThe new xml is in {}. '
+            'Run with --update-snapshots to accept the changes.'.format(
+                os.path.relpath(SNAPSHOT_FILE), '\n'.join(messages), failure_dir,
+            ),
+            pytrace=False,
+        )
 
-def test_upstream_stages_for_artifacts(script_result, script_name):
-    if script_name in ['edxpipelines/pipelines/api_deploy.py']:
-        pytest.xfail("{} is known to be non-independent".format(script_name))
 
-    required_artifacts = set(
-        (
-            pipeline.get('name'),  # This pipeline
-            fetch.get('pipeline'),  # The upstream pipeline
-            fetch.get('stage'),  # The upstream stage
-        )
-        for pipeline in script_result.iter('pipeline')
-        for fetch in pipeline.iter('fetchartifact')
-        if fetch.get('pipeline') != pipeline.get('name')
-    )
-
-    available_stages = set(
-        (
-            pipeline.get('name'),  # This pipeline
-            pipeline_material.get('pipelineName'),  # The upstream pipeline
-            stage,  # The upstream stage
-        )
-        for pipeline in script_result.iter('pipeline')
-        for materials in pipeline.iter('materials')
-        for pipeline_material in materials.findall('pipeline')
-        for stage in find_available_stages(
-            script_result,
-            pipeline_material.get('pipelineName'),
-            pipeline_material.get('stageName')
-        ),
-    )
-
-    assert required_artifacts - available_stages == set([])
+def test_virtualenv_python(script_result):
+    """
+    Jobs that install a virtualenv install a single one, before any task that runs python (or ansible) from a
+    repository, with the requirements of every such repository. They only run python through bash, which
+    activates the virtualenv (through BASH_ENV), and never run the system interpreter explicitly.
+    """
+    problems = []
+    for job in script_result.iterfind('pipelines/pipeline/stage/jobs/job'):
+        if job.find('environmentvariables/variable[@name="BASH_ENV"]') is None:
+            continue
+        installs = [task for task in job.iterfind('tasks/exec') if virtualenvs.installed_dirs(task) is not None]
+        if len(installs) != 1:
+            problems.append('{}: {} virtualenv installs'.format(job.get('name'), len(installs)))
+        installed = set()
+        for task in job.iterfind('tasks/exec'):
+            args = [arg.text or '' for arg in task.iterfind('arg')]
+            dirs = virtualenvs.installed_dirs(task)
+            if dirs is not None:
+                installed.update(dirs)
+            elif task.get('command') != '/bin/bash':
+                if 'python' in task.get('command'):
+                    problems.append('{}: {} {}'.format(job.get('name'), task.get('command'), ' '.join(args)))
+            elif any('/usr/bin/python' in arg for arg in args):
+                problems.append('{}: {}'.format(job.get('name'), ' '.join(args)))
+            elif task.get('workingdir') and re.search(r'\bpython\b|ansible-playbook|\.py\b', ' '.join(args)):
+                repo = task.get('workingdir').split('/')[0]
+                if repo not in installed:
+                    problems.append('{}: runs {} without its requirements: {}'.format(
+                        job.get('name'), repo, ' '.join(args),
+                    ))
+    assert problems == []
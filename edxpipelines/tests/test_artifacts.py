@@ -0,0 +1,91 @@
+import unittest
+
+from ddt import ddt, data
+from gomatic import (
+    BuildArtifact, FetchArtifactDir, FetchArtifactFile, FetchArtifactTask, GoCdConfigurator, empty_config,
+)
+from gomatic.fake import FakeHostRestClient
+
+from edxpipelines.artifacts import UnpublishedArtifact
+from edxpipelines.index import IndexedConfigurator
+from edxpipelines.utils import ArtifactLocation
+
+
+def _configurator(config=None):
+    if config is None:
+        return IndexedConfigurator(GoCdConfigurator(empty_config()))
+    return IndexedConfigurator(GoCdConfigurator(FakeHostRestClient(config)))
+
+
+def _add_build(configurator, artifacts=(BuildArtifact('target/ami.yml'), BuildArtifact('target/logs', 'output'))):
+    build = configurator.ensure_pipeline_group('builds').ensure_replacement_of_pipeline('build')
+    build.ensure_stage('build').ensure_job('build_job').ensure_artifacts(set(artifacts))
+    return build
+
+
+def _fetch(configurator, src, pipeline='build', stage='build', job='build_job'):
+    deploy = configurator.ensure_pipeline_group('deploys').ensure_pipeline('deploy')
+    deploy.ensure_stage('deploy').ensure_job('deploy_job').add_task(FetchArtifactTask(pipeline, stage, job, src))
+
+
+@ddt
+class TestArtifactRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.configurator = _configurator()
+
+    @data(FetchArtifactFile('ami.yml'), FetchArtifactDir('output/logs'), FetchArtifactFile('output/logs/build.log'))
+    def test_published(self, src):
+        _add_build(self.configurator)
+        _fetch(self.configurator, src)
+        self.assertEqual(self.configurator.artifact_registry.unresolved(), [])
+
+    @data(
+        {'src': FetchArtifactFile('missing.yml')},
+        {'src': FetchArtifactFile('ami.yml'), 'job': 'missing_job'},
+        {'src': FetchArtifactFile('ami.yml'), 'stage': 'missing_stage'},
+    )
+    def test_unpublished(self, fetch):
+        _add_build(self.configurator)
+        with self.assertRaises(UnpublishedArtifact):
+            _fetch(self.configurator, **fetch)
+
+    def test_fetch_before_upstream_exists(self):
+        _fetch(self.configurator, FetchArtifactFile('ami.yml'))
+        self.assertEqual(self.configurator.artifact_registry.unresolved(), [])
+
+        _add_build(self.configurator, [BuildArtifact('target/other.yml')])
+        self.assertEqual(len(self.configurator.artifact_registry.unresolved()), 1)
+
+        _add_build(self.configurator)
+        self.assertEqual(self.configurator.artifact_registry.unresolved(), [])
+
+    def test_replaced_consumer(self):
+        _fetch(self.configurator, FetchArtifactFile('missing.yml'))
+        self.configurator.ensure_pipeline_group('deploys').ensure_replacement_of_pipeline('deploy')
+        _add_build(self.configurator)
+        self.assertEqual(self.configurator.artifact_registry.unresolved(), [])
+
+    def test_replaced_producer(self):
+        _add_build(self.configurator)
+        _add_build(self.configurator, [BuildArtifact('target/other.yml')])
+        with self.assertRaises(UnpublishedArtifact):
+            _fetch(self.configurator, FetchArtifactFile('ami.yml'))
+
+    def test_server_config(self):
+        _add_build(self.configurator)
+        configurator = _configurator(self.configurator.config)
+        _fetch(configurator, FetchArtifactFile('ami.yml'))
+        with self.assertRaises(UnpublishedArtifact):
+            _fetch(configurator, FetchArtifactFile('missing.yml'))
+
+    def test_locate(self):
+        build = _add_build(self.configurator)
+        registry = self.configurator.artifact_registry
+        self.assertEqual(registry.locate('build', 'ami.yml'), ArtifactLocation('build', 'build', 'build_job', 'ami.yml'))
+
+        build.ensure_stage('publish').ensure_job('publish_job').ensure_artifacts({BuildArtifact('ami.yml')})
+        with self.assertRaises(UnpublishedArtifact):
+            registry.locate('build', 'ami.yml')
+        with self.assertRaises(UnpublishedArtifact):
+            registry.locate('build', 'missing.yml')
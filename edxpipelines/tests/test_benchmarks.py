@@ -0,0 +1,21 @@
+import unittest
+
+from edxpipelines.benchmarks import fleets
+
+
+class TestFleets(unittest.TestCase):
+
+    def test_measure(self):
+        results = fleets.measure(3)
+        self.assertEqual(list(results), list(fleets.STEPS))
+        for measurement in results.values():
+            self.assertGreaterEqual(measurement['seconds'], 0)
+            self.assertGreater(measurement['peak_rss_kb'], 0)
+
+    def test_regressions(self):
+        base = {'results': {'10': {'install': {'seconds': 1.0}, 'diff': {'seconds': 1.0}}}}
+        head = {'results': {
+            '10': {'install': {'seconds': 1.2}, 'diff': {'seconds': 2.0}},
+            '100': {'install': {'seconds': 10.0}},
+        }}
+        self.assertEqual(fleets.regressions(base, head, 1.25), [('10', 'diff', 1.0, 2.0)])
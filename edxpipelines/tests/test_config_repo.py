@@ -0,0 +1,156 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from ddt import ddt, data
+from gomatic import (
+    ExecTask, FetchArtifactDir, FetchArtifactFile, FetchArtifactTask, GitMaterial, GoCdConfigurator,
+    PipelineMaterial, BuildArtifact, empty_config,
+)
+import yaml
+
+from edxpipelines import config_repo
+
+
+def _configurator():
+    configurator = GoCdConfigurator(empty_config())
+    group = configurator.ensure_pipeline_group('test_group')
+
+    upstream = group.ensure_pipeline('upstream')
+    upstream.set_git_material(GitMaterial('https://github.com/edx/tubular.git', polling=False))
+    job = upstream.ensure_stage('build').ensure_job('build_job')
+    job.add_task(ExecTask(['/bin/bash', '-c', 'make'], working_dir='tubular'))
+    job.ensure_artifacts({BuildArtifact('target/ami.yml')})
+
+    downstream = group.ensure_pipeline('downstream')
+    downstream.ensure_material(PipelineMaterial('upstream', 'build', 'upstream_build'))
+    downstream.ensure_material(GitMaterial(
+        'https://github.com/edx/configuration.git',
+        branch='release',
+        material_name='configuration',
+        destination_directory='configuration',
+        ignore_patterns={'**/*'},
+    ))
+    downstream.ensure_environment_variables({'PLAY': 'edxapp'})
+    downstream.ensure_encrypted_environment_variables({'TOKEN': 'ciphertext'})
+    stage = downstream.ensure_stage('deploy').set_has_manual_approval()
+    job = stage.ensure_job('deploy_job')
+    job.add_task(FetchArtifactTask('upstream', 'build', 'build_job', FetchArtifactFile('ami.yml'), dest='target'))
+    job.add_task(FetchArtifactTask('upstream', 'build', 'build_job', FetchArtifactDir('logs'), runif='any'))
+    return configurator
+
+
+def _pipeline(configurator, name):
+    group = configurator.ensure_pipeline_group('test_group')
+    return group.find_pipeline(name).element
+
+
+@ddt
+class TestConfigRepo(unittest.TestCase):
+
+    def setUp(self):
+        self.configurator = _configurator()
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_json_pipeline(self):
+        pipeline = config_repo.pipeline_to_json('test_group', _pipeline(self.configurator, 'downstream'))
+
+        self.assertEqual(pipeline['group'], 'test_group')
+        self.assertEqual(pipeline['environment_variables'], [
+            {'name': 'PLAY', 'value': 'edxapp'},
+            {'name': 'TOKEN', 'encrypted_value': 'ciphertext'},
+        ])
+        self.assertIn(
+            {'type': 'dependency', 'pipeline': 'upstream', 'stage': 'build', 'name': 'upstream_build'},
+            pipeline['materials'],
+        )
+        self.assertIn(
+            {
+                'type': 'git', 'url': 'https://github.com/edx/configuration.git', 'branch': 'release',
+                'name': 'configuration', 'destination': 'configuration', 'auto_update': True,
+                'shallow_clone': False, 'filter': {'ignore': ['**/*']},
+            },
+            pipeline['materials'],
+        )
+        stage = pipeline['stages'][0]
+        self.assertEqual(stage['approval']['type'], 'manual')
+        self.assertEqual(stage['jobs'][0]['tasks'], [
+            {
+                'type': 'fetch', 'pipeline': 'upstream', 'stage': 'build', 'job': 'build_job',
+                'source': 'ami.yml', 'is_source_a_file': True, 'destination': 'target', 'run_if': 'passed',
+            },
+            {
+                'type': 'fetch', 'pipeline': 'upstream', 'stage': 'build', 'job': 'build_job',
+                'source': 'logs', 'is_source_a_file': False, 'run_if': 'any',
+            },
+        ])
+
+    def test_yaml_pipeline(self):
+        rendered = config_repo.pipeline_to_yaml('test_group', _pipeline(self.configurator, 'upstream'))
+        pipeline = rendered['pipelines']['upstream']
+
+        self.assertEqual(pipeline['materials']['git_0']['auto_update'], False)
+        job = pipeline['stages'][0]['build']['jobs']['build_job']
+        self.assertEqual(job['artifacts'], [{'build': {'source': 'target/ami.yml'}}])
+        self.assertEqual(job['tasks'], [
+            {'exec': {'command': '/bin/bash', 'arguments': ['-c', 'make'], 'working_directory': 'tubular',
+                      'run_if': 'passed'}},
+        ])
+
+    def test_unencrypted_secrets_rejected(self):
+        pipeline = self.configurator.ensure_pipeline_group('test_group').find_pipeline('upstream')
+        pipeline.ensure_unencrypted_secure_environment_variables({'TOKEN': 'plain'})
+        with self.assertRaises(config_repo.UnsupportedConfig):
+            config_repo.pipeline_to_json('test_group', pipeline.element)
+
+    @data('json', 'yaml')
+    def test_export(self, file_format):
+        written = config_repo.export_pipelines(self.configurator, self.tempdir, file_format)
+        self.assertEqual(
+            sorted(os.path.basename(path) for path in written),
+            sorted(name + config_repo.FILE_EXTENSIONS[file_format] for name in ('upstream', 'downstream')),
+        )
+        with open(written[0]) as pipeline_file:
+            (json.load if file_format == 'json' else yaml.safe_load)(pipeline_file)
+
+        # Only changed pipelines are rewritten.
+        self.assertEqual(config_repo.export_pipelines(self.configurator, self.tempdir, file_format), [])
+        pipeline = self.configurator.ensure_pipeline_group('test_group').find_pipeline('downstream')
+        pipeline.ensure_environment_variables({'PLAY': 'ecommerce'})
+        self.assertEqual(
+            [os.path.basename(path) for path in config_repo.export_pipelines(self.configurator, self.tempdir, file_format)],
+            ['downstream' + config_repo.FILE_EXTENSIONS[file_format]],
+        )
+
+    def test_dry_run(self):
+        output_dir = os.path.join(self.tempdir, 'repo')
+        written = config_repo.export_pipelines(self.configurator, output_dir, dry_run=True)
+        self.assertEqual(len(written), 2)
+        self.assertFalse(os.path.exists(output_dir))
+
+    def test_stale_pipelines_removed(self):
+        config_repo.export_pipelines(self.configurator, self.tempdir)
+        self.assertEqual(config_repo.remove_stale_pipelines(self.configurator, self.tempdir, 'script'), [])
+        # Another script's pipelines are never removed.
+        other = os.path.join(self.tempdir, 'other' + config_repo.FILE_EXTENSIONS['yaml'])
+        open(other, 'w').close()
+
+        self.configurator.ensure_pipeline_group('test_group').ensure_removal_of_pipeline('downstream')
+        downstream = os.path.join(self.tempdir, 'downstream' + config_repo.FILE_EXTENSIONS['yaml'])
+        self.assertEqual(
+            config_repo.remove_stale_pipelines(self.configurator, self.tempdir, 'script', complete=False), [],
+        )
+        self.assertEqual(
+            config_repo.remove_stale_pipelines(self.configurator, self.tempdir, 'script', dry_run=True), [downstream],
+        )
+        self.assertTrue(os.path.exists(downstream))
+        self.assertEqual(config_repo.remove_stale_pipelines(self.configurator, self.tempdir, 'script'), [downstream])
+        self.assertEqual(
+            sorted(os.listdir(self.tempdir)),
+            ['.script' + config_repo.MANIFEST_EXTENSION, 'other.gocd.yaml', 'upstream.gocd.yaml'],
+        )
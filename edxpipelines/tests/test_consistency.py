@@ -0,0 +1,121 @@
+import unittest
+
+from ddt import ddt, data, unpack
+from gomatic import (
+    BuildArtifact, FetchArtifactDir, FetchArtifactFile, FetchArtifactTask, GitMaterial, GoCdConfigurator,
+    PipelineMaterial, empty_config,
+)
+
+from edxpipelines.consistency import SystemIndex
+
+
+def _build_config():
+    configurator = GoCdConfigurator(empty_config())
+    build = configurator.ensure_pipeline_group('builds').ensure_pipeline('build')
+    build.ensure_material(GitMaterial('https://github.com/edx/tubular.git'))
+    job = build.ensure_stage('build').ensure_job('build_job')
+    job.ensure_artifacts({BuildArtifact('target/ami.yml'), BuildArtifact('target/logs', 'output')})
+    build.ensure_stage('publish').ensure_job('publish_job').ensure_artifacts({BuildArtifact('ami.yml')})
+    return configurator.config
+
+
+def _deploy_config(fetch_pipeline='build', stage='build', job='build_job', artifact=FetchArtifactFile('ami.yml')):
+    configurator = GoCdConfigurator(empty_config())
+    deploy = configurator.ensure_pipeline_group('deploys').ensure_pipeline('deploy')
+    deploy.ensure_material(PipelineMaterial('build', 'build'))
+    deploy.ensure_stage('deploy').ensure_job('deploy_job').add_task(
+        FetchArtifactTask(fetch_pipeline, stage, job, artifact)
+    )
+    return configurator.config
+
+
+def _template_config(templates=True):
+    """
+    A pipeline built from a template, with a parameterised job name, and a pipeline that uses it.
+    """
+    template = """
+      <templates>
+        <pipeline name="build_template">
+          <stage name="build">
+            <jobs>
+              <job name="#{job}">
+                <tasks><exec command="make" /></tasks>
+                <artifacts><artifact src="target/ami.yml" /></artifacts>
+              </job>
+            </jobs>
+          </stage>
+        </pipeline>
+      </templates>"""
+    return """<cruise>
+      <pipelines group="builds">
+        <pipeline name="up" template="build_template">
+          <params><param name="job">build_job</param></params>
+          <materials><git url="https://github.com/edx/tubular.git" /></materials>
+        </pipeline>
+        <pipeline name="down">
+          <materials><pipeline pipelineName="up" stageName="build" /></materials>
+          <stage name="deploy">
+            <jobs>
+              <job name="deploy_job">
+                <tasks><fetchartifact pipeline="up" stage="build" job="build_job" srcfile="ami.yml" /></tasks>
+              </job>
+            </jobs>
+          </stage>
+        </pipeline>
+      </pipelines>{}
+    </cruise>""".format(template if templates else '')
+
+
+@ddt
+class TestSystemIndex(unittest.TestCase):
+
+    def test_references_across_configs(self):
+        index = SystemIndex.from_configs([('build.py', _build_config()), ('deploy.py', _deploy_config())])
+        self.assertEqual(index.errors(check_artifacts=True), [])
+
+    def test_missing_upstream(self):
+        index = SystemIndex.from_configs([_deploy_config()])
+        self.assertEqual(index.errors(), [
+            'pipeline deploy: material refers to missing stage build/build',
+            'pipeline deploy: fetch refers to missing job build/build/build_job',
+        ])
+
+    def test_duplicate_pipelines(self):
+        index = SystemIndex.from_configs([('build.py', _build_config()), ('other.py', _build_config())])
+        self.assertEqual(index.errors(), ['pipeline build is defined by both build.py and other.py'])
+
+    @data(
+        ({'stage': 'publish', 'job': 'publish_job'}, 'is from a stage after the material stage build'),
+        ({'fetch_pipeline': 'other'}, 'needs other to be a material of deploy'),
+        ({'fetch_pipeline': 'build/deploy'}, 'needs deploy to be a material of deploy'),
+        ({'artifact': FetchArtifactFile('missing.yml')}, 'missing artifact build/build/build_job/missing.yml'),
+    )
+    @unpack
+    def test_bad_fetch(self, fetch, message):
+        index = SystemIndex.from_configs([_build_config(), _deploy_config(**fetch)])
+        errors = index.errors(check_artifacts=True)
+        self.assertEqual(len(errors), 1)
+        self.assertIn(message, errors[0])
+
+    @data(FetchArtifactDir('output/logs'), FetchArtifactFile('output/logs/build.log'))
+    def test_fetch_from_artifact_destination(self, artifact):
+        index = SystemIndex.from_configs([_build_config(), _deploy_config(artifact=artifact)])
+        self.assertEqual(index.errors(check_artifacts=True), [])
+
+    def test_selected_pipelines(self):
+        index = SystemIndex.from_configs([_deploy_config()])
+        self.assertEqual(index.errors(pipelines={'build'}), [])
+
+    def test_template_pipelines(self):
+        index = SystemIndex.from_configs([_template_config()])
+        self.assertEqual(index.pipelines['up'].stages, {'build': 0})
+        self.assertEqual(index.errors(check_artifacts=True), [])
+
+    def test_template_in_other_config(self):
+        index = SystemIndex.from_configs([_template_config(templates=False), _template_config()])
+        self.assertEqual(index.pipelines['up'].stages, {'build': 0})
+
+    def test_unknown_template(self):
+        index = SystemIndex.from_configs([_template_config(templates=False)])
+        self.assertTrue(index.pipelines['up'].unresolved)
+        self.assertEqual(index.errors(check_artifacts=True), [])
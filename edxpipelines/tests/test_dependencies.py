@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from edxpipelines.dependencies import module_dependencies
+
+SOURCES = {
+    'pkg/__init__.py': '',
+    'pkg/script.py': 'import os\nfrom pkg import helpers\nfrom pkg.sub.deep import thing\n',
+    'pkg/helpers.py': 'import constants\n\ndef helper():\n    from .sub import lazy\n',
+    'pkg/constants.py': 'from pkg import script\n',
+    'pkg/unused.py': '',
+    'pkg/sub/__init__.py': '',
+    'pkg/sub/deep.py': 'from .. import constants\n',
+    'pkg/sub/lazy.py': 'import yaml\n',
+}
+
+
+class TestModuleDependencies(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for path, source in SOURCES.items():
+            full_path = os.path.join(self.root, path)
+            if not os.path.isdir(os.path.dirname(full_path)):
+                os.makedirs(os.path.dirname(full_path))
+            with open(full_path, 'w') as source_file:
+                source_file.write(source)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_dependencies(self):
+        self.assertEqual(
+            module_dependencies(os.path.join(self.root, 'pkg/script.py'), self.root),
+            sorted(
+                os.path.join(self.root, path)
+                for path in SOURCES if path != 'pkg/unused.py'
+            ),
+        )
+
+    def test_third_party_imports(self):
+        # Only the packages that the module is in are found, not the third-party one it imports.
+        self.assertEqual(
+            module_dependencies(os.path.join(self.root, 'pkg/sub/lazy.py'), self.root),
+            [os.path.join(self.root, path) for path in ('pkg/__init__.py', 'pkg/sub/__init__.py', 'pkg/sub/lazy.py')],
+        )
+
+    def test_modified_module(self):
+        path = os.path.join(self.root, 'pkg/sub/lazy.py')
+        module_dependencies(path, self.root)
+        with open(path, 'w') as source_file:
+            source_file.write('from pkg import unused\n')
+        # Make sure the change is visible, even on filesystems with coarse timestamps.
+        os.utime(path, (0, 0))
+        self.assertIn(os.path.join(self.root, 'pkg/unused.py'), module_dependencies(path, self.root))
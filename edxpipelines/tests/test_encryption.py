@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from ddt import ddt, data
+from gomatic import GoCdConfigurator, empty_config
+
+from edxpipelines import encryption
+
+
+def _configurator_with_variables(*variable_sets):
+    """
+    Build a configurator with one pipeline per dict of unencrypted secure variables.
+    """
+    configurator = GoCdConfigurator(empty_config())
+    group = configurator.ensure_pipeline_group('test_group')
+    for index, variables in enumerate(variable_sets):
+        pipeline = group.ensure_pipeline('pipeline_{}'.format(index))
+        pipeline.ensure_unencrypted_secure_environment_variables(variables)
+        pipeline.ensure_environment_variables({'PLAIN': 'not_a_secret'})
+    return configurator
+
+
+@ddt
+class TestEncryptSecureVariables(unittest.TestCase):
+
+    def setUp(self):
+        self.encrypter = encryption.LocalEncrypter()
+
+    def test_values_are_replaced(self):
+        configurator = _configurator_with_variables({'TOKEN': 'secret'})
+        count = encryption.encrypt_secure_variables(configurator, self.encrypter, encryption.EncryptionCache(), 'id')
+
+        pipeline = configurator.ensure_pipeline_group('test_group').find_pipeline('pipeline_0')
+        self.assertEqual(count, 1)
+        self.assertEqual(pipeline.unencrypted_secure_environment_variables, {})
+        self.assertEqual(pipeline.encrypted_environment_variables, {'TOKEN': self.encrypter.encrypt('secret')})
+        self.assertEqual(pipeline.environment_variables, {'PLAIN': 'not_a_secret'})
+
+    @data(1, 5, 20)
+    def test_each_secret_encrypted_once(self, pipeline_count):
+        configurator = _configurator_with_variables(*[{'TOKEN': 'secret', 'OTHER': 'other'}] * pipeline_count)
+        encryption.encrypt_secure_variables(configurator, self.encrypter, encryption.EncryptionCache(), 'id')
+        self.assertEqual(self.encrypter.calls, 2)
+
+    def test_encrypted_values_untouched(self):
+        configurator = GoCdConfigurator(empty_config())
+        pipeline = configurator.ensure_pipeline_group('test_group').ensure_pipeline('pipeline')
+        pipeline.ensure_encrypted_environment_variables({'TOKEN': 'already_encrypted'})
+        encryption.encrypt_secure_variables(configurator, self.encrypter, encryption.EncryptionCache(), 'id')
+        self.assertEqual(pipeline.encrypted_environment_variables, {'TOKEN': 'already_encrypted'})
+        self.assertEqual(self.encrypter.calls, 0)
+
+
+class TestEncryptionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'cache.json')
+        self.encrypter = encryption.LocalEncrypter()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_cache_persists_between_runs(self):
+        for _ in range(2):
+            encryption.encrypt_secure_variables(
+                _configurator_with_variables({'TOKEN': 'secret'}),
+                self.encrypter,
+                encryption.EncryptionCache(self.path, 'secret'),
+                'id',
+            )
+        self.assertEqual(self.encrypter.calls, 1)
+
+    def test_cache_is_keyed_by_cipher(self):
+        cache = encryption.EncryptionCache(self.path, 'secret')
+        encryption.encrypt_secure_variables(_configurator_with_variables({'TOKEN': 'secret'}), self.encrypter, cache, 'a')
+        encryption.encrypt_secure_variables(_configurator_with_variables({'TOKEN': 'secret'}), self.encrypter, cache, 'b')
+        self.assertEqual(self.encrypter.calls, 2)
+
+    def test_plaintext_not_stored(self):
+        encryption.encrypt_secure_variables(
+            _configurator_with_variables({'TOKEN': 'very_secret_value'}),
+            self.encrypter,
+            encryption.EncryptionCache(self.path, 'secret'),
+            'id',
+        )
+        with open(self.path) as cache_file:
+            self.assertNotIn('very_secret_value', cache_file.read())
+
+    def test_keys_need_the_secret(self):
+        encryption.encrypt_secure_variables(
+            _configurator_with_variables({'TOKEN': 'secret'}),
+            self.encrypter,
+            encryption.EncryptionCache(self.path, 'secret'),
+            'id',
+        )
+        with open(self.path) as cache_file:
+            keys = json.load(cache_file)['entries'].keys()
+        self.assertNotIn(hashlib.sha256(u'id\0secret').hexdigest(), keys)
+        self.assertEqual(encryption.EncryptionCache(self.path, 'other').get('id', 'secret'), None)
+        self.assertEqual(encryption.EncryptionCache(self.path, 'secret').get('id', 'secret'), self.encrypter.encrypt('secret'))
+
+    def test_no_secret_keeps_cache_in_memory(self):
+        encryption.encrypt_secure_variables(
+            _configurator_with_variables({'TOKEN': 'secret'}), self.encrypter, encryption.EncryptionCache(self.path), 'id',
+        )
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_unversioned_cache_ignored(self):
+        with open(self.path, 'w') as cache_file:
+            json.dump({hashlib.sha256(u'id\0secret').hexdigest(): 'stale'}, cache_file)
+        cache = encryption.EncryptionCache(self.path, 'secret')
+        self.assertEqual(cache.entries, {})
+        cache.save()
+        with open(self.path) as cache_file:
+            self.assertNotIn('stale', cache_file.read())
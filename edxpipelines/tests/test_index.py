@@ -0,0 +1,71 @@
+import unittest
+
+from gomatic import GitMaterial, GoCdConfigurator, PipelineMaterial, empty_config
+
+from edxpipelines.index import IndexedConfigurator
+
+
+def _build(configurator):
+    """
+    Exercise the ensure_* operations that the index replaces.
+    """
+    group = configurator.ensure_pipeline_group('group')
+    for name in ('first', 'second', 'first'):
+        pipeline = group.ensure_replacement_of_pipeline(name)
+        pipeline.ensure_material(GitMaterial('https://github.com/edx/tubular.git', ignore_patterns={'**/*'}))
+        pipeline.ensure_material(GitMaterial('https://github.com/edx/tubular.git', ignore_patterns={'**/*'}))
+        pipeline.ensure_material(PipelineMaterial('upstream', 'build'))
+        for stage_name in ('build', 'deploy', 'build'):
+            stage = pipeline.ensure_stage(stage_name)
+            stage.ensure_job('job')
+            stage.ensure_job('job')
+    configurator.ensure_pipeline_group('other').ensure_pipeline('third').ensure_stage('only')
+    configurator.ensure_pipeline_group('group').ensure_removal_of_pipeline('second')
+    configurator.ensure_removal_of_pipeline_group('other')
+    configurator.ensure_pipeline_group('other').ensure_pipeline('fourth')
+    return configurator.config
+
+
+class TestIndexedConfigurator(unittest.TestCase):
+
+    def setUp(self):
+        self.configurator = IndexedConfigurator(GoCdConfigurator(empty_config()))
+
+    def test_same_config_as_gomatic(self):
+        self.assertEqual(_build(self.configurator), _build(GoCdConfigurator(empty_config())))
+
+    def test_lookups_return_existing_elements(self):
+        group = self.configurator.ensure_pipeline_group('group')
+        pipeline = group.ensure_pipeline('pipeline')
+        stage = pipeline.ensure_stage('stage')
+        job = stage.ensure_job('job')
+
+        self.assertIs(self.configurator.ensure_pipeline_group('group').element, group.element)
+        self.assertIs(group.ensure_pipeline('pipeline').element, pipeline.element)
+        self.assertIs(group.find_pipeline('pipeline').element, pipeline.element)
+        self.assertIs(pipeline.ensure_stage('stage').element, stage.element)
+        self.assertIs(stage.ensure_job('job').element, job.element)
+
+    def test_replacement_empties_pipeline(self):
+        group = self.configurator.ensure_pipeline_group('group')
+        group.ensure_pipeline('pipeline').ensure_stage('stage')
+        pipeline = group.ensure_replacement_of_pipeline('pipeline')
+        self.assertEqual(pipeline.stages, [])
+        pipeline.ensure_stage('stage')
+        self.assertEqual(len(pipeline.stages), 1)
+
+    def test_removal(self):
+        group = self.configurator.ensure_pipeline_group('group')
+        group.ensure_pipeline('pipeline')
+        group.ensure_removal_of_pipeline('pipeline')
+        self.assertFalse(group.has_pipeline('pipeline'))
+        with self.assertRaises(RuntimeError):
+            group.find_pipeline('pipeline')
+
+    def test_changed_pipelines(self):
+        self.configurator.ensure_pipeline_group('group').ensure_removal_of_pipeline('removed')
+        _build(self.configurator)
+        self.assertEqual(
+            list(self.configurator.changed_pipelines.items()),
+            [('removed', 'group'), ('first', 'group'), ('second', 'group'), ('third', 'other'), ('fourth', 'other')],
+        )
@@ -0,0 +1,39 @@
+import unittest
+
+from gomatic import GoCdConfigurator
+from gomatic.fake import FakeHostRestClient, empty_config_xml
+
+from edxpipelines import constants
+from edxpipelines.job_classes import JobClass, configure_job_classes, set_job_class
+
+
+class TestJobClasses(unittest.TestCase):
+
+    def setUp(self):
+        configurator = GoCdConfigurator(FakeHostRestClient(empty_config_xml))
+        stage = configurator.ensure_pipeline_group('group').ensure_replacement_of_pipeline('app').ensure_stage('play')
+        self.job = stage.ensure_job('play_job')
+        self.addCleanup(configure_job_classes)
+
+    def test_unconfigured(self):
+        set_job_class(self.job, JobClass.ANSIBLE_HEAVY)
+        self.assertEqual(self.job.environment_variables, {constants.JOB_CLASS_VARIABLE: 'ansible-heavy'})
+        self.assertEqual(self.job.resources, set())
+        self.assertFalse(self.job.has_elastic_profile_id)
+
+    def test_resources(self):
+        configure_job_classes({'ansible-heavy': {'resources': ['ansible', 'docker']}, 'light': {'resources': ['light']}})
+        set_job_class(self.job, JobClass.ANSIBLE_HEAVY)
+        self.assertEqual(self.job.resources, {'ansible', 'docker'})
+
+    def test_elastic_profile(self):
+        configure_job_classes({'long-wait': {'elastic_profile_id': 'waiting'}})
+        set_job_class(self.job, JobClass.LONG_WAIT)
+        self.assertEqual(self.job.elastic_profile_id, 'waiting')
+        self.assertEqual(self.job.resources, set())
+
+    def test_invalid(self):
+        with self.assertRaisesRegexp(ValueError, 'job classes must be some of'):
+            configure_job_classes({'heavy': {'resources': ['ansible']}})
+        with self.assertRaisesRegexp(ValueError, 'either resources or an elastic_profile_id'):
+            configure_job_classes({'light': {'resources': ['light'], 'elastic_profile_id': 'light'}})
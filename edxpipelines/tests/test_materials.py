@@ -0,0 +1,32 @@
+import unittest
+
+from edxpipelines import materials
+
+
+class TestMaterials(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(materials.configure)
+
+    def test_defaults(self):
+        tubular = materials.TUBULAR()
+        self.assertTrue(tubular.polling)
+        self.assertFalse(tubular.shallow)
+        self.assertTrue(materials.EDX_PLATFORM().shallow)
+
+    def test_configure(self):
+        materials.configure(polling='webhook', shallow=True, materials={'edx-platform': {'polling': 'poll'}})
+        tubular = materials.TUBULAR()
+        self.assertFalse(tubular.polling)
+        self.assertTrue(tubular.shallow)
+        self.assertTrue(materials.EDX_PLATFORM().polling)
+
+    def test_overrides(self):
+        materials.configure(materials={'edx-platform': {'shallow': False}})
+        self.assertFalse(materials.EDX_PLATFORM().shallow)
+        self.assertTrue(materials.EDX_PLATFORM(shallow=True).shallow)
+        self.assertEqual(materials.EDX_PLATFORM(branch='master').branch, 'master')
+
+    def test_unknown_polling(self):
+        with self.assertRaisesRegexp(ValueError, 'material polling must be one of'):
+            materials.configure(materials={'tubular': {'polling': 'hourly'}})
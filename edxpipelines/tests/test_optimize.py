@@ -0,0 +1,166 @@
+import unittest
+from xml.etree import ElementTree
+
+from gomatic import (
+    BuildArtifact, ExecTask, FetchArtifactDir, FetchArtifactFile, FetchArtifactTask, GoCdConfigurator,
+    PipelineMaterial,
+)
+from gomatic.fake import FakeHostRestClient, empty_config_xml
+
+from edxpipelines import virtualenvs
+from edxpipelines.index import IndexedConfigurator
+from edxpipelines.optimize import fuse_stages, optimize_pipelines
+from edxpipelines.patterns import tasks
+
+
+def _shell(command, runif='passed'):
+    return ExecTask(['/bin/bash', '-c', command], runif=runif)
+
+
+class TestStageFusion(unittest.TestCase):
+
+    def setUp(self):
+        self.configurator = IndexedConfigurator(GoCdConfigurator(FakeHostRestClient(empty_config_xml)))
+        self.group = self.configurator.ensure_pipeline_group('group')
+        self.pipeline = self.group.ensure_pipeline('app').enable_stage_fusion()
+
+        launch = self.pipeline.ensure_stage('launch').ensure_job('launch_job')
+        launch.add_task(_shell('launch'))
+        launch.ensure_artifacts({BuildArtifact('target/key.pem'), BuildArtifact('target/logs', 'launch')})
+
+        play = self.pipeline.ensure_stage('play').ensure_job('play_job')
+        play.add_task(FetchArtifactTask('', 'launch', 'launch_job', FetchArtifactFile('key.pem'), dest='target'))
+        play.add_task(FetchArtifactTask('', 'launch', 'launch_job', FetchArtifactDir('launch/logs'), dest='old'))
+        play.add_task(_shell('play'))
+        play.ensure_artifacts({BuildArtifact('target/ami.yml')})
+
+        deploy = self.pipeline.ensure_stage('deploy').ensure_job('deploy_job')
+        deploy.add_task(FetchArtifactTask('', 'play', 'play_job', FetchArtifactFile('ami.yml'), dest='target'))
+        deploy.add_task(_shell('deploy'))
+
+    def _stages(self):
+        return [
+            (stage.name, [job.name for job in stage.jobs])
+            for stage in self.configurator.ensure_pipeline_group('group').find_pipeline('app').stages
+        ]
+
+    def _commands(self, stage_name):
+        tasks = self.pipeline.ensure_stage(stage_name).jobs[0].element.find('tasks')
+        return [
+            task.findall('arg')[-1].text if task.tag == 'exec' else 'fetch ' + (task.get('srcfile') or task.get('srcdir'))
+            for task in tasks
+        ]
+
+    def test_fuse(self):
+        self.assertEqual(optimize_pipelines(self.configurator), {'app': [['launch', 'play', 'deploy']]})
+        self.assertEqual(self._stages(), [('launch', ['launch_job'])])
+        self.assertEqual(self._commands('launch'), [
+            'launch', 'mkdir -p old && cp -r target/logs old/logs', 'play', 'deploy',
+        ])
+        self.assertEqual(
+            {artifact.get('src') for artifact in self.pipeline.ensure_stage('launch').jobs[0].element.iter('artifact')},
+            {'target/key.pem', 'target/logs', 'target/ami.yml'},
+        )
+
+    def test_single_virtualenv(self):
+        for stage_name, working_dirs in (('launch', ['tubular']), ('play', ['configuration', 'tubular'])):
+            job = self.pipeline.ensure_stage(stage_name).jobs[0]
+            job.ensure_environment_variables({'BASH_ENV': 'activate.sh'})
+            job.add_task(_shell(virtualenvs.install_command(working_dirs)))
+
+        self.assertEqual(optimize_pipelines(self.configurator), {'app': [['launch', 'play']]})
+        job = self.pipeline.ensure_stage('launch').jobs[0].element
+        installs = [virtualenvs.installed_dirs(task) for task in job.find('tasks')]
+        self.assertEqual([dirs for dirs in installs if dirs is not None], [['tubular', 'configuration']])
+
+    def test_not_enabled(self):
+        self.pipeline.make_empty()
+        self.assertEqual(optimize_pipelines(self.configurator), {})
+
+    def test_manual_approval(self):
+        self.pipeline.ensure_stage('play').set_has_manual_approval()
+        self.assertEqual(optimize_pipelines(self.configurator), {'app': [['play', 'deploy']]})
+        self.assertEqual(self._stages(), [('launch', ['launch_job']), ('play', ['play_job'])])
+
+    def test_incomplete_config(self):
+        self.assertEqual(optimize_pipelines(self.configurator, complete=False), {})
+        self.assertEqual(len(self._stages()), 3)
+
+    def test_fan_out(self):
+        self.pipeline.ensure_stage('play').ensure_job('other_job').add_task(_shell('other'))
+        self.assertEqual(optimize_pipelines(self.configurator), {})
+
+    def test_cross_pipeline_material(self):
+        downstream = self.group.ensure_pipeline('downstream')
+        downstream.ensure_material(PipelineMaterial('app', 'play'))
+        self.assertEqual(optimize_pipelines(self.configurator), {})
+
+    def test_cross_pipeline_fetch(self):
+        downstream = self.group.ensure_pipeline('downstream')
+        downstream.ensure_stage('use').ensure_job('use_job').add_task(
+            FetchArtifactTask('app', 'launch', 'launch_job', FetchArtifactFile('key.pem'))
+        )
+        self.assertEqual(optimize_pipelines(self.configurator), {'app': [['play', 'deploy']]})
+        # Later stages fetch from the fused job.
+        self.assertEqual(self._commands('play'), ['fetch key.pem', 'fetch launch/logs', 'play', 'deploy'])
+
+    def test_template_fetch(self):
+        template = self.configurator.ensure_template('deploy_template')
+        template.ensure_stage('use').ensure_job('use_job').add_task(
+            FetchArtifactTask('app', 'play', 'play_job', FetchArtifactFile('ami.yml'))
+        )
+        downstream = self.group.ensure_pipeline('downstream').set_template_name('deploy_template')
+        downstream.ensure_material(PipelineMaterial('app', 'deploy'))
+        # The play stage is fetched from, so it can't be fused into launch.
+        self.assertEqual(optimize_pipelines(self.configurator), {})
+
+    def test_unknown_template(self):
+        downstream = self.group.ensure_pipeline('downstream').set_template_name('missing_template')
+        downstream.ensure_material(PipelineMaterial('app', 'deploy'))
+        self.assertEqual(optimize_pipelines(self.configurator), {})
+
+    def test_runs_after_failure(self):
+        self.pipeline.ensure_stage('deploy').jobs[0].add_task(_shell('cleanup', runif='any'))
+        self.assertEqual(optimize_pipelines(self.configurator), {'app': [['launch', 'play']]})
+        fetch = self.pipeline.ensure_stage('deploy').jobs[0].tasks[0]
+        self.assertEqual((fetch.stage, fetch.job), ('launch', 'launch_job'))
+
+    def test_shared_artifact(self):
+        migrate = self.group.ensure_pipeline('migrate').enable_stage_fusion()
+        for sub_application_name in ('cms', 'lms'):
+            job = migrate.ensure_stage('apply_migrations_' + sub_application_name).ensure_job('apply_migrations_job')
+            tasks.generate_run_migrations(job, sub_application_name)
+        # Both jobs write their results to target/migrations, so the fused job would only publish the lms results.
+        self.assertEqual(fuse_stages(migrate.element), [])
+
+    def _add_playbooks(self, output_names):
+        for stage_name, output_name in zip(('launch', 'play'), output_names):
+            job = self.pipeline.ensure_stage(stage_name).jobs[0]
+            job.add_task(_shell(tasks.ansible_playbook_command(job, output_name, 'playbook.yml')))
+
+    def test_ansible_output(self):
+        # The jobs share the ansible output directory, but write different files to it.
+        self._add_playbooks(['launch_instance', 'run_play'])
+        self.assertEqual(optimize_pipelines(self.configurator), {'app': [['launch', 'play', 'deploy']]})
+
+    def test_same_ansible_output(self):
+        self._add_playbooks(['run_play', 'run_play'])
+        self.assertEqual(optimize_pipelines(self.configurator), {'app': [['play', 'deploy']]})
+
+    def test_conflicting_variables(self):
+        self.pipeline.ensure_stage('launch').jobs[0].ensure_environment_variables({'PLAY': 'edxapp'})
+        self.pipeline.ensure_stage('play').jobs[0].ensure_environment_variables({'PLAY': 'ecommerce'})
+        self.pipeline.ensure_stage('deploy').jobs[0].ensure_environment_variables({'PLAY': 'ecommerce'})
+        self.assertEqual(optimize_pipelines(self.configurator), {'app': [['play', 'deploy']]})
+
+    def test_stage_variable(self):
+        # The launch job would see the variable, instead of the pipeline's value, if it were fused.
+        self.pipeline.ensure_environment_variables({'PLAY': 'edxapp'})
+        self.pipeline.ensure_stage('play').ensure_environment_variables({'PLAY': 'ecommerce'})
+        self.assertEqual(optimize_pipelines(self.configurator), {})
+
+    def test_unpublished_fetch(self):
+        tasks = self.pipeline.ensure_stage('play').jobs[0].element.find('tasks')
+        # Added directly, since the artifact registry would refuse it.
+        ElementTree.SubElement(tasks, 'fetchartifact', stage='launch', job='launch_job', srcfile='missing.yml')
+        self.assertEqual(fuse_stages(self.pipeline.element), [['play', 'deploy']])
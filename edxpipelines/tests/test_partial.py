@@ -0,0 +1,96 @@
+import unittest
+from xml.etree import ElementTree
+
+from gomatic import ExecTask, GoCdConfigurator, PipelineMaterial
+from gomatic.fake import FakeHostRestClient, empty_config_xml
+
+from edxpipelines.index import IndexedConfigurator
+from edxpipelines.partial import PartialGenerationError, select_pipelines, upstream_closure
+
+
+def _install(configurator, version):
+    """
+    Replace the edxapp group with a chain of build -> deploy -> rollback pipelines.
+    """
+    configurator.ensure_removal_of_pipeline_group('edxapp')
+    group = configurator.ensure_pipeline_group('edxapp')
+    group.ensure_authorization().ensure_view().add_role('{}-viewers'.format(version))
+    upstream = None
+    for name in ('build', 'deploy', 'rollback'):
+        pipeline = group.ensure_replacement_of_pipeline(name)
+        if upstream:
+            pipeline.ensure_material(PipelineMaterial(upstream, 'run'))
+        pipeline.ensure_stage('run').ensure_job('run').add_task(ExecTask(['echo', version]))
+        upstream = name
+
+
+def _server(*pipelines):
+    """
+    The config xml of a server that has version 1 of ``pipelines`` (and nothing else).
+    """
+    configurator = GoCdConfigurator(FakeHostRestClient(empty_config_xml))
+    _install(configurator, 'v1')
+    group = configurator.ensure_pipeline_group('edxapp')
+    for name in ('build', 'deploy', 'rollback'):
+        if name not in pipelines:
+            group.ensure_removal_of_pipeline(name)
+    return configurator.config
+
+
+def _versions(configurator):
+    """
+    Pipeline name -> the version its job echoes, and the roles that can view the edxapp group.
+    """
+    root = ElementTree.fromstring(configurator.config)
+    versions = {
+        pipeline.get('name'): pipeline.find('stage/jobs/job/tasks/exec/arg').text
+        for pipeline in root.findall('pipelines/pipeline')
+    }
+    return versions, [role.text for role in root.findall('pipelines/authorization/view/role')]
+
+
+class TestPartial(unittest.TestCase):
+
+    def _run(self, server):
+        configurator = IndexedConfigurator(GoCdConfigurator(FakeHostRestClient(server)))
+        initial = configurator.config
+        _install(configurator, 'v2')
+        return configurator, initial
+
+    def test_upstream_closure(self):
+        configurator, _ = self._run(_server())
+        self.assertEqual(upstream_closure(configurator, ['rollback']), {'build', 'deploy'})
+        self.assertEqual(upstream_closure(configurator, ['deploy', 'build']), set())
+
+    def test_only_selected_pipeline_changes(self):
+        configurator, initial = self._run(_server('build', 'deploy', 'rollback'))
+        self.assertEqual(select_pipelines(configurator, initial, ['rollback']), {'build', 'deploy'})
+        self.assertEqual(
+            _versions(configurator),
+            ({'build': 'v1', 'deploy': 'v1', 'rollback': 'v2'}, ['v1-viewers']),
+        )
+
+    def test_unselected_new_pipelines_are_dropped(self):
+        configurator, initial = self._run(_server('build'))
+        select_pipelines(configurator, initial, ['build'])
+        self.assertEqual(_versions(configurator), ({'build': 'v2'}, ['v1-viewers']))
+
+    def test_new_group_is_dropped(self):
+        configurator, initial = self._run(_server('build'))
+        configurator.ensure_pipeline_group('other').ensure_replacement_of_pipeline('other')
+        select_pipelines(configurator, initial, ['deploy'])
+        self.assertEqual([group.name for group in configurator.pipeline_groups], ['edxapp'])
+
+    def test_missing_upstream(self):
+        configurator, initial = self._run(_server('build'))
+        with self.assertRaisesRegexp(PartialGenerationError, 'needs deploy, which is not on the server'):
+            select_pipelines(configurator, initial, ['rollback'])
+        select_pipelines(configurator, initial, ['rollback', 'deploy'])
+        self.assertEqual(
+            _versions(configurator)[0], {'build': 'v1', 'deploy': 'v2', 'rollback': 'v2'},
+        )
+
+    def test_unknown_pipeline(self):
+        configurator, initial = self._run(_server())
+        with self.assertRaisesRegexp(PartialGenerationError, 'does not generate missing'):
+            select_pipelines(configurator, initial, ['missing'])
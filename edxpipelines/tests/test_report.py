@@ -0,0 +1,125 @@
+from StringIO import StringIO
+import unittest
+
+import lxml.etree as ElementTree
+
+from edxpipelines import report
+
+CONFIG = """
+<cruise>
+  <pipelines group="group">
+    <pipeline name="small">
+      <stage name="only">
+        <jobs><job name="only_job"><tasks>
+          <exec command="/bin/bash"><arg>-c</arg><arg>make</arg></exec>
+        </tasks></job></jobs>
+      </stage>
+    </pipeline>
+    <pipeline name="large">
+      <environmentvariables>
+        <variable name="A"><value>shared</value></variable>
+        <variable name="B"><value>unique</value></variable>
+      </environmentvariables>
+      <stage name="first">
+        <jobs><job name="first_job"><tasks>
+          <exec command="/bin/bash"><arg>-c</arg><arg>make</arg></exec>
+          <fetchartifact pipeline="small" stage="only" job="only_job" srcfile="file"/>
+        </tasks></job></jobs>
+      </stage>
+      <stage name="second">
+        <environmentvariables><variable name="C"><value>shared</value></variable></environmentvariables>
+        <jobs><job name="second_job"><tasks/></job></jobs>
+      </stage>
+    </pipeline>
+  </pipelines>
+</cruise>
+"""
+
+
+class TestSizeReport(unittest.TestCase):
+
+    def setUp(self):
+        self.config = ElementTree.parse(StringIO(CONFIG), parser=report.PARSER)
+
+    def test_counts(self):
+        group, = report.size_report(self.config, depth='task')
+        large, small = group['children']
+
+        self.assertEqual((group['tasks'], group['env_vars']), (3, 3))
+        self.assertEqual(large['name'], 'large')
+        self.assertEqual((large['tasks'], large['env_vars'], large['duplicated_strings']), (2, 3, 4))
+        self.assertEqual((small['tasks'], small['env_vars'], small['duplicated_strings']), (1, 0, 2))
+        self.assertGreater(large['bytes'], small['bytes'])
+        self.assertEqual(
+            [task['name'] for task in large['children'][0]['children'][0]['children']],
+            ['0: exec /bin/bash make', '1: fetchartifact small/only/only_job/file'],
+        )
+
+    def test_depth(self):
+        group, = report.size_report(self.config, depth='pipeline')
+        self.assertTrue(all('children' not in pipeline for pipeline in group['children']))
+
+
+MATERIALS_CONFIG = """
+<cruise>
+  <pipelines group="group">
+    <pipeline name="build">
+      <materials>
+        <git url="https://github.com/edx/tubular" />
+        <git url="https://github.com/edx/edx-platform" branch="release" shallowClone="true" />
+      </materials>
+    </pipeline>
+    <pipeline name="deploy">
+      <materials>
+        <git url="https://github.com/edx/tubular" branch="master" autoUpdate="false" />
+        <git url="https://github.com/edx/edx-platform" branch="release" shallowClone="true" />
+        <pipeline pipelineName="build" stageName="build" />
+      </materials>
+    </pipeline>
+  </pipelines>
+</cruise>
+"""
+
+
+class TestPollingReport(unittest.TestCase):
+
+    def test_counts(self):
+        polling = report.polling_report(ElementTree.parse(StringIO(MATERIALS_CONFIG), parser=report.PARSER))
+        self.assertEqual(polling['repos'], [
+            {'url': 'https://github.com/edx/edx-platform', 'branch': 'release', 'pipelines': 2, 'poll': 2, 'shallow': 2},
+            {'url': 'https://github.com/edx/tubular', 'branch': 'master', 'pipelines': 2, 'poll': 1, 'shallow': 0},
+        ])
+        self.assertEqual(
+            polling['totals'], {'pipelines': 4, 'poll': 3, 'shallow': 2, 'repos': 2, 'polled_repos': 2}
+        )
+
+
+JOB_CLASSES_CONFIG = """
+<cruise>
+  <pipelines group="group">
+    <pipeline name="build">
+      <materials><pipeline pipelineName="upstream" stageName="build" /></materials>
+      <stage name="build">
+        <jobs>
+          <job name="play_job">
+            <environmentvariables><variable name="EDX_JOB_CLASS"><value>ansible-heavy</value></variable></environmentvariables>
+          </job>
+          <job name="armed_job">
+            <environmentvariables><variable name="EDX_JOB_CLASS"><value>light</value></variable></environmentvariables>
+          </job>
+          <job name="other_job" />
+        </jobs>
+      </stage>
+    </pipeline>
+  </pipelines>
+</cruise>
+"""
+
+
+class TestJobClassReport(unittest.TestCase):
+
+    def test_counts(self):
+        classes = report.job_class_report(ElementTree.parse(StringIO(JOB_CLASSES_CONFIG), parser=report.PARSER))
+        expected = {'ansible-heavy': 1, 'light': 1, 'long-wait': 0, 'secrets': 0, 'unclassified': 1}
+        self.assertEqual(classes['pipelines'], [{'name': 'build', 'jobs': expected}])
+        self.assertEqual(classes['totals'], expected)
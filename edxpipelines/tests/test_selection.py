@@ -0,0 +1,72 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from ddt import ddt, data, unpack
+
+from edxpipelines import selection
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+EDXAPP = {'script': 'edxpipelines/pipelines/cd_edxapp_latest.py', 'variable_file': [
+    'edxpipelines/pipelines/config/edxapp.yml', '../gomatic-secure/gocd/vars/tools/edxapp.yml',
+]}
+API = {'script': 'edxpipelines/pipelines/api_build.py', 'env-variable-file': [
+    ['stage', '../gomatic-secure/gocd/vars/tools/api.yml'],
+]}
+MARKETING = {'script': 'edxpipelines/pipelines/deploy_marketing_site.py'}
+SCRIPTS = [EDXAPP, API, MARKETING]
+
+
+@ddt
+class TestAffectedScripts(unittest.TestCase):
+
+    @data(
+        (['edxpipelines/patterns/edxapp.py'], [EDXAPP]),
+        (['edxpipelines/pipelines/config/edxapp.yml'], [EDXAPP]),
+        (['../gomatic-secure/gocd/vars/tools/api.yml'], [API]),
+        (['edxpipelines/patterns/tasks.py'], [EDXAPP, MARKETING]),
+        (['edxpipelines/utils.py'], SCRIPTS),
+        (['README.md', 'edxpipelines/tests/test_utils.py'], []),
+        (['test-config.yml'], SCRIPTS),
+        (['edxpipelines/tests/scripts/conftest.py'], SCRIPTS),
+        (['edxpipelines/schema/pipelines.xsd'], SCRIPTS),
+    )
+    @unpack
+    def test_affected(self, changed, affected):
+        self.assertEqual(selection.affected_scripts(SCRIPTS, set(changed), ROOT), affected)
+
+    def test_harness_changed(self):
+        harness = [os.path.join(ROOT, 'edxpipelines/validation.py')]
+        self.assertEqual(
+            selection.affected_scripts(SCRIPTS, {'edxpipelines/canonicalize.py'}, ROOT, harness),
+            SCRIPTS,
+        )
+
+
+class TestChangedFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self._git('init', '-q')
+        for name in ('committed.py', 'modified.py'):
+            self._write(name)
+        self._git('add', '.')
+        self._git('-c', 'user.name=test', '-c', 'user.email=test@example.com', 'commit', '-q', '-m', 'initial')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _git(self, *args):
+        subprocess.check_call(('git',) + args, cwd=self.root)
+
+    def _write(self, name, content='pass\n'):
+        with open(os.path.join(self.root, name), 'w') as source:
+            source.write(content)
+
+    def test_changed_files(self):
+        self._write('modified.py', 'import os\n')
+        self._write('untracked.py')
+        self.assertEqual(selection.changed_files('HEAD', self.root), {'modified.py', 'untracked.py'})
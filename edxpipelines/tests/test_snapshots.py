@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ddt import ddt, data, unpack
+import lxml.etree as ElementTree
+
+from edxpipelines import snapshots
+
+CONFIG = """
+<cruise>
+  <pipelines group="group">
+    <pipeline name="build">
+      <materials><git url="https://github.com/edx/tubular.git"/></materials>
+      <stage name="build">
+        <jobs>
+          <job name="build_job"><tasks><exec command="make"><arg>build</arg></exec></tasks></job>
+          <job name="test_job"><tasks><exec command="make"><arg>test</arg></exec></tasks></job>
+        </jobs>
+      </stage>
+    </pipeline>
+    <pipeline name="deploy">
+      <stage name="deploy"><jobs><job name="deploy_job"/></jobs></stage>
+    </pipeline>
+  </pipelines>
+</cruise>
+"""
+
+
+def _snapshot(config):
+    return snapshots.config_snapshot(ElementTree.fromstring(config))
+
+
+@ddt
+class TestSnapshots(unittest.TestCase):
+
+    def test_snapshot_paths(self):
+        self.assertEqual(sorted(_snapshot(CONFIG)['build']), [
+            'materials', 'pipeline', 'stage build', 'stage build/job build_job', 'stage build/job test_job',
+        ])
+
+    def test_unchanged(self):
+        reformatted = ElementTree.tostring(ElementTree.fromstring(CONFIG), pretty_print=True)
+        self.assertEqual(snapshots.diff_snapshots(_snapshot(CONFIG), _snapshot(reformatted)), {})
+
+    @data(
+        ('<arg>test</arg>', '<arg>test-all</arg>', ['changed stage build/job test_job']),
+        ('<stage name="build">', '<stage name="build" fetchMaterials="false">', ['changed stage build']),
+        ('<job name="test_job">', '<job name="unit_job">', [
+            'removed stage build/job test_job', 'added stage build/job unit_job',
+        ]),
+        ('<pipeline name="build">', '<pipeline name="build" isLocked="true">', [
+            'changed pipeline settings or group',
+        ]),
+    )
+    @unpack
+    def test_changed(self, old, new, changes):
+        differences = snapshots.diff_snapshots(_snapshot(CONFIG), _snapshot(CONFIG.replace(old, new)))
+        self.assertEqual(differences, {'build': changes})
+
+    def test_moved_group(self):
+        moved = CONFIG.replace('</pipeline>\n    <pipeline name="deploy">', '</pipeline>\n  </pipelines>\n'
+                               '  <pipelines group="other">\n    <pipeline name="deploy">')
+        differences = snapshots.diff_snapshots(_snapshot(CONFIG), _snapshot(moved))
+        self.assertEqual(differences, {'deploy': ['changed pipeline settings or group']})
+
+    def test_added_and_removed_pipelines(self):
+        renamed = CONFIG.replace('<pipeline name="deploy">', '<pipeline name="release">')
+        differences = snapshots.diff_snapshots(_snapshot(CONFIG), _snapshot(renamed))
+        self.assertEqual(differences, {'deploy': ['pipeline removed'], 'release': ['pipeline added']})
+
+    def test_save_and_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'snapshots.yml')
+            self.assertEqual(snapshots.load_snapshots(path), {})
+            snapshots.save_snapshots(path, {'script.py': _snapshot(CONFIG)})
+            self.assertEqual(snapshots.load_snapshots(path), {'script.py': _snapshot(CONFIG)})
+        finally:
+            shutil.rmtree(directory)
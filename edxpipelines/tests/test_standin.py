@@ -0,0 +1,94 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from click.testing import CliRunner
+from gomatic import GoCdConfigurator, HostRestClient
+import requests
+import yaml
+
+from edxpipelines import standin
+from edxpipelines.encryption import ENCRYPT_PATH
+
+
+class TestStandin(unittest.TestCase):
+
+    def setUp(self):
+        self.state = standin.StandinState()
+        self.server = standin.StandinServer(self.state).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _url(self, path):
+        return self.server.url + path
+
+    def test_config_round_trip(self):
+        configurator = GoCdConfigurator(HostRestClient(self.server.url[len('http://'):]))
+        configurator.ensure_pipeline_group('group').ensure_pipeline('pipeline')
+        configurator.save_updated_config()
+
+        self.assertIn('<pipeline name="pipeline"', self.state.config)
+        stats = requests.get(self._url(standin.STATS_PATH)).json()
+        self.assertEqual(stats[standin.CONFIG_POST_PATH]['status_200'], 1)
+        self.assertEqual(stats[standin.CONFIG_POST_PATH]['bytes_in'] > len(self.state.config), True)
+
+    def test_stale_md5(self):
+        response = requests.get(self._url(standin.CONFIG_GET_PATH))
+        md5 = response.headers['X-CRUISE-CONFIG-MD5']
+        self.state.set_config(response.text.replace('artifacts', 'other_artifacts'))
+
+        response = requests.post(self._url(standin.CONFIG_POST_PATH), {'xmlFile': '<cruise/>', 'md5': md5})
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('other_artifacts', self.state.config)
+
+    def test_encrypt(self):
+        response = requests.post(self._url(ENCRYPT_PATH), json.dumps({'value': 'secret'}))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('secret', response.json()['encrypted_value'])
+
+    def test_injected_failures(self):
+        self.state.failure_rate = 1
+        response = requests.get(self._url(standin.VERSION_PATH))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.state.summary()[standin.VERSION_PATH]['injected_failures'], 1)
+
+
+class TestStandinRun(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_run_script(self):
+        variable_file = os.path.join(self.tempdir, 'variables.yml')
+        with open(variable_file, 'w') as variables:
+            yaml.safe_dump({
+                'gocd_url': 'gocd.example.com', 'gocd_username': 'user', 'gocd_password': 'password',
+                'pipeline_group': 'janitors', 'pipeline_name': 'asg_cleanup', 'cron_timer': '0 0 * * * ?',
+                'asgard_api_endpoints': 'asgard', 'asgard_token': 'token',
+                'aws_access_key_id': 'key', 'aws_secret_access_key': 'secret',
+            }, variables)
+        final_config = os.path.join(self.tempdir, 'config.xml')
+        stats_file = os.path.join(self.tempdir, 'stats.json')
+
+        result = CliRunner().invoke(
+            standin.cli,
+            [
+                'run', '--final-config', final_config, '--stats-file', stats_file, '--',
+                sys.executable, 'edxpipelines/pipelines/asg_cleanup.py', '--variable_file', variable_file,
+                '--encryption-cache', os.path.join(self.tempdir, 'cache.json'),
+            ],
+        )
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        with open(final_config) as config:
+            self.assertIn('<pipeline name="asg_cleanup"', config.read())
+        with open(stats_file) as stats:
+            self.assertEqual(json.load(stats)['endpoints'][standin.CONFIG_POST_PATH]['status_200'], 1)
@@ -0,0 +1,347 @@
+import os
+import shutil
+import stat
+import subprocess
+import tempfile
+import unittest
+
+from gomatic import BuildArtifact, ExecTask, FetchArtifactTask, GoCdConfigurator
+from gomatic.fake import FakeHostRestClient, empty_config_xml
+
+from edxpipelines import constants
+from edxpipelines import utils
+from edxpipelines import virtualenvs
+from edxpipelines.patterns import stages
+from edxpipelines.patterns import tasks
+
+
+def _run(task, root, env=None):
+    """
+    Run an ExecTask the way a GoCD agent would, from the ``root`` working directory.
+
+    Returns:
+        str: the output of the task
+    """
+    return subprocess.check_output(
+        list(task.command_and_args), cwd=os.path.join(root, task.working_dir or ''), env=env
+    )
+
+
+class TestInstanceAccess(unittest.TestCase):
+
+    def setUp(self):
+        configurator = GoCdConfigurator(FakeHostRestClient(empty_config_xml))
+        pipeline = configurator.ensure_pipeline_group('group').ensure_replacement_of_pipeline('app')
+        self.launch_job = pipeline.ensure_stage(constants.LAUNCH_INSTANCE_STAGE_NAME).ensure_job(
+            constants.LAUNCH_INSTANCE_JOB_NAME
+        )
+        self.job = pipeline.ensure_stage('use').ensure_job('use_job')
+        self.location = utils.ArtifactLocation(
+            'app', constants.LAUNCH_INSTANCE_STAGE_NAME, constants.LAUNCH_INSTANCE_JOB_NAME,
+            constants.INSTANCE_ACCESS_FILENAME,
+        )
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def _launch(self):
+        """
+        Write the files the launch playbook would, and run the task that bundles them.
+        """
+        tasks.generate_launch_instance(self.launch_job)
+        target = os.path.join(self.root, constants.ARTIFACT_PATH)
+        os.mkdir(target)
+        for name in constants.INSTANCE_ACCESS_FILES:
+            with open(os.path.join(target, name), 'w') as output:
+                output.write(name)
+        _run(self.launch_job.tasks[-1], self.root)
+        for name in constants.INSTANCE_ACCESS_FILES:
+            os.remove(os.path.join(target, name))
+
+    def test_bundle_is_published(self):
+        tasks.generate_launch_instance(self.launch_job)
+        self.assertIn(
+            BuildArtifact('{}/{}'.format(constants.ARTIFACT_PATH, constants.INSTANCE_ACCESS_FILENAME)),
+            self.launch_job.artifacts,
+        )
+
+    def test_single_fetch(self):
+        tasks.generate_fetch_instance_access(self.job, self.location)
+        fetches = [task for task in self.job.tasks if isinstance(task, FetchArtifactTask)]
+        self.assertEqual(len(fetches), 1)
+        self.assertEqual(fetches[0].dest, constants.ARTIFACT_PATH)
+
+    def test_unpack(self):
+        self._launch()
+        unpack = tasks.generate_fetch_instance_access(self.job, self.location, key_dir='configuration')
+        self.assertIsInstance(unpack, ExecTask)
+        _run(unpack, self.root)
+
+        for directory in (constants.ARTIFACT_PATH, 'configuration'):
+            for name in constants.INSTANCE_ACCESS_FILES:
+                with open(os.path.join(self.root, directory, name)) as unpacked:
+                    self.assertEqual(unpacked.read(), name)
+            mode = stat.S_IMODE(os.stat(os.path.join(self.root, directory, 'key.pem')).st_mode)
+            self.assertEqual(mode, 0o600)
+
+
+class TestAnsibleOptions(unittest.TestCase):
+
+    def setUp(self):
+        configurator = GoCdConfigurator(FakeHostRestClient(empty_config_xml))
+        pipeline = configurator.ensure_pipeline_group('group').ensure_replacement_of_pipeline('app')
+        self.job = pipeline.ensure_stage('cleanup').ensure_job('cleanup_job')
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        os.mkdir(os.path.join(self.root, constants.PUBLIC_CONFIGURATION_DIR))
+
+        # An ansible-playbook that reports how it was called.
+        bin_dir = os.path.join(self.root, 'bin')
+        os.mkdir(bin_dir)
+        fake = os.path.join(bin_dir, 'ansible-playbook')
+        with open(fake, 'w') as script:
+            script.write('#!/bin/bash\necho "callback=$ANSIBLE_STDOUT_CALLBACK args=$*"\n')
+        os.chmod(fake, 0o755)
+        self.env = dict(os.environ, PATH=bin_dir + os.pathsep + os.environ['PATH'])
+
+    def _run_cleanup(self, verbosity=None, output=None):
+        job = self.job
+        tasks.ensure_ansible_options(job, verbosity, output)
+        env = dict(self.env, **{
+            variable: value for variable, value in job.environment_variables.items() if variable.startswith('ANSIBLE_')
+        })
+        return _run(tasks.generate_ami_cleanup(job), self.root, env)
+
+    def test_default(self):
+        output = self._run_cleanup()
+        self.assertIn('callback= args=-v --module-path', output)
+        self.assertIn(BuildArtifact(constants.ANSIBLE_OUTPUT_PATH), self.job.artifacts)
+
+    def test_verbosity(self):
+        self.assertIn('args=-vvv --module-path', self._run_cleanup(verbosity=3))
+        self.assertIn('args=--module-path', self._run_cleanup(verbosity=0))
+
+    def test_json_output(self):
+        output = self._run_cleanup(output='json')
+        self.assertNotIn('args=', output)
+        with open(os.path.join(self.root, constants.ANSIBLE_OUTPUT_PATH, 'cleanup.json')) as saved:
+            self.assertIn('callback=json args=-v', saved.read())
+
+    def test_unknown_output(self):
+        with self.assertRaisesRegexp(ValueError, 'ansible output must be one of'):
+            tasks.ensure_ansible_options(self.job, output='yaml')
+
+
+class TestAnsiblePlaybookCommand(unittest.TestCase):
+
+    def setUp(self):
+        configurator = GoCdConfigurator(FakeHostRestClient(empty_config_xml))
+        pipeline = configurator.ensure_pipeline_group('group').ensure_replacement_of_pipeline('app')
+        self.job = pipeline.ensure_stage('play').ensure_job('play_job')
+
+    def test_local(self):
+        command = tasks.ansible_playbook_command(self.job, 'play', 'play.yml', ['a=1', '@vars.yml'])
+        self.assertTrue(command.endswith(
+            'ansible-playbook $ANSIBLE_VERBOSITY_FLAGS --module-path=playbooks/library -i "localhost," -c local '
+            '-e a=1 -e @vars.yml play.yml'
+        ))
+        self.assertNotIn('ANSIBLE_SSH_ARGS', command)
+
+    def test_inventory(self):
+        command = tasks.ansible_playbook_command(
+            self.job, 'play', 'play.yml', inventory='target/inventory', private_key='target/key.pem',
+            module_path=None, root='../..',
+        )
+        self.assertIn('ControlPersist', command)
+        self.assertIn('PRIVATE_KEY=`/bin/pwd`/../../target/key.pem;', command)
+        self.assertTrue(command.endswith(
+            'ansible-playbook $ANSIBLE_VERBOSITY_FLAGS -i ../../target/inventory --private-key=$PRIVATE_KEY '
+            '--user=ubuntu play.yml'
+        ))
+        self.assertNotIn(BuildArtifact(constants.ANSIBLE_FACT_CACHE_PATH), self.job.artifacts)
+
+    def test_fact_cache(self):
+        command = tasks.ansible_playbook_command(
+            self.job, 'play', 'play.yml', inventory='target/inventory', private_key='target/key.pem',
+            fact_cache=True,
+        )
+        self.assertIn('ANSIBLE_GATHERING=smart ANSIBLE_CACHE_PLUGIN=jsonfile', command)
+        self.assertIn(BuildArtifact(constants.ANSIBLE_FACT_CACHE_PATH), self.job.artifacts)
+
+    def test_options(self):
+        tasks.ensure_ansible_options(self.job, pipelining=True, forks=20, strategy='free')
+        self.assertEqual(
+            {
+                variable: value for variable, value in self.job.environment_variables.items()
+                if variable.startswith('ANSIBLE_')
+            },
+            {'ANSIBLE_PIPELINING': 'True', 'ANSIBLE_FORKS': '20', 'ANSIBLE_STRATEGY': 'free'},
+        )
+
+
+class TestFetchSecureRepo(unittest.TestCase):
+
+    def setUp(self):
+        configurator = GoCdConfigurator(FakeHostRestClient(empty_config_xml))
+        pipeline = configurator.ensure_pipeline_group('group').ensure_replacement_of_pipeline('app')
+        self.job = pipeline.ensure_stage('play').ensure_job('play_job')
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.agent = os.path.join(self.root, 'agent')
+
+        # The secure repo, with two commits on master.
+        origin = os.path.join(self.root, 'origin')
+        subprocess.check_output(['git', 'init', '--quiet', '-b', 'master', origin])
+        self.shas = []
+        for number in range(2):
+            self._git(origin, 'commit', '--allow-empty', '-m', str(number))
+            self.shas.append(self._git(origin, 'rev-parse', 'HEAD').strip())
+
+        os.makedirs(os.path.join(self.agent, 'tubular', 'scripts'))
+        with open(os.path.join(self.agent, 'tubular', 'scripts', 'format_rsa_key.py'), 'w') as script:
+            script.write('')
+        self.env = dict(
+            os.environ, CONFIGURATION_SECURE_REPO='file://' + origin, CONFIGURATION_SECURE_VERSION='master',
+        )
+        self.env.pop('EDX_GIT_REFERENCE_CACHE', None)
+
+    def _git(self, directory, *args):
+        return subprocess.check_output(
+            ['git', '-c', 'user.name=edx', '-c', 'user.email=edx@example.com'] + list(args), cwd=directory
+        )
+
+    def _fetch(self, **env):
+        _run(tasks.fetch_secure_configuration(self.job, 'secure'), self.agent, dict(self.env, **env))
+        with open(os.path.join(self.agent, constants.ARTIFACT_PATH, 'configuration-secure_sha')) as sha:
+            return sha.read().strip()
+
+    def test_shallow(self):
+        self.assertEqual(self._fetch(), self.shas[-1])
+        self.assertTrue(os.path.exists(os.path.join(self.agent, 'secure', '.git', 'shallow')))
+
+    def test_unadvertised_sha(self):
+        # Servers that only serve the heads of branches and tags need the whole history fetched.
+        sha = self._fetch(CONFIGURATION_SECURE_VERSION=self.shas[0], GIT_CONFIG_PARAMETERS="'protocol.version=0'")
+        self.assertEqual(sha, self.shas[0])
+        self.assertFalse(os.path.exists(os.path.join(self.agent, 'secure', '.git', 'shallow')))
+
+    def test_reference_cache(self):
+        cache = os.path.join(self.root, 'cache')
+        self.assertEqual(self._fetch(EDX_GIT_REFERENCE_CACHE=cache), self.shas[-1])
+        reference = os.path.join(cache, 'configuration-secure.git')
+        self.assertEqual(self._git(reference, 'rev-parse', 'master').strip(), self.shas[-1])
+        with open(os.path.join(self.agent, 'secure', '.git', 'objects', 'info', 'alternates')) as alternates:
+            self.assertEqual(alternates.read().strip(), os.path.join(reference, 'objects'))
+
+
+class TestVirtualenvInstall(unittest.TestCase):
+
+    def setUp(self):
+        configurator = GoCdConfigurator(FakeHostRestClient(empty_config_xml))
+        pipeline = configurator.ensure_pipeline_group('group').ensure_pipeline('app')
+        self.job = pipeline.ensure_stage('stage').ensure_job('job')
+
+    def _installs(self):
+        return [
+            virtualenvs.installed_dirs(task) for task in self.job.element.findall('tasks/exec')
+            if virtualenvs.installed_dirs(task) is not None
+        ]
+
+    def test_single_virtualenv(self):
+        tasks.generate_virtualenv_install(self.job, ['tubular'])
+        self.job.add_task(ExecTask(['/bin/bash', '-c', 'python scripts/asgard-deploy.py'], working_dir='tubular'))
+        tasks.generate_virtualenv_install(self.job, ['configuration', 'tubular'])
+
+        self.assertEqual(self._installs(), [['tubular', 'configuration']])
+        self.assertEqual(len(self.job.tasks), 2)
+
+
+class TestAmiReuse(unittest.TestCase):
+
+    def setUp(self):
+        configurator = GoCdConfigurator(FakeHostRestClient(empty_config_xml))
+        self.pipeline = configurator.ensure_pipeline_group('group').ensure_replacement_of_pipeline('app_B')
+        self.job = self.pipeline.ensure_stage('find').ensure_job('find_job')
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.target = os.path.join(self.root, constants.ARTIFACT_PATH)
+
+        # An aws cli that finds $FAKE_AMI_ID, if it's set, and logs how it was called.
+        bin_dir = os.path.join(self.root, 'bin')
+        os.mkdir(bin_dir)
+        fake = os.path.join(bin_dir, 'aws')
+        with open(fake, 'w') as script:
+            script.write('#!/bin/bash\necho "$*" >> "$FAKE_AWS_LOG"\necho "${FAKE_AMI_ID:-None}"\n')
+        os.chmod(fake, 0o755)
+        self.log = os.path.join(self.root, 'aws.log')
+        self.env = dict(
+            os.environ, PATH=bin_dir + os.pathsep + os.environ['PATH'], FAKE_AWS_LOG=self.log,
+            PLAY='edxapp', GO_REVISION_EDX_PLATFORM='1' * 40, GO_REVISION_TUBULAR='2' * 40,
+        )
+
+    def _read(self, file_name):
+        with open(os.path.join(self.target, file_name)) as artifact:
+            return artifact.read()
+
+    def _find(self, **env):
+        _run(tasks.generate_find_reusable_ami(self.job), self.root, dict(self.env, **env))
+        lines = self._read(constants.AMI_REUSE_FILENAME).splitlines()
+        return dict((key, value.strip()) for key, value in (line.split(':', 1) for line in lines))
+
+    def test_fingerprint(self):
+        reuse = self._find()
+        self.assertEqual(reuse['ami_id'], '')
+        self.assertIn('Name=tag:{},Values={}'.format(constants.AMI_FINGERPRINT_TAG, reuse['fingerprint']), open(self.log).read())
+        self.assertEqual(self._find(GO_REVISION_TUBULAR='3' * 40), reuse)
+        self.assertNotEqual(self._find(GO_REVISION_EDX_PLATFORM='3' * 40)['fingerprint'], reuse['fingerprint'])
+
+    def test_build_config(self):
+        fingerprints = set()
+        for theme_version in ('release', 'release', 'master'):
+            configurator = GoCdConfigurator(FakeHostRestClient(empty_config_xml))
+            pipeline = configurator.ensure_pipeline_group('group').ensure_replacement_of_pipeline('app_B')
+            stages.generate_find_reusable_ami(pipeline)
+            stages.generate_run_play(
+                pipeline, 'playbooks/edx-east/edxapp.yml', 'edxapp', 'edx', 'stage', 'https://github.com/edx/edx-platform',
+                edxapp_theme_version=theme_version,
+            )
+            stages.skip_build_when_ami_reused(pipeline, [constants.RUN_PLAY_STAGE_NAME])
+            job = pipeline.ensure_stage(constants.FIND_REUSABLE_AMI_STAGE_NAME).jobs[0]
+            _run(job.tasks[-1], self.root, dict(self.env, **job.environment_variables))
+            fingerprints.add(self._read(constants.AMI_REUSE_FILENAME))
+        # The same config gives the same fingerprint, and changing a play option changes it.
+        self.assertEqual(len(fingerprints), 2)
+
+    def test_reuse(self):
+        self._find(FAKE_AMI_ID='ami-1234')
+        _run(tasks.generate_record_ami_fingerprint(self.job), self.root, self.env)
+        self.assertEqual(self._read(constants.BUILD_AMI_FILENAME), 'ami_id: ami-1234\n')
+        self.assertNotIn('create-tags', open(self.log).read())
+
+    def test_tag_built_ami(self):
+        fingerprint = self._find()['fingerprint']
+        with open(os.path.join(self.target, constants.BUILD_AMI_FILENAME), 'w') as ami:
+            ami.write('ami_id: ami-5678\n')
+        _run(tasks.generate_record_ami_fingerprint(self.job), self.root, self.env)
+        self.assertIn(
+            'create-tags --region us-east-1 --resources ami-5678 --tags Key={},Value={}'.format(
+                constants.AMI_FINGERPRINT_TAG, fingerprint
+            ),
+            open(self.log).read(),
+        )
+
+    def test_skipped_stage(self):
+        build_job = self.pipeline.ensure_stage('build').ensure_job('build_job')
+        build_job.ensure_artifacts(set([BuildArtifact('target/built')]))
+        build_job.add_task(ExecTask(['/bin/bash', '-c', 'echo built > ../target/built;'], working_dir='configuration'))
+        stages.skip_build_when_ami_reused(self.pipeline, ['build'])
+        self.assertIsInstance(build_job.tasks[0], FetchArtifactTask)
+        os.mkdir(os.path.join(self.root, 'configuration'))
+
+        for ami_id, built in (('ami-1234', ''), ('', 'built\n')):
+            shutil.rmtree(self.target, ignore_errors=True)
+            os.mkdir(self.target)
+            with open(os.path.join(self.target, constants.AMI_REUSE_FILENAME), 'w') as reuse:
+                reuse.write('fingerprint: abc\nami_id: {}\n'.format(ami_id))
+            for task in build_job.tasks[1:]:
+                _run(task, self.root, self.env)
+            self.assertEqual(self._read('built'), built)
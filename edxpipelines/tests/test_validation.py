@@ -0,0 +1,122 @@
+import unittest
+
+from ddt import ddt, data, unpack
+from gomatic import (
+    ExecTask, FetchArtifactFile, FetchArtifactTask, GitMaterial, GoCdConfigurator, PipelineMaterial, empty_config,
+)
+
+from edxpipelines import validation
+
+
+def _configurator():
+    configurator = GoCdConfigurator(empty_config())
+    group = configurator.ensure_pipeline_group('group')
+
+    upstream = group.ensure_pipeline('upstream')
+    upstream.ensure_material(GitMaterial('https://github.com/edx/tubular.git'))
+    upstream.ensure_stage('build').ensure_job('build_job').add_task(ExecTask(['make']))
+
+    downstream = group.ensure_pipeline('downstream')
+    downstream.ensure_material(PipelineMaterial('upstream', 'build'))
+    job = downstream.ensure_stage('deploy').ensure_job('deploy_job')
+    job.add_task(FetchArtifactTask('upstream', 'build', 'build_job', FetchArtifactFile('ami.yml')))
+    return configurator
+
+
+@ddt
+class TestValidation(unittest.TestCase):
+
+    def setUp(self):
+        self.configurator = _configurator()
+
+    def test_valid_config(self):
+        validation.validate_config(self.configurator.config)
+
+    def test_schema_errors(self):
+        group = self.configurator.ensure_pipeline_group('group')
+        group.ensure_pipeline('no_materials').ensure_stage('stage').ensure_job('job')
+        group.find_pipeline('upstream').ensure_stage('bad stage name').ensure_job('job')
+
+        errors = validation.schema_errors(self.configurator.config)
+        self.assertEqual(len(errors), 2)
+
+    def test_other_schema_errors_only_warned_about(self):
+        other = self.configurator.ensure_pipeline_group('other').ensure_pipeline('other')
+        other.ensure_material(GitMaterial('https://github.com/edx/tubular.git'))
+        other.ensure_stage('bad stage name').ensure_job('build_job').add_task(ExecTask(['make']))
+
+        warnings = validation.validate_config(self.configurator.config, pipelines={'upstream', 'downstream'})
+        self.assertEqual(len(warnings), 1)
+        self.assertTrue(warnings[0].startswith('pipeline group other, pipeline other: '))
+        with self.assertRaises(validation.ConfigValidationError):
+            validation.validate_config(self.configurator.config, pipelines={'other'})
+
+    def test_submodule_folder(self):
+        material = self.configurator.ensure_pipeline_group('group').find_pipeline('upstream').element.find(
+            'materials/git'
+        )
+        material.set('submoduleFolder', 'submodules')
+        self.assertEqual(validation.schema_errors(self.configurator.config), [])
+
+    def test_duplicate_pipeline_names(self):
+        other = self.configurator.ensure_pipeline_group('other').ensure_pipeline('upstream')
+        other.ensure_material(GitMaterial('https://github.com/edx/tubular.git'))
+        other.ensure_stage('build').ensure_job('build_job')
+
+        self.assertEqual(
+            validation.reference_errors(self.configurator.config),
+            ['pipeline upstream is defined more than once'],
+        )
+
+    @data(
+        ('missing', 'build', 'build_job'),
+        ('upstream', 'missing', 'build_job'),
+        ('upstream', 'build', 'missing'),
+    )
+    @unpack
+    def test_missing_fetch(self, pipeline, stage, job):
+        downstream = self.configurator.ensure_pipeline_group('group').find_pipeline('downstream')
+        downstream.ensure_stage('deploy').ensure_job('deploy_job').add_task(
+            FetchArtifactTask(pipeline, stage, job, FetchArtifactFile('ami.yml'))
+        )
+        with self.assertRaises(validation.ConfigValidationError) as context:
+            validation.validate_config(self.configurator.config)
+        self.assertEqual(len(context.exception.errors), 1)
+
+    def test_ancestor_fetch(self):
+        release = self.configurator.ensure_pipeline_group('group').ensure_pipeline('release')
+        release.ensure_material(PipelineMaterial('downstream', 'deploy'))
+        release.ensure_stage('release').ensure_job('release_job').add_task(
+            FetchArtifactTask('upstream/downstream', 'build', 'build_job', FetchArtifactFile('ami.yml'))
+        )
+        self.assertEqual(validation.reference_errors(self.configurator.config), [])
+
+    def test_missing_material_stage(self):
+        downstream = self.configurator.ensure_pipeline_group('group').find_pipeline('downstream')
+        downstream.ensure_material(PipelineMaterial('upstream', 'missing', 'other'))
+        self.assertEqual(
+            validation.reference_errors(self.configurator.config),
+            ['pipeline downstream: material refers to missing stage upstream/missing'],
+        )
+
+    def test_other_pipelines_only_warned_about(self):
+        other = self.configurator.ensure_pipeline_group('other').ensure_pipeline('other')
+        other.ensure_material(PipelineMaterial('upstream', 'missing'))
+        other.ensure_stage('build').ensure_job('build_job').add_task(ExecTask(['make']))
+
+        warnings = validation.validate_config(self.configurator.config, pipelines={'upstream', 'downstream'})
+        self.assertEqual(warnings, ['pipeline other: material refers to missing stage upstream/missing'])
+        with self.assertRaises(validation.ConfigValidationError):
+            validation.validate_config(self.configurator.config, pipelines={'other'})
+
+    def test_material_polling_conflict(self):
+        other = self.configurator.ensure_pipeline_group('other').ensure_pipeline('other')
+        other.ensure_material(GitMaterial('https://github.com/edx/tubular.git', polling=False))
+        other.ensure_stage('build').ensure_job('build_job').add_task(ExecTask(['make']))
+
+        message = 'material https://github.com/edx/tubular.git (master) is polled by upstream, but not by other'
+        with self.assertRaises(validation.ConfigValidationError) as context:
+            validation.validate_config(self.configurator.config, pipelines={'other'})
+        self.assertEqual(context.exception.errors, [message])
+        # Conflicts between pipelines the script didn't generate are only warned about.
+        self.assertEqual(validation.validate_config(self.configurator.config, pipelines={'downstream'}), [message])
@@ -0,0 +1,91 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from xml.etree import ElementTree
+
+from gomatic import GoCdConfigurator
+from gomatic.fake import FakeHostRestClient, empty_config_xml
+import yaml
+
+from edxpipelines.encryption import EncryptionCache, LocalEncrypter
+from edxpipelines import watch
+from edxpipelines.watch import BaseConfig, Watcher, generate, pipeline_differences
+
+VARIABLES = {
+    'pipeline_group': 'janitors', 'pipeline_name': 'asg_cleanup', 'cron_timer': '0 0 * * * ?',
+    'asgard_api_endpoints': 'https://asgard.example.com', 'asgard_token': 'token',
+    'aws_access_key_id': 'key', 'aws_secret_access_key': 'secret',
+}
+
+
+def _base(xml=empty_config_xml):
+    return BaseConfig(xml, LocalEncrypter(), EncryptionCache(), 'local')
+
+
+class TestWatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.variable_file = os.path.join(self.tempdir, 'variables.yml')
+        self._write_variables()
+        self.script = {'script': 'edxpipelines/pipelines/asg_cleanup.py', 'variable_file': [self.variable_file]}
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _write_variables(self, **overrides):
+        with open(self.variable_file, 'w') as variables:
+            yaml.safe_dump(dict(VARIABLES, **overrides), variables)
+
+    def _deployed(self):
+        """
+        A base config that already has the pipeline generated from the current variables.
+        """
+        configurator = GoCdConfigurator(FakeHostRestClient(empty_config_xml))
+        group = configurator.ensure_pipeline_group('janitors')
+        for _, xml in generate(self.script, _base()).values():
+            group.element.append(ElementTree.fromstring(xml))
+        return _base(configurator.config)
+
+    def test_new_pipeline(self):
+        lines = pipeline_differences(_base(), generate(self.script, _base()))
+        self.assertEqual(lines[0], 'pipeline asg_cleanup (janitors): pipeline added')
+
+    def test_unchanged_pipeline(self):
+        base = self._deployed()
+        self.assertEqual(pipeline_differences(base, generate(self.script, base)), [])
+
+    def test_changed_variables(self):
+        base = self._deployed()
+        output = []
+        watcher = Watcher(lambda: [self.script], os.path.join(self.tempdir, 'config.yml'), base, echo=output.append)
+
+        self._write_variables(cron_timer='0 30 * * * ?')
+        os.utime(self.variable_file, (0, 0))
+        self.assertEqual(watcher.check(), [self.script])
+        self.assertEqual(output[2], 'pipeline asg_cleanup (janitors): changed timer')
+        self.assertIn('+  <timer>0 30 * * * ?</timer>', output)
+        self.assertEqual(watcher.check(), [])
+
+        # The pipeline changed by the last run is put back as it is on the server first.
+        del output[:]
+        self._write_variables()
+        os.utime(self.variable_file, (1, 1))
+        self.assertEqual(watcher.check(), [self.script])
+        self.assertEqual(output[2], 'no changes')
+
+    def test_reloads_keep_one_generation(self):
+        # Put the modules of this process back afterwards, for the tests that run after this one.
+        modules = dict(sys.modules)
+        self.addCleanup(sys.modules.update, modules)
+        base = _base()
+        watcher = Watcher(lambda: [self.script], os.path.join(self.tempdir, 'config.yml'), base, echo=lambda line: None)
+        for _ in range(3):
+            watcher.regenerate([self.script])
+            names = [module.__name__ for module in watch._RETIRED_MODULES]
+            self.assertIn('edxpipelines.index', names)
+            self.assertEqual(len(names), len(set(names)))
+        # The encryption cache was made before the reloads, and still works.
+        self.assertIsNone(base.cache.get('local', 'value'))
@@ -0,0 +1,196 @@
+"""
+In-process validation of generated GoCD configurations.
+
+Checks the pipeline groups against the GoCD cruise-config schema, along with
+invariants the schema can't express, so that a bad config is rejected before
+it's sent to the server, with every problem reported at once.
+
+The schema (schema/pipelines.xsd) is a hand-written subset of the cruise-config
+schema, covering only the pipeline groups, and is looser or stricter than the
+server's in places:
+
+* templates, environments, agents and the server section aren't checked.
+* svn, hg, p4, tfs, package and scm materials, ant, nant, rake and pluggable
+  tasks, tracking tools and job properties accept any content.
+* ``#{param}`` references are only checked against the name pattern, not
+  against the params that are defined.
+* attributes added after schema version 72 (such as git ``username`` and
+  ``password``) are rejected.
+
+Since the server config also holds hand-made pipelines, only problems in the
+pipelines being generated are errors; problems elsewhere are warnings.
+"""
+import os.path
+import re
+
+import lxml.etree as ElementTree
+
+from edxpipelines.canonicalize import PARSER
+from edxpipelines.consistency import SystemIndex
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), 'schema', 'pipelines.xsd')
+_SCHEMA = []
+
+
+class ConfigValidationError(Exception):
+    def __init__(self, errors):
+        super(ConfigValidationError, self).__init__(
+            'Generated config is invalid:\n' + '\n'.join('  ' + error for error in errors)
+        )
+        self.errors = errors
+
+
+def _schema():
+    if not _SCHEMA:
+        _SCHEMA.append(ElementTree.XMLSchema(ElementTree.parse(SCHEMA_PATH)))
+    return _SCHEMA[0]
+
+
+def _root(config):
+    if isinstance(config, basestring):
+        return ElementTree.fromstring(config, parser=PARSER)
+    elif isinstance(config, ElementTree._ElementTree):
+        return config.getroot()
+    return config
+
+
+def _schema_problems(config):
+    """
+    Yield (pipeline group element, pipeline name or None, message) for each schema violation in ``config``.
+    """
+    schema = _schema()
+    for group in _root(config).findall('pipelines'):
+        if schema.validate(group):
+            continue
+        pipelines = group.findall('pipeline')
+        for error in schema.error_log:
+            # Invalid values are reported a second time by the uniqueness constraints; skip the repeats.
+            if 'No precomputed value' in error.message:
+                continue
+            match = re.match(r'/pipelines/pipeline(?:\[(\d+)\])?', error.path or '')
+            name = pipelines[int(match.group(1) or 1) - 1].get('name') if match else None
+            yield group, name, error.message
+
+
+def _in_pipelines(group, name, pipelines):
+    """
+    Whether a schema violation concerns ``pipelines``: it's in one of them, or in the
+    group-level settings of a group that holds one of them.
+    """
+    if pipelines is None:
+        return True
+    if name is not None:
+        return name in pipelines
+    return any(pipeline.get('name') in pipelines for pipeline in group.findall('pipeline'))
+
+
+def _format_problem(group, name, message):
+    location = 'pipeline group {}'.format(group.get('group'))
+    if name is not None:
+        location += ', pipeline {}'.format(name)
+    return '{}: {}'.format(location, message)
+
+
+def schema_errors(config, pipelines=None):
+    """
+    Check the pipeline groups in ``config`` against the GoCD schema.
+
+    Args:
+        config (str, lxml tree or element): the cruise-config xml
+        pipelines (set of str): only report the violations in these pipelines, and in the
+            groups that hold them (all of them by default)
+
+    Returns:
+        list of str: the schema violations
+    """
+    return [
+        _format_problem(group, name, message)
+        for group, name, message in _schema_problems(config)
+        if _in_pipelines(group, name, pipelines)
+    ]
+
+
+def reference_errors(config, pipelines=None):
+    """
+    Check invariants of ``config`` that span pipelines: pipeline names are
+    unique across all groups, and every pipeline material and fetch artifact
+    task refers to a stage and job that exist.
+
+    Args:
+        config (str, lxml tree or element): the cruise-config xml
+        pipelines (set of str): only check the references made by these pipelines (all of them by default)
+
+    Returns:
+        list of str: the invariant violations
+    """
+    return SystemIndex.from_configs([_root(config)]).errors(pipelines)
+
+
+def material_errors(config, pipelines=None):
+    """
+    Check that every copy of a git material (with the same url and branch) in ``config`` has the same
+    autoUpdate setting, as GoCD requires. Scripts set the polling of the shared materials from their own
+    variables (see edxpipelines.materials), so they can disagree with the pipelines of other scripts.
+
+    Args:
+        config (str, lxml tree or element): the cruise-config xml
+        pipelines (set of str): only check the materials that these pipelines have a copy of
+            (all of them by default)
+
+    Returns:
+        list of str: the conflicting materials
+    """
+    copies = {}
+    for pipeline in _root(config).iterfind('pipelines/pipeline'):
+        for material in pipeline.iterfind('materials/git'):
+            key = (material.get('url'), material.get('branch', 'master'))
+            copies.setdefault(key, {}).setdefault(material.get('autoUpdate', 'true'), set()).add(pipeline.get('name'))
+
+    errors = []
+    for (url, branch), settings in sorted(copies.items()):
+        if len(settings) < 2:
+            continue
+        if pipelines is not None and not set.union(*settings.values()) & set(pipelines):
+            continue
+        errors.append('material {} ({}) is polled by {}, but not by {}'.format(
+            url, branch, ', '.join(sorted(settings['true'])), ', '.join(sorted(settings['false'])),
+        ))
+    return errors
+
+
+def validate_config(config, check_references=True, pipelines=None):
+    """
+    Validate a generated config.
+
+    Args:
+        config (str, lxml tree or element): the cruise-config xml
+        check_references (bool): whether to check references between pipelines, and that
+            the copies of each material agree. This needs the complete server config.
+        pipelines (set of str): the pipelines that were generated, if ``config`` also
+            holds others. Schema violations in, broken references made by and material
+            conflicts between the other pipelines aren't the generator's doing, so they
+            are returned as warnings instead of raised.
+
+    Returns:
+        list of str: the warnings
+
+    Raises:
+        ConfigValidationError: listing every problem found
+    """
+    root = _root(config)
+    errors = []
+    warnings = []
+    for group, name, message in _schema_problems(root):
+        problems = errors if _in_pipelines(group, name, pipelines) else warnings
+        problems.append(_format_problem(group, name, message))
+    if check_references:
+        index = SystemIndex.from_configs([root])
+        errors.extend(index.errors(pipelines))
+        conflicts = material_errors(root, pipelines)
+        errors.extend(conflicts)
+        if pipelines is not None:
+            warnings.extend(index.errors(set(index.pipelines) - set(pipelines)))
+            warnings.extend(conflict for conflict in material_errors(root) if conflict not in conflicts)
+    if errors:
+        raise ConfigValidationError(errors)
+    return warnings
@@ -0,0 +1,86 @@
+"""
+The virtualenvs that jobs install their python requirements into (see
+``patterns.tasks.generate_virtualenv_install``).
+
+The bash tasks of a job activate its virtualenv through BASH_ENV, which names
+one activation script per job, so each job has a single virtualenv: installing
+more requirements in a job adds them to the job's one install task, rather than
+replacing the virtualenv that its earlier tasks installed. Fused jobs (see
+``edxpipelines.optimize``) combine their installs the same way.
+"""
+import re
+
+from edxpipelines import constants
+
+_DIRS = re.compile(r'for dir in ([^;]*);')
+
+
+def install_command(working_dirs):
+    """
+    The bash command that builds (or reuses, from the agent's cache) a virtualenv with the requirements.txt
+    of each of ``working_dirs`` installed, in order, and activates it for the rest of the job.
+    """
+    dirs = ' '.join(working_dirs)
+    find_links = '${EDX_WHEELHOUSE:+--find-links "$EDX_WHEELHOUSE"}'
+    return '; '.join([
+        'set -e',
+        'ROOT=`/bin/pwd`',
+        'CACHE="{}"'.format(constants.VIRTUALENV_CACHE_DIR),
+        'mkdir -p "$CACHE/activate"',
+        'KEY=$({{ python -V 2>&1; for dir in {dirs}; do echo "$dir"; '
+        'cat "$dir"/requirements.txt "$dir"/requirements/*.txt 2>/dev/null || true; done; }} '
+        '| sha1sum | cut -c1-16)'.format(dirs=dirs),
+        'VENV="$CACHE/venv-$KEY"',
+        # Jobs on other agents sharing the cache wait for the virtualenv to be built, rather than build it too.
+        'exec 9>"$VENV.lock"',
+        'flock 9',
+        'if [ ! -e "$VENV/.complete" ]; then rm -rf "$VENV"; virtualenv --quiet "$VENV"; '
+        'for dir in {dirs}; do (cd "$dir" && "$VENV/bin/pip" install --quiet {find_links} -r requirements.txt); '
+        'done; touch "$VENV/.complete"; fi'.format(dirs=dirs, find_links=find_links),
+        'flock -u 9',
+        'touch "$VENV"',
+        'echo "export VIRTUAL_ENV=$VENV PATH=$VENV/bin:\\$PATH" > "{}"'.format(constants.VIRTUALENV_ACTIVATE_SCRIPT),
+        'find "$CACHE" "$CACHE/activate" -maxdepth 1 -mtime +{} \\( -name "venv-*" -o -name "*.sh" \\) '
+        '-exec rm -rf {{}} +'.format(constants.VIRTUALENV_CACHE_DAYS),
+    ])
+
+
+def installed_dirs(task):
+    """
+    The directories whose requirements ``task`` (an exec task element) installs into a virtualenv,
+    or None if it isn't a virtualenv install. The install command can be part of a longer one.
+    """
+    if task.tag != 'exec' or task.get('command') != '/bin/bash':
+        return None
+    args = [arg.text or '' for arg in task.findall('arg')]
+    if len(args) != 2 or install_command([])[:40] not in args[1]:
+        return None
+    match = _DIRS.search(args[1])
+    return match.group(1).split() if match else None
+
+
+def install_task(job):
+    """
+    The virtualenv install task element of ``job`` (a job element), or None if it has none.
+    """
+    for task in job.findall('tasks/exec'):
+        if installed_dirs(task) is not None:
+            return task
+    return None
+
+
+def add_requirements(job, working_dirs):
+    """
+    Install the requirements of ``working_dirs`` in the virtualenv of ``job`` (a job element), after
+    the ones it already installs.
+
+    Returns:
+        Element: the job's install task, or None if it has none (and nothing was added)
+    """
+    task = install_task(job)
+    if task is not None:
+        dirs = installed_dirs(task)
+        dirs.extend(working_dir for working_dir in working_dirs if working_dir not in dirs)
+        arg = task.findall('arg')[1]
+        arg.text = _DIRS.sub('for dir in {};'.format(' '.join(dirs)), arg.text)
+    return task
@@ -0,0 +1,378 @@
+"""
+Regenerate pipelines as their sources change, and show how they differ from the server.
+
+``deploy_pipelines.py --watch`` keeps one process running that polls
+``edxpipelines/``, config.yml and the variable files of every script. When
+files change, only the scripts affected by them (see ``edxpipelines.selection``)
+are run again, in-process, against a base config that was read once at start.
+For each pipeline that the scripts generate, a summary of what changed (see
+``edxpipelines.snapshots``) and a diff of its canonical xml against the base
+config are printed.
+"""
+from collections import OrderedDict
+import difflib
+import imp
+import importlib
+import os
+import sys
+import time
+import traceback
+from xml.etree import ElementTree as StdlibElementTree
+
+import click
+import lxml.etree as ElementTree
+
+from edxpipelines import selection, snapshots
+from edxpipelines.canonicalize import PARSER, canonicalize_element
+
+POLL_INTERVAL = 0.2
+SOURCE_DIR = 'edxpipelines'
+# Modules that stay loaded while watching: this one, and the modules it imports. Every other
+# edxpipelines module is imported again after a source change, so that the scripts use the new code.
+PERSISTENT_MODULES = (
+    'edxpipelines', __name__, 'edxpipelines.canonicalize', 'edxpipelines.dependencies',
+    'edxpipelines.selection', 'edxpipelines.snapshots',
+)
+# The modules replaced by the latest imports. Python 2 clears the globals of a module when it's
+# deleted, which would break objects still using the old code, so the previous generation is kept
+# until the next reload (and BaseConfig keeps the modules of its own objects).
+_RETIRED_MODULES = []
+
+
+def _canonical_pipeline(xml):
+    return canonicalize_element(ElementTree.fromstring(xml, parser=PARSER))
+
+
+def _pipeline_lines(element):
+    return ElementTree.tostring(element, pretty_print=True).splitlines()
+
+
+def script_variables(script):
+    """
+    The variables of a config.yml script entry, merged as the pipeline scripts merge them.
+
+    Returns:
+        (dict, dict): the variables, and the variables for each environment
+    """
+    utils = importlib.import_module('edxpipelines.utils')
+    variable_files = list(script.get('variable_file', []))
+    env_files = OrderedDict()
+    for environment, path in script.get('env-variable-file', []):
+        env_files.setdefault(environment, []).append(path)
+    config = utils.merge_files_and_dicts(variable_files, [])
+    env_configs = {
+        environment: utils.merge_files_and_dicts(variable_files + files, [])
+        for environment, files in env_files.items()
+    }
+    return config, env_configs
+
+
+class BaseConfig(object):
+    """
+    The server config that scripts are run against, and its pipelines in canonical form.
+
+    The config is parsed into a gomatic configurator once. Scripts are run
+    against that configurator, which is then kept warm: before each run, the
+    pipelines changed by earlier runs are put back as they are in ``xml``.
+
+    Args:
+        xml (str): the cruise-config xml
+        encrypter: anything with an ``encrypt(value)`` method, used for secure variables
+        cache (EncryptionCache): previously encrypted values
+        identity (str): the identity of the cipher of ``encrypter``
+        configurator (GoCdConfigurator): a configurator already holding ``xml``, if there is one
+    """
+    def __init__(self, xml, encrypter, cache, identity, configurator=None):
+        self.xml = xml
+        self.encrypter = encrypter
+        self.cache = cache
+        self.identity = identity
+        self._configurator = configurator
+        # The modules that the encrypter and cache were made with, which outlive any reloads.
+        self._modules = [sys.modules[type(obj).__module__] for obj in (encrypter, cache)]
+        # Pipeline name -> group name, for every pipeline changed by a script since it was last reset.
+        self._changed = OrderedDict()
+        self._pipelines = None
+        self._canonical = {}
+
+    def _base_pipelines(self):
+        """
+        Pipeline name -> (group name, position in the group, lxml element), from ``xml``.
+        """
+        if self._pipelines is None:
+            root = ElementTree.fromstring(self.xml, parser=PARSER)
+            self._pipelines = {
+                pipeline.get('name'): (group.get('group'), group.index(pipeline), pipeline)
+                for group in root.iterfind('pipelines')
+                for pipeline in group.iterfind('pipeline')
+            }
+        return self._pipelines
+
+    def pipeline(self, name):
+        """
+        The group and canonical element of the pipeline called ``name``, or (None, None).
+        """
+        if name not in self._base_pipelines():
+            return None, None
+        if name not in self._canonical:
+            # Each pipeline is only canonicalized the first time it's compared.
+            group, _, element = self._base_pipelines()[name]
+            self._canonical[name] = (group, canonicalize_element(element))
+        return self._canonical[name]
+
+    def configurator(self):
+        """
+        The gomatic configurator holding the base config, with the changes of any earlier runs undone.
+        """
+        if self._configurator is None:
+            gomatic = importlib.import_module('gomatic')
+            fake = importlib.import_module('gomatic.fake')
+            self._configurator = gomatic.GoCdConfigurator(fake.FakeHostRestClient(self.xml))
+
+        partial = importlib.import_module('edxpipelines.partial')
+        partial.restore_pipelines(self._configurator, self._changed, self._original)
+        self._changed.clear()
+        return self._configurator
+
+    def _original(self, name):
+        """
+        The group, position and a fresh stdlib copy of the base pipeline called ``name``, or None.
+        """
+        if name not in self._base_pipelines():
+            return None
+        group_name, position, element = self._base_pipelines()[name]
+        return group_name, position, StdlibElementTree.fromstring(ElementTree.tostring(element))
+
+    def record_changes(self, pipelines):
+        """
+        Note the ``pipelines`` (name -> group) that a script changed, so that they can be undone.
+        """
+        self._changed.update(pipelines)
+
+
+def pipeline_differences(base, generated):
+    """
+    Describe how the pipelines generated by a script differ from the base config.
+
+    Args:
+        base (BaseConfig): the base config
+        generated (OrderedDict): pipeline name -> (group name, generated xml, or None if it was removed)
+
+    Returns:
+        list of str: the lines to show
+    """
+    lines = []
+    for name, (group, xml) in generated.items():
+        base_group, base_element = base.pipeline(name)
+        element = _canonical_pipeline(xml) if xml is not None else None
+        if element is None and base_element is None:
+            continue
+        expected = {name: snapshots.pipeline_snapshot(base_group, base_element)} if base_element is not None else {}
+        actual = {name: snapshots.pipeline_snapshot(group, element)} if element is not None else {}
+        changes = snapshots.diff_snapshots(expected, actual).get(name)
+        if not changes:
+            continue
+        lines.append('pipeline {} ({}): {}'.format(name, group or base_group, '; '.join(changes)))
+        if base_group is not None and group is not None and base_group != group:
+            lines.append('  moved from group {} to {}'.format(base_group, group))
+        lines.extend(difflib.unified_diff(
+            _pipeline_lines(base_element) if base_element is not None else [],
+            _pipeline_lines(element) if element is not None else [],
+            'base/{}'.format(name), 'generated/{}'.format(name), lineterm='',
+        ))
+    return lines
+
+
+def generate(script, base):
+    """
+    Run a config.yml script entry against ``base``, in this process.
+
+    Returns:
+        OrderedDict: pipeline name -> (group name, xml of the pipeline, or None if the script removed it)
+    """
+    encryption = importlib.import_module('edxpipelines.encryption')
+    index = importlib.import_module('edxpipelines.index')
+    optimize = importlib.import_module('edxpipelines.optimize')
+
+    config, env_configs = script_variables(script)
+    # A fresh index over the warm configurator, built with the current version of the index module.
+    configurator = index.IndexedConfigurator(base.configurator())
+    try:
+        module_name = 'watched_' + os.path.splitext(os.path.basename(script['script']))[0]
+        imp.load_source(module_name, script['script']).install_pipelines(configurator, config, env_configs)
+        optimize.optimize_pipelines(configurator)
+        encryption.encrypt_secure_variables(configurator, base.encrypter, base.cache, base.identity)
+    finally:
+        base.record_changes(configurator.changed_pipelines)
+
+    groups = {group.name: group for group in configurator.pipeline_groups}
+    generated = OrderedDict()
+    for name, group_name in configurator.changed_pipelines.items():
+        generated[name] = (group_name, None)
+        for group in groups.values():
+            if group.has_pipeline(name):
+                pipeline = group.find_pipeline(name)
+                # As gomatic does for the whole config, when it's saved.
+                pipeline.reorder_elements_to_please_go()
+                generated[name] = (group.name, StdlibElementTree.tostring(pipeline.element))
+                break
+    return generated
+
+
+def load_base_config(script, base_config_file=None, encryption_cache_path=None):
+    """
+    Read the config to run scripts against, from a file or from the GoCD server.
+
+    The server (and credentials) are those of the config.yml ``script`` entry,
+    unless ``GOCD_URL`` is set. Secure variables are encrypted by the server,
+    with the ciphertexts cached in ``encryption_cache_path``, keyed with the
+    script's GoCD credentials. When the config is read from a file, cached
+    ciphertexts are still used, but values that aren't cached are encrypted
+    with a local stand-in, and never saved to the cache.
+
+    Returns:
+        BaseConfig: the config
+    """
+    gomatic = importlib.import_module('gomatic')
+    fake = importlib.import_module('gomatic.fake')
+    encryption = importlib.import_module('edxpipelines.encryption')
+    script_module = importlib.import_module('edxpipelines.pipelines.script')
+
+    config, _ = script_variables(script)
+    host, ssl = script_module.gocd_host(os.environ.get('GOCD_URL') or config['gocd_url'])
+    # The cache is keyed with the GoCD credentials, so without them it is only kept in memory.
+    secret = None
+    if config.get('gocd_username') and config.get('gocd_password'):
+        secret = encryption.credentials_secret(config['gocd_username'], config['gocd_password'])
+    cache = encryption.EncryptionCache(encryption_cache_path, secret)
+    if base_config_file is None:
+        configurator = gomatic.GoCdConfigurator(gomatic.HostRestClient(
+            host, config['gocd_username'], config['gocd_password'], ssl=ssl,
+        ))
+        encrypter = encryption.GoCdEncrypter(host, config['gocd_username'], config['gocd_password'], ssl=ssl)
+    else:
+        with open(base_config_file) as config_file:
+            configurator = gomatic.GoCdConfigurator(fake.FakeHostRestClient(config_file.read()))
+        encrypter = encryption.LocalEncrypter()
+        cache.path = None
+    identity = encryption.cipher_identity(host, configurator)
+    return BaseConfig(configurator.config, encrypter, cache, identity, configurator)
+
+
+def script_label(script):
+    """
+    A name for a config.yml script entry, telling apart entries for the same script.
+    """
+    variable_files = selection.variable_files(script)
+    if not variable_files:
+        return script['script']
+    return '{} ({})'.format(script['script'], os.path.basename(variable_files[-1]))
+
+
+class Watcher(object):
+    """
+    Polls the sources and variable files of some scripts, and regenerates the scripts affected by each change.
+
+    Args:
+        load_scripts (callable): returns the config.yml script entries to watch
+        config_file (str): the config.yml they were read from, which is watched too
+        base (BaseConfig): the config to run the scripts against
+        root (str): the repository root
+        echo (callable): prints a line
+    """
+    def __init__(self, load_scripts, config_file, base, root='.', echo=click.echo):
+        self.load_scripts = load_scripts
+        self.config_file = os.path.normpath(config_file)
+        self.base = base
+        self.root = root
+        self.echo = echo
+        self.scripts = load_scripts()
+        self.mtimes = self._mtimes()
+
+    def _watched_files(self):
+        for directory, subdirectories, files in os.walk(os.path.join(self.root, SOURCE_DIR)):
+            subdirectories[:] = [name for name in subdirectories if name not in ('tests', 'benchmarks')]
+            for name in files:
+                if name.endswith(('.py', '.yml', '.xsd')):
+                    yield os.path.relpath(os.path.join(directory, name), self.root)
+        yield self.config_file
+        for script in self.scripts:
+            for path in selection.variable_files(script):
+                yield os.path.normpath(path)
+
+    def _mtimes(self):
+        mtimes = {}
+        for path in set(self._watched_files()):
+            try:
+                mtimes[path] = os.path.getmtime(os.path.join(self.root, path))
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    def changed_files(self):
+        """
+        The watched files that changed, appeared or disappeared since the last call.
+        """
+        mtimes = self._mtimes()
+        changed = {path for path in set(mtimes) | set(self.mtimes) if mtimes.get(path) != self.mtimes.get(path)}
+        self.mtimes = mtimes
+        return changed
+
+    def regenerate(self, scripts, reload_modules=True):
+        """
+        Run ``scripts`` again, and print how their pipelines differ from the base config.
+
+        Args:
+            reload_modules (bool): whether to import the edxpipelines modules again first
+        """
+        if reload_modules:
+            retired = [
+                sys.modules.pop(name) for name in list(sys.modules)
+                if name.startswith('edxpipelines.') and name not in PERSISTENT_MODULES
+            ]
+            # Python 2 also caches failed relative imports, as None.
+            _RETIRED_MODULES[:] = [module for module in retired if module is not None]
+
+        for script in scripts:
+            start = time.time()
+            try:
+                lines = pipeline_differences(self.base, generate(script, self.base))
+            except Exception:  # pylint: disable=broad-except
+                lines = traceback.format_exc().splitlines()
+            self.echo(click.style('== {} ({:.2f}s)'.format(script_label(script), time.time() - start), bold=True))
+            for line in lines or ['no changes']:
+                self.echo(line)
+
+    def check(self):
+        """
+        Regenerate the scripts affected by any changes since the last check.
+
+        Returns:
+            list of dict: the script entries that were regenerated
+        """
+        changed = self.changed_files()
+        if not changed:
+            return []
+        if self.config_file in changed:
+            self.scripts = self.load_scripts()
+            # The variable files of the new entries are watched from now on.
+            self.mtimes = self._mtimes()
+            affected = self.scripts
+        else:
+            affected = selection.affected_scripts(self.scripts, changed, self.root)
+        self.echo(click.style('Changed: {}'.format(', '.join(sorted(changed))), fg='yellow'))
+        self.regenerate(affected, reload_modules=any(path.endswith('.py') for path in changed))
+        return affected
+
+    def run(self):
+        """
+        Show the differences of every script, then keep regenerating them as files change, until interrupted.
+        """
+        self.regenerate(self.scripts)
+        self.echo('Watching {} files for changes'.format(len(self.mtimes)))
+        try:
+            while True:
+                time.sleep(POLL_INTERVAL)
+                self.check()
+        except KeyboardInterrupt:
+            pass